@@ -1,7 +1,7 @@
 import streamlit as st
-import os
-import tempfile
 from rag_chatbot import SimpleRAGBot  # импортируем наш класс из консольной версии
+from search_filters import SearchFilter, parse_page_ranges
+from sentence_index import snippet
 
 # Настройка страницы
 st.set_page_config(page_title="RAG Чат-бот", page_icon="📚")
@@ -10,7 +10,7 @@ st.title("📚 Чат-бот по конспектам")
 # Инициализация бота
 @st.cache_resource
 def init_bot():
-    return SimpleRAGBot()
+    return SimpleRAGBot(warm_up=True)
 
 bot = init_bot()
 
@@ -20,15 +20,24 @@ with st.sidebar:
     uploaded_file = st.file_uploader("Выберите PDF файл", type=['pdf'])
     
     if uploaded_file:
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-            tmp_file.write(uploaded_file.getvalue())
-            tmp_path = tmp_file.name
-        
         if st.button("Обработать PDF"):
+            # Разбор прямо из памяти, без временного файла; повторная загрузка того же файла ничего не делает
+            progress_bar = st.progress(0.0)
             with st.spinner("Обработка..."):
-                bot.process_pdf(tmp_path)
+                bot.process_pdf(uploaded_file.getvalue(), source=uploaded_file.name,
+                                progress_callback=lambda progress: progress_bar.progress(progress.fraction))
                 st.success("✅ PDF обработан!")
-            os.unlink(tmp_path)
+    
+    # Область поиска: выбранные документы и страницы
+    st.header("🎯 Где искать")
+    selected_sources = st.multiselect("Документы", bot.indexed_sources(), placeholder="Все документы")
+    pages = st.text_input("Страницы", placeholder="Например: 1-5, 8")
+    try:
+        page_ranges = parse_page_ranges(pages)
+    except ValueError as e:
+        st.warning(f"⚠️ {e}")
+        page_ranges = None
+    search_filter = SearchFilter.create(sources=selected_sources or None, pages=page_ranges)
 
 # Основной чат
 st.header("💬 Задайте вопрос")
@@ -41,7 +50,7 @@ if st.button("Спросить") and question:
         st.warning("⚠️ Сначала загрузите PDF!")
     else:
         with st.spinner("🔍 Ищу ответ..."):
-            chunks = bot.search(question)
+            chunks = bot.search(question, filters=search_filter)
             answer = bot.generate_answer(question, chunks)
             
             # Показываем ответ
@@ -51,9 +60,9 @@ if st.button("Спросить") and question:
             # Показываем источники
             if chunks:
                 with st.expander("📖 Источники"):
-                    for chunk in chunks:
+                    for chunk, spans in zip(chunks, bot.highlight(question, chunks)):
                         st.markdown(f"""
                         **Страница {chunk.page}** (релевантность: {chunk.relevance_score:.3f})
-                        > {chunk.text[:200]}...
+                        > {snippet(chunk.text, spans, 200)}
                         ---
                         """)
\ No newline at end of file
@@ -0,0 +1,370 @@
+"""
+Воспроизводимые замеры производительности RAG чат-бота
+Запуск: python benchmark.py --sizes 20 100 --k 1 3 10 --output results.json
+Сравнение с прошлым запуском: python benchmark.py --compare old.json --output new.json
+
+Что измеряется для каждого размера корпуса (синтетические PDF на русском и английском):
+    parse    — извлечение текста страниц (страниц/с)
+    split    — разбиение на чанки (чанков/с)
+    embed    — вычисление эмбеддингов без кеша (чанков/с)
+    persist  — запись векторов в хранилище (чанков/с)
+    ingest   — полный process_pdf (страниц/с)
+    cold     — холодный старт SimpleRAGBot в отдельном процессе до первого ответа
+    query    — задержка search() p50/p95/p99 для нескольких k
+    rss      — пиковое потребление памяти (RSS): каждый размер замеряется в отдельном процессе
+Модель берется из локального кеша, сеть не нужна.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+# Только локальная копия модели: замеры не должны зависеть от сети
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+import rag_chatbot
+from rag_chatbot import SimpleRAGBot, _iter_pdf_pages, _make_text_splitter
+
+RESULTS_VERSION = 2
+
+_RU_WORDS = (
+    "градиентный спуск функция потерь нейронная сеть обучение модели веса слой активация "
+    "обратное распространение ошибки скорость обучения регуляризация выборка признаки "
+    "классификация регрессия матрица вектор производная оптимизация сходимость эпоха "
+    "переобучение валидация точность полнота кластеризация дерево решений ансамбль"
+).split()
+_EN_WORDS = (
+    "gradient descent loss function neural network training model weights layer activation "
+    "backpropagation learning rate regularization sample features classification regression "
+    "matrix vector derivative optimization convergence epoch overfitting validation accuracy "
+    "recall clustering decision tree ensemble attention transformer embedding"
+).split()
+
+# Кириллица в стандартном шрифте Helvetica: байты 0x80.. переназначаются на глифы afii
+_RU_UPPER = "АБВГДЕЁЖЗИЙКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯ"
+_RU_LOWER = "абвгдеёжзийклмнопрстуфхцчшщъыьэюя"
+_CYRILLIC_CODES = {letter: 0x80 + i for i, letter in enumerate(_RU_UPPER + _RU_LOWER)}
+_CYRILLIC_GLYPHS = ([f"afii{10017 + i}" for i in range(len(_RU_UPPER))]
+                    + [f"afii{10065 + i}" for i in range(len(_RU_LOWER))])
+
+
+def make_sentence(rng: random.Random, words: List[str]) -> str:
+    sentence = " ".join(rng.choice(words) for _ in range(rng.randint(6, 16)))
+    return sentence[0].upper() + sentence[1:] + "."
+
+
+def _encode_pdf_text(text: str) -> bytes:
+    """Строка PDF в однобайтовой кодировке шрифта (с экранированием скобок)"""
+    data = bytearray()
+    for char in text:
+        if char in _CYRILLIC_CODES:
+            data.append(_CYRILLIC_CODES[char])
+        elif char in "()\\":
+            data += b"\\" + char.encode("ascii")
+        elif ord(char) < 128:
+            data.append(ord(char))
+        else:
+            data.append(ord("?"))
+    return bytes(data)
+
+
+def write_pdf(path: str, pages: List[List[str]]):
+    """
+    Минимальный PDF без внешних библиотек: по одной строке текста на строку страницы,
+    шрифт Helvetica с кодировкой, в которую добавлены кириллические глифы
+    """
+    objects: List[bytes] = []
+
+    def add(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+
+    differences = " ".join(f"/{glyph}" for glyph in _CYRILLIC_GLYPHS)
+    font = add(("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding "
+                f"<< /Type /Encoding /BaseEncoding /WinAnsiEncoding /Differences [128 {differences}] >> >>"
+                ).encode("ascii"))
+    pages_id = len(objects) + 1 + 2 * len(pages)
+    page_ids = []
+    for lines in pages:
+        stream = bytearray(b"BT /F1 10 Tf 12 TL 50 800 Td\n")
+        for line in lines:
+            stream += b"(" + _encode_pdf_text(line) + b") Tj T*\n"
+        stream += b"ET"
+        content = add(b"<< /Length %d >>\nstream\n" % len(stream) + bytes(stream) + b"\nendstream")
+        page_ids.append(add((f"<< /Type /Page /Parent {pages_id} 0 R /MediaBox [0 0 595 842] "
+                             f"/Resources << /Font << /F1 {font} 0 R >> >> /Contents {content} 0 R >>"
+                             ).encode("ascii")))
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    add(f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode("ascii"))
+    catalog = add(f"<< /Type /Catalog /Pages {pages_id} 0 R >>".encode("ascii"))
+
+    output = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        output += b"%010d 00000 n \n" % offset
+    output += (b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+               % (len(objects) + 1, catalog, xref))
+    with open(path, "wb") as f:
+        f.write(output)
+
+
+def generate_corpus(directory: str, pages: int, languages: List[str], seed: int = 0,
+                    lines_per_page: int = 60) -> List[str]:
+    """Синтетические PDF (по одному на язык) заданного размера; одинаковый seed — одинаковые файлы"""
+    paths = []
+    for language in languages:
+        rng = random.Random(f"{seed}-{language}-{pages}")
+        words = _RU_WORDS if language == "ru" else _EN_WORDS
+        content = [[make_sentence(rng, words)[:95] for _ in range(lines_per_page)] for _ in range(pages)]
+        path = os.path.join(directory, f"synthetic_{language}_{pages}p.pdf")
+        write_pdf(path, content)
+        paths.append(path)
+    return paths
+
+
+def make_queries(count: int, languages: List[str], seed: int = 1) -> List[str]:
+    """Разные запросы (чтобы кеш результатов не искажал задержки)"""
+    rng = random.Random(seed)
+    queries = []
+    while len(queries) < count:
+        words = _RU_WORDS if languages[len(queries) % len(languages)] == "ru" else _EN_WORDS
+        queries.append(" ".join(rng.sample(words, rng.randint(2, 5))) + f" {len(queries)}")
+    return queries
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """p50/p95/p99 (ближайший ранг) и среднее, в миллисекундах"""
+    ordered = sorted(values)
+    if not ordered:
+        return {}
+
+    def rank(q: float) -> float:
+        return ordered[min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))]
+
+    return {"mean_ms": sum(ordered) / len(ordered), "p50_ms": rank(0.50),
+            "p95_ms": rank(0.95), "p99_ms": rank(0.99)}
+
+
+def peak_rss_mb(children: bool = False) -> float:
+    """Пиковый RSS процесса (или завершившихся дочерних процессов)"""
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # На macOS ru_maxrss в байтах, на Linux — в КБ
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def rate(count: int, seconds: float) -> float:
+    return count / seconds if seconds > 0 else 0.0
+
+
+def bench_stages(paths: List[str], bot: SimpleRAGBot) -> dict:
+    """Отдельные этапы загрузки: разбор, разбиение, эмбеддинги, запись"""
+    started = time.perf_counter()
+    pages = [page for path in paths for page in _iter_pdf_pages(path)]
+    parse_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    chunks = _make_text_splitter().split_documents(pages)
+    split_seconds = time.perf_counter() - started
+
+    texts = [chunk.page_content for chunk in chunks]
+    started = time.perf_counter()
+    vectors = bot.embeddings.embed_documents(texts)
+    embed_seconds = time.perf_counter() - started
+
+    store = bot._ensure_vector_store()
+    ids = [f"bench-{i}" for i in range(len(texts))]
+    started = time.perf_counter()
+    store.upsert(ids, vectors, [dict(chunk.metadata) for chunk in chunks], texts)
+    store.persist()
+    persist_seconds = time.perf_counter() - started
+    store.delete(ids)
+    store.persist()
+
+    return {
+        "pages": len(pages),
+        "chunks": len(chunks),
+        "parse_pages_per_s": rate(len(pages), parse_seconds),
+        "split_chunks_per_s": rate(len(chunks), split_seconds),
+        "embed_chunks_per_s": rate(len(chunks), embed_seconds),
+        "persist_chunks_per_s": rate(len(chunks), persist_seconds),
+    }
+
+
+_COLD_START_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+from rag_chatbot import SimpleRAGBot
+bot = SimpleRAGBot(persist_directory=sys.argv[1], embedding_cache_path=None,
+                   backend=sys.argv[2], embedding_backend=sys.argv[3])
+constructed = time.perf_counter()
+bot.search(sys.argv[4], k=3)
+answered = time.perf_counter()
+print(json.dumps({"construct_s": constructed - started, "first_answer_s": answered - started,
+                  "startup_timings": bot.startup_timings}))
+"""
+
+
+def bench_cold_start(persist_directory: str, backend: str, embedding_backend: str, query: str) -> dict:
+    """Холодный старт в новом процессе: импорт, конструктор, первый поиск"""
+    started = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-c", _COLD_START_SCRIPT, persist_directory, backend, embedding_backend, query],
+        cwd=os.path.dirname(os.path.abspath(rag_chatbot.__file__)),
+        capture_output=True, text=True, check=True,
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result["process_s"] = time.perf_counter() - started
+    return result
+
+
+def bench_queries(bot: SimpleRAGBot, queries: List[str], k_values: List[int], mode: str) -> List[dict]:
+    """Задержки search() для каждого k (каждый запрос — впервые, мимо кеша результатов)"""
+    results = []
+    for k in k_values:
+        bot.search_cache.clear()
+        bot.query_embedding_cache.clear()
+        latencies = []
+        for query in queries:
+            started = time.perf_counter()
+            bot.search(query, k=k, mode=mode)
+            latencies.append((time.perf_counter() - started) * 1000)
+        results.append({"k": k, "queries": len(queries), **percentiles(latencies)})
+    return results
+
+
+def bench_corpus(args, pages: int, workdir: str) -> dict:
+    """Все замеры для одного размера корпуса (выполняется в отдельном процессе)"""
+    print(f"\n📚 Корпус: {pages} стр. x {len(args.languages)} яз.")
+    corpus_dir = os.path.join(workdir, f"corpus_{pages}")
+    db_dir = os.path.join(workdir, f"db_{pages}")
+    os.makedirs(corpus_dir)
+    paths = generate_corpus(corpus_dir, pages, args.languages, args.seed)
+
+    bot = SimpleRAGBot(persist_directory=db_dir, embedding_cache_path=None,
+                       backend=args.backend, embedding_backend=args.embedding_backend)
+    bot.embeddings  # загрузка модели не входит в замеры этапов
+    entry = {"pages": pages, "stages": bench_stages(paths, bot)}
+    print(f"   ⚙️ Этапы: {json.dumps(entry['stages'], ensure_ascii=False)}")
+
+    started = time.perf_counter()
+    for path in paths:
+        bot.process_pdf(path)
+    ingest_seconds = time.perf_counter() - started
+    entry["ingest"] = {"seconds": ingest_seconds, "chunks": bot.chunks_count,
+                       "pages_per_s": rate(pages * len(paths), ingest_seconds)}
+
+    queries = make_queries(args.queries, args.languages, args.seed + 1)
+    bot.search(queries[0], k=3, mode=args.mode)  # прогрев
+    entry["query"] = bench_queries(bot, queries, args.k, args.mode)
+    for row in entry["query"]:
+        print(f"   🔍 k={row['k']}: p50 {row['p50_ms']:.1f} мс, p95 {row['p95_ms']:.1f} мс, "
+              f"p99 {row['p99_ms']:.1f} мс")
+    entry["disk_mb"] = bot.stats.disk_mb if bot.stats else 0.0
+    del bot
+
+    entry["cold_start"] = bench_cold_start(db_dir, args.backend, args.embedding_backend, queries[-1])
+    print(f"   🚀 Холодный старт до первого ответа: {entry['cold_start']['first_answer_s']:.2f} с")
+    entry["peak_rss_mb"] = peak_rss_mb()
+    entry["peak_rss_children_mb"] = peak_rss_mb(children=True)
+    print(f"   💾 Пиковая память: {entry['peak_rss_mb']:.0f} MB "
+          f"(холодный старт: {entry['peak_rss_children_mb']:.0f} MB)")
+    return entry
+
+
+def run(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="rag_bench_")
+    results = {
+        "version": RESULTS_VERSION,
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpus": os.cpu_count()},
+        "config": {"sizes": args.sizes, "languages": args.languages, "k": args.k,
+                   "queries": args.queries, "mode": args.mode, "backend": args.backend,
+                   "embedding_backend": args.embedding_backend, "seed": args.seed},
+        "corpora": [],
+    }
+    try:
+        for pages in args.sizes:
+            # Новый процесс на каждый размер: пиковый RSS относится только к этому корпусу
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                results["corpora"].append(pool.submit(bench_corpus, args, pages, workdir).result())
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def _flatten(results: dict) -> Dict[str, float]:
+    """Плоский словарь метрик для сравнения: {"100p.query.k3.p95_ms": ...}"""
+    flat = {}
+    for entry in results.get("corpora", []):
+        prefix = f"{entry['pages']}p"
+        if "peak_rss_mb" in entry:
+            flat[f"{prefix}.peak_rss_mb"] = entry["peak_rss_mb"]
+        for name, value in entry.get("stages", {}).items():
+            flat[f"{prefix}.stages.{name}"] = value
+        flat[f"{prefix}.ingest.pages_per_s"] = entry.get("ingest", {}).get("pages_per_s", 0.0)
+        flat[f"{prefix}.cold_start.first_answer_s"] = entry.get("cold_start", {}).get("first_answer_s", 0.0)
+        for row in entry.get("query", []):
+            for name in ("p50_ms", "p95_ms", "p99_ms"):
+                flat[f"{prefix}.query.k{row['k']}.{name}"] = row.get(name, 0.0)
+    return flat
+
+
+def compare(old: dict, new: dict):
+    """Таблица изменений метрик относительно прошлого запуска"""
+    old_flat, new_flat = _flatten(old), _flatten(new)
+    print(f"\n📊 Сравнение с запуском {old.get('started_at', '?')}")
+    print(f"{'метрика':<45} {'было':>12} {'стало':>12} {'изм.':>8}")
+    for name in sorted(set(old_flat) & set(new_flat)):
+        before, after = old_flat[name], new_flat[name]
+        change = f"{(after - before) / before * 100:+.1f}%" if before else "—"
+        print(f"{name:<45} {before:>12.2f} {after:>12.2f} {change:>8}")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Замеры производительности загрузки и поиска")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 50], help="размеры корпуса (страниц на язык)")
+    parser.add_argument("--languages", nargs="+", choices=["ru", "en"], default=["ru", "en"])
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 3, 10])
+    parser.add_argument("--queries", type=int, default=100, help="запросов на каждое k")
+    parser.add_argument("--mode", choices=rag_chatbot.SEARCH_MODES, default="vector")
+    parser.add_argument("--backend", choices=["chroma", "numpy"], default="chroma")
+    parser.add_argument("--embedding-backend", choices=rag_chatbot.EMBEDDING_BACKENDS, default="torch")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="файл для результатов (JSON)")
+    parser.add_argument("--compare", help="результаты прошлого запуска для сравнения")
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"✅ Результаты сохранены: {args.output}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,246 @@
+"""
+Лексический индекс BM25 для гибридного поиска по конспектам
+Инвертированный индекс с компактными списками вхождений (array) и
+простой нормализацией слов для русского и английского языков
+"""
+
+import os
+import re
+import sys
+import math
+import array
+import pickle
+import heapq
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Tuple
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Окончания, которые отбрасываются при нормализации (сначала самые длинные)
+_RU_ENDINGS = sorted([
+    "ный", "ная", "ное", "ные", "ных", "ным", "ной", "ного", "ному", "ными", "ную",
+    "ами", "ями", "ого", "его", "ому", "ему", "ыми", "ими", "ение", "ения", "ений", "ость",
+    "ости", "ых", "их", "ой", "ей", "ий", "ый", "ая", "яя", "ое", "ее", "ом", "ем", "ам",
+    "ям", "ах", "ях", "ов", "ев", "ую", "юю", "ть", "ет", "ит", "ут", "ют", "ат", "ят",
+    "ла", "ли", "ло", "а", "я", "о", "е", "ы", "и", "у", "ю", "ь", "й",
+], key=len, reverse=True)
+_EN_ENDINGS = ["ing", "ed", "ly", "s"]
+
+
+def normalize_token(token: str) -> str:
+    """Нормализация слова: нижний регистр, ё -> е, отбрасывание типичных окончаний"""
+    token = token.lower().replace("ё", "е")
+    if token.isdigit() or len(token) <= 3:
+        return token
+    endings = _RU_ENDINGS if re.search("[а-я]", token) else _EN_ENDINGS
+    for ending in endings:
+        if token.endswith(ending) and len(token) - len(ending) >= 3 and not token.endswith("ss"):
+            return token[:-len(ending)]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """Разбиение текста на нормализованные термы"""
+    return [normalize_token(token) for token in _TOKEN_RE.findall(text)]
+
+
+class BM25Index:
+    """
+    Инвертированный индекс BM25 с инкрементальным добавлением и удалением чанков.
+    Каждому чанку выделяется слот; списки вхождений хранят слоты и частоты в массивах uint32.
+    Для слота запоминаются его термы (общие строки с ключами списков), поэтому удаление
+    затрагивает только списки вхождений этих термов.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.slot_ids: List[Optional[str]] = []
+        self.slot_terms: List[Optional[Tuple[str, ...]]] = []
+        self.id_to_slot: Dict[str, int] = {}
+        self.doc_lengths = array.array('I')
+        self.postings: Dict[str, Tuple[array.array, array.array]] = {}
+        self.total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.id_to_slot)
+
+    def __contains__(self, term: str) -> bool:
+        return term in self.postings
+
+    def add(self, chunk_ids: Iterable[str], texts: Iterable[str]):
+        """Добавление (или замена) чанков"""
+        chunk_ids, texts = list(chunk_ids), list(texts)
+        # Прежние версии заменяемых чанков удаляются одним пакетом
+        replaced = [chunk_id for chunk_id in chunk_ids if chunk_id in self.id_to_slot]
+        if replaced:
+            self.remove(replaced)
+        for chunk_id, text in zip(chunk_ids, texts):
+            if chunk_id in self.id_to_slot:
+                # Повтор id внутри пакета: остается последний текст
+                self.remove([chunk_id])
+            terms = tokenize(text)
+            slot = len(self.slot_ids)
+            self.slot_ids.append(chunk_id)
+            self.id_to_slot[chunk_id] = slot
+            self.doc_lengths.append(len(terms))
+            self.total_length += len(terms)
+
+            frequencies: Dict[str, int] = {}
+            for term in terms:
+                term = sys.intern(term)
+                frequencies[term] = frequencies.get(term, 0) + 1
+            self.slot_terms.append(tuple(frequencies))
+            for term, frequency in frequencies.items():
+                slots, tfs = self.postings.setdefault(term, (array.array('I'), array.array('I')))
+                # Новые слоты всегда больше старых, списки остаются отсортированными
+                slots.append(slot)
+                tfs.append(frequency)
+
+    def remove(self, chunk_ids: Iterable[str]):
+        """Удаление чанков: вхождения удаляются только из списков их термов"""
+        slots_by_term: Dict[str, List[int]] = {}
+        for chunk_id in chunk_ids:
+            slot = self.id_to_slot.pop(chunk_id, None)
+            if slot is None:
+                continue
+            self.slot_ids[slot] = None
+            self.total_length -= self.doc_lengths[slot]
+            self.doc_lengths[slot] = 0
+            for term in self.slot_terms[slot]:
+                slots_by_term.setdefault(term, []).append(slot)
+            self.slot_terms[slot] = None
+
+        for term, term_slots in slots_by_term.items():
+            entry = self.postings.get(term)
+            if entry is None:
+                continue
+            slots, tfs = entry
+            for slot in term_slots:
+                position = bisect_left(slots, slot)
+                if position < len(slots) and slots[position] == slot:
+                    del slots[position]
+                    del tfs[position]
+            if not slots:
+                del self.postings[term]
+
+        # Сжатие слотов, когда удаленных стало слишком много
+        if len(self.slot_ids) > 1000 and len(self.id_to_slot) < len(self.slot_ids) // 2:
+            self._compact()
+
+    def _compact(self):
+        """Перенумерация слотов без пропусков"""
+        remap = {}
+        slot_ids: List[Optional[str]] = []
+        slot_terms: List[Optional[Tuple[str, ...]]] = []
+        lengths = array.array('I')
+        for old_slot, chunk_id in enumerate(self.slot_ids):
+            if chunk_id is not None:
+                remap[old_slot] = len(slot_ids)
+                slot_ids.append(chunk_id)
+                slot_terms.append(self.slot_terms[old_slot])
+                lengths.append(self.doc_lengths[old_slot])
+        for term, (slots, tfs) in self.postings.items():
+            self.postings[term] = (array.array('I', (remap[slot] for slot in slots)), tfs)
+        self.slot_ids = slot_ids
+        self.slot_terms = slot_terms
+        self.doc_lengths = lengths
+        self.id_to_slot = {chunk_id: slot for slot, chunk_id in enumerate(slot_ids)}
+
+    def clear(self):
+        self.__init__(self.k1, self.b)
+
+    def search(self, query: str, k: int = 10,
+               allowed: Optional[Iterable[str]] = None) -> List[Tuple[str, float]]:
+        """Top-k чанков по BM25: список (id чанка, оценка); allowed — ограничение по id чанков"""
+        count = len(self.id_to_slot)
+        if not count:
+            return []
+        allowed_slots = None
+        if allowed is not None:
+            allowed_slots = {self.id_to_slot[chunk_id] for chunk_id in allowed if chunk_id in self.id_to_slot}
+            if not allowed_slots:
+                return []
+        average_length = self.total_length / count or 1.0
+
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            entry = self.postings.get(term)
+            if entry is None:
+                continue
+            slots, tfs = entry
+            idf = math.log(1 + (count - len(slots) + 0.5) / (len(slots) + 0.5))
+            for slot, tf in zip(slots, tfs):
+                if allowed_slots is not None and slot not in allowed_slots:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[slot] / average_length)
+                scores[slot] = scores.get(slot, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(self.slot_ids[slot], score) for slot, score in best]
+
+    def save(self, path: str):
+        """Сохранение индекса на диск (атомарно, через временный файл)"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(self.__dict__, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        """Загрузка индекса (пустой индекс, если файла нет)"""
+        index = cls()
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                index.__dict__.update(pickle.load(f))
+        return index
+
+    def to_arrays(self) -> Tuple[dict, Dict[str, bytes]]:
+        """
+        Индекс без pickle (для файлов, которые копируются между узлами): поля JSON
+        и плоские массивы uint32/uint64 — длины чанков, границы и содержимое списков вхождений
+        """
+        terms = list(self.postings)
+        offsets = array.array('Q', [0])
+        slots, tfs = array.array('I'), array.array('I')
+        for term in terms:
+            term_slots, term_tfs = self.postings[term]
+            slots.extend(term_slots)
+            tfs.extend(term_tfs)
+            offsets.append(len(slots))
+        meta = {"k1": self.k1, "b": self.b, "total_length": self.total_length,
+                "slot_ids": self.slot_ids, "terms": terms}
+        return meta, {"lengths": self.doc_lengths.tobytes(), "offsets": offsets.tobytes(),
+                      "slots": slots.tobytes(), "tfs": tfs.tobytes()}
+
+    @classmethod
+    def from_arrays(cls, meta: dict, arrays: Dict[str, bytes]) -> "BM25Index":
+        """Индекс из результата to_arrays"""
+        index = cls(meta["k1"], meta["b"])
+        index.total_length = meta["total_length"]
+        index.slot_ids = list(meta["slot_ids"])
+        index.id_to_slot = {chunk_id: slot for slot, chunk_id in enumerate(index.slot_ids) if chunk_id is not None}
+        index.doc_lengths.frombytes(arrays["lengths"])
+        offsets, slots, tfs = array.array('Q'), array.array('I'), array.array('I')
+        offsets.frombytes(arrays["offsets"])
+        slots.frombytes(arrays["slots"])
+        tfs.frombytes(arrays["tfs"])
+        terms_by_slot: Dict[int, List[str]] = {}
+        for i, term in enumerate(meta["terms"]):
+            term = sys.intern(term)
+            start, end = offsets[i], offsets[i + 1]
+            index.postings[term] = (slots[start:end], tfs[start:end])
+            for slot in slots[start:end]:
+                terms_by_slot.setdefault(slot, []).append(term)
+        index.slot_terms = [tuple(terms_by_slot.get(slot, ())) if chunk_id is not None else None
+                            for slot, chunk_id in enumerate(index.slot_ids)]
+        return index
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """Объединение нескольких ранжирований методом RRF: сумма 1 / (k + позиция)"""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, 1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
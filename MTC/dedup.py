@@ -0,0 +1,303 @@
+"""
+Удаление почти одинаковых чанков при загрузке: подписи MinHash и индекс LSH
+Повторяющиеся колонтитулы, заголовки слайдов и шаблонные абзацы попадают в индекс
+один раз: у чанка считается подпись MinHash по словесным шинглам, индекс LSH по полосам
+подписи находит кандидатов, а оценка сходства Жаккара по подписям решает, дубликат ли это.
+
+Дубликат не получает эмбеддинг и не записывается в хранилище, но запоминается вместе
+с текстом и метаданными при своем представителе. Представитель может быть из другого
+документа: список мест (документ, страница), за которые он стоит (locations), бот записывает
+в его метаданные, и фильтры поиска проверяют и эти места (см. vector_backends.matches_where).
+Хранилищам без списков в метаданных (Chroma) нужен cross_document=False: тогда дубликаты
+ищутся только внутри документа.
+
+Если представителя удаляют (документ изменился или отменена загрузка), его место занимает
+первый из дубликатов, поэтому текст не теряется. Индекс хранится в маленьком pickle-файле рядом с БД.
+"""
+
+import os
+import re
+import zlib
+import pickle
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+# Простое число Мерсенна для хеширования (a * x + b) mod p. Считается в uint64: a, b и x (crc32)
+# меньше 2**32, поэтому a * x + b < 2**64 и до взятия mod p переполнения нет. Коэффициенты
+# шире 32 бит (или хеши шингла длиннее crc32) переполнили бы uint64 раньше mod p
+_PRIME = (1 << 61) - 1
+
+# Параметры, от которых зависят подписи: их нельзя сменить у сохраненного индекса
+_SIGNATURE_PARAMS = ("num_perm", "bands", "shingle_size", "seed")
+
+
+@dataclass
+class DroppedChunk:
+    """Дубликат, не записанный в хранилище"""
+    chunk_id: str
+    text: str
+    metadata: dict
+    representative: str
+
+
+@dataclass
+class DedupReport:
+    """Сколько дубликатов отброшено"""
+    checked: int = 0
+    dropped: int = 0
+    # Дубликаты по документам
+    per_source: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def ratio(self) -> float:
+        return self.dropped / self.checked if self.checked else 0.0
+
+
+class NearDuplicateIndex:
+    """MinHash + LSH по чанкам хранилища"""
+
+    def __init__(self, num_perm: int = 64, bands: int = 8, threshold: float = 0.8,
+                 shingle_size: int = 3, seed: int = 1, cross_document: bool = True):
+        """
+        num_perm: длина подписи MinHash; bands: число полос LSH (num_perm делится на bands).
+        threshold: минимальное сходство Жаккара (по подписям), при котором чанк — дубликат.
+        При 8 полосах по 8 значений кандидатами почти наверняка становятся пары со сходством от 0.8.
+        cross_document: представитель может быть из другого документа (иначе — только из того же)
+        """
+        import numpy as np
+        if num_perm % bands:
+            raise ValueError("num_perm должно делиться на bands")
+        self.np = np
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.seed = seed
+        self.cross_document = cross_document
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, 1 << 32, num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 32, num_perm, dtype=np.uint64)
+        self.signatures: Dict[str, "np.ndarray"] = {}
+        # Документ каждого представителя (без cross_document кандидаты из других документов пропускаются)
+        self.sources: Dict[str, object] = {}
+        self.buckets: Dict[int, List[str]] = {}
+        self.dropped: Dict[str, DroppedChunk] = {}
+        self.dropped_by_source: Dict[object, Set[str]] = {}
+        self.members: Dict[str, List[str]] = {}
+        # Представители, у которых изменился список мест с прошлого take_touched
+        self.touched: Set[str] = set()
+        self.checked_total = 0
+
+    def __len__(self) -> int:
+        return len(self.signatures)
+
+    def signature(self, text: str):
+        """Подпись MinHash по словесным шинглам (без учета регистра)"""
+        np = self.np
+        tokens = _TOKEN_PATTERN.findall(text.lower())
+        size = self.shingle_size
+        shingles = {" ".join(tokens[i:i + size]) for i in range(max(1, len(tokens) - size + 1))}
+        hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles),
+                             dtype=np.uint64, count=len(shingles))
+        values = (self._a[:, None] * hashes[None, :] + self._b[:, None]) % _PRIME
+        return (values.min(axis=1) & 0xFFFFFFFF).astype(np.uint32)
+
+    def _band_keys(self, signature, source) -> List[int]:
+        # Без cross_document в ключ корзины входит документ: чанки разных документов
+        # почти не встречаются в одной корзине
+        prefix = 0 if self.cross_document else zlib.crc32(repr(source).encode("utf-8")) << 40
+        return [prefix | band << 32 | zlib.crc32(signature[band * self.rows:(band + 1) * self.rows].tobytes())
+                for band in range(self.bands)]
+
+    def find(self, signature, source=None) -> Optional[str]:
+        """Представитель, на который чанк похож не меньше threshold (или None)"""
+        best, best_similarity = None, self.threshold
+        seen = set()
+        for key in self._band_keys(signature, source):
+            for chunk_id in self.buckets.get(key, ()):
+                if chunk_id in seen:
+                    continue
+                seen.add(chunk_id)
+                if not self.cross_document and self.sources.get(chunk_id) != source:
+                    continue
+                similarity = float((self.signatures[chunk_id] == signature).mean())
+                if similarity >= best_similarity:
+                    best, best_similarity = chunk_id, similarity
+        return best
+
+    def add(self, chunk_id: str, signature, source=None):
+        """Добавление представителя (чанка, который записан в хранилище)"""
+        if chunk_id in self.signatures:
+            self._unlink(chunk_id)
+        self.signatures[chunk_id] = signature
+        self.sources[chunk_id] = source
+        for key in self._band_keys(signature, source):
+            self.buckets.setdefault(key, []).append(chunk_id)
+
+    def _unlink(self, chunk_id: str):
+        signature = self.signatures.pop(chunk_id)
+        for key in self._band_keys(signature, self.sources.pop(chunk_id, None)):
+            bucket = self.buckets.get(key)
+            if bucket is not None and chunk_id in bucket:
+                bucket.remove(chunk_id)
+                if not bucket:
+                    del self.buckets[key]
+
+    def _rebuild_buckets(self):
+        self.buckets = {}
+        for chunk_id, signature in self.signatures.items():
+            for key in self._band_keys(signature, self.sources.get(chunk_id)):
+                self.buckets.setdefault(key, []).append(chunk_id)
+
+    def locations(self, chunk_id: str) -> List[list]:
+        """Места [документ, страница] дубликатов, за которые стоит представитель chunk_id"""
+        found = []
+        for member in self.members.get(chunk_id, ()):
+            metadata = self.dropped[member].metadata
+            location = [metadata.get("source"), metadata.get("page")]
+            if location not in found:
+                found.append(location)
+        return found
+
+    def take_touched(self) -> Set[str]:
+        """Представители, список мест которых изменился (метаданные в хранилище нужно обновить)"""
+        touched, self.touched = self.touched, set()
+        return touched
+
+    def _drop(self, record: DroppedChunk):
+        self.dropped[record.chunk_id] = record
+        self.dropped_by_source.setdefault(record.metadata.get("source"), set()).add(record.chunk_id)
+
+    def _forget(self, chunk_id: str) -> Optional[DroppedChunk]:
+        """Удаление записи о дубликате (None, если чанк не дубликат)"""
+        record = self.dropped.pop(chunk_id, None)
+        if record is not None:
+            source = record.metadata.get("source")
+            ids = self.dropped_by_source.get(source)
+            if ids is not None:
+                ids.discard(chunk_id)
+                if not ids:
+                    del self.dropped_by_source[source]
+        return record
+
+    def filter(self, ids: List[str], texts: List[str], metadatas: List[dict],
+               report: Optional[DedupReport] = None) -> List[int]:
+        """
+        Отбор чанков для записи: возвращает позиции представителей.
+        Дубликаты (среди уже проиндексированных чанков и внутри самого пакета) запоминаются
+        при своих представителях; новые представители сразу попадают в индекс.
+        """
+        kept = []
+        for i, (chunk_id, text, metadata) in enumerate(zip(ids, texts, metadatas)):
+            if chunk_id in self.dropped:
+                # Чанк загружается заново: прежняя запись о дубликате больше не нужна
+                self.remove([chunk_id])
+            source = metadata.get("source")
+            signature = self.signature(text)
+            representative = self.find(signature, source)
+            self.checked_total += 1
+            if report is not None:
+                report.checked += 1
+            if representative is None or representative == chunk_id:
+                self.add(chunk_id, signature, source)
+                kept.append(i)
+                continue
+            self._drop(DroppedChunk(chunk_id, text, dict(metadata), representative))
+            self.members.setdefault(representative, []).append(chunk_id)
+            self.touched.add(representative)
+            if report is not None:
+                report.dropped += 1
+                name = metadata.get("source", "unknown")
+                report.per_source[name] = report.per_source.get(name, 0) + 1
+        return kept
+
+    def remove(self, ids: List[str]) -> List[DroppedChunk]:
+        """
+        Удаление чанков (представителей и дубликатов). Возвращает дубликаты, которые
+        заменяют удаленных представителей: их нужно записать в хранилище
+        """
+        removed = set(ids)
+        for chunk_id in ids:
+            record = self._forget(chunk_id)
+            if record is not None:
+                members = self.members.get(record.representative)
+                if members is not None and chunk_id in members:
+                    members.remove(chunk_id)
+                    self.touched.add(record.representative)
+
+        promoted = []
+        for chunk_id in ids:
+            if chunk_id not in self.signatures:
+                continue
+            self._unlink(chunk_id)
+            members = [member for member in self.members.pop(chunk_id, []) if member not in removed]
+            if not members:
+                continue
+            record = self._forget(members[0])
+            self.add(record.chunk_id, self.signature(record.text), record.metadata.get("source"))
+            if members[1:]:
+                self.members[record.chunk_id] = members[1:]
+                for member in members[1:]:
+                    self.dropped[member].representative = record.chunk_id
+            self.touched.add(record.chunk_id)
+            promoted.append(record)
+        return promoted
+
+    def dropped_for_source(self, source: str) -> List[DroppedChunk]:
+        return [self.dropped[chunk_id] for chunk_id in self.dropped_by_source.get(source, ())]
+
+    def update_metadata(self, ids: List[str], metadatas: List[dict]) -> Tuple[List[str], List[dict]]:
+        """Обновление метаданных дубликатов; возвращает остальные id и метаданные (они в хранилище)"""
+        rest_ids, rest_metadatas = [], []
+        for chunk_id, metadata in zip(ids, metadatas):
+            record = self.dropped.get(chunk_id)
+            if record is not None:
+                self._forget(chunk_id)
+                record.metadata = dict(metadata)
+                self._drop(record)
+                self.touched.add(record.representative)
+            else:
+                rest_ids.append(chunk_id)
+                rest_metadatas.append(metadata)
+        return rest_ids, rest_metadatas
+
+    def clear(self):
+        self.signatures.clear()
+        self.sources.clear()
+        self.buckets.clear()
+        self.dropped.clear()
+        self.dropped_by_source.clear()
+        self.members.clear()
+        self.touched.clear()
+        self.checked_total = 0
+
+    def save(self, path: str):
+        """Сохранение индекса на диск (атомарно, через временный файл)"""
+        state = {key: value for key, value in self.__dict__.items() if key not in ("np", "touched")}
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> "NearDuplicateIndex":
+        """
+        Загрузка индекса (пустой индекс, если файла нет). Явно переданные параметры важнее
+        сохраненных: порог применяется сразу, при смене cross_document перестраиваются корзины LSH.
+        ValueError, если отличается параметр подписей (сохраненные подписи с ним несовместимы)
+        """
+        index = cls(**kwargs)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                state = pickle.load(f)
+            for name in _SIGNATURE_PARAMS:
+                if name in kwargs and kwargs[name] != state[name]:
+                    raise ValueError(f"Индекс дубликатов {path} построен с {name}={state[name]}")
+            index.__dict__.update(state)
+            index.__dict__.update(kwargs)
+            if index.cross_document != state["cross_document"]:
+                index._rebuild_buckets()
+        return index
@@ -0,0 +1,145 @@
+"""
+Дисковый кеш эмбеддингов для RAG чат-бота
+Ключ — (имя модели, хеш нормализованного текста чанка),
+значение — вектор float32 в компактном бинарном виде (4 байта на координату)
+"""
+
+import os
+import time
+import array
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from typing import List, Optional
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "rag_chatbot", "embeddings.sqlite")
+
+
+def normalize_text(text: str) -> str:
+    """Нормализация текста перед хешированием: Unicode NFC и схлопывание пробелов"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def _pack_vector(vector) -> bytes:
+    """Вектор -> байты float32"""
+    return array.array('f', vector).tobytes()
+
+
+def _unpack_vector(blob: bytes) -> List[float]:
+    """Байты float32 -> вектор"""
+    values = array.array('f')
+    values.frombytes(blob)
+    return values.tolist()
+
+
+class EmbeddingCache:
+    """Персистентный кеш эмбеддингов в SQLite с вытеснением давно не использованных записей"""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = 500_000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key BLOB PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings(last_used)")
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def make_key(model_name: str, text: str) -> bytes:
+        """Ключ кеша: 32 байта SHA-256 от имени модели и нормализованного текста"""
+        return hashlib.sha256(f"{model_name}\0{normalize_text(text)}".encode('utf-8')).digest()
+
+    def get_many(self, model_name: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """Поиск векторов для списка текстов (None для отсутствующих)"""
+        keys = [self.make_key(model_name, text) for text in texts]
+        found = {}
+        with self._lock:
+            # Ограничение SQLite на число параметров в запросе
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                self._conn.commit()
+
+        result = [_unpack_vector(found[key]) if key in found else None for key in keys]
+        hits = sum(1 for vector in result if vector is not None)
+        self.hits += hits
+        self.misses += len(result) - hits
+        return result
+
+    def put_many(self, model_name: str, texts: List[str], vectors: List[List[float]]):
+        """Сохранение векторов в кеш"""
+        now = time.time()
+        rows = [(self.make_key(model_name, text), _pack_vector(vector), now)
+                for text, vector in zip(texts, vectors)]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+            self._count += len(rows)
+            if self._count > self.max_entries:
+                self._evict()
+
+    def _evict(self):
+        """Удаление самых давно использованных записей до 90% лимита"""
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = self._count - int(self.max_entries * 0.9)
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess,)
+            )
+            self._conn.commit()
+            self._count -= excess
+
+    def __len__(self) -> int:
+        return self._count
+
+
+class CachedEmbeddings:
+    """
+    Обертка над моделью эмбеддингов (интерфейс как у HuggingFaceEmbeddings):
+    embed_documents сначала ищет векторы в кеше и вызывает модель только для промахов
+    """
+
+    def __init__(self, embeddings, cache: EmbeddingCache, model_name: str):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model_name = model_name
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = self.cache.get_many(self.model_name, texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            computed = self.embeddings.embed_documents([texts[i] for i in missing])
+            self.cache.put_many(self.model_name, [texts[i] for i in missing], computed)
+            for i, vector in zip(missing, computed):
+                vectors[i] = list(vector)
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Пакетный эмбеддинг запросов мимо дискового кеша (запросы кешируются в памяти бота)"""
+        return self.embeddings.embed_documents(texts)
@@ -0,0 +1,339 @@
+"""
+HTTP-сервис поиска по конспектам (JSON API поверх SimpleRAGBot)
+Запуск: python http_service.py --port 8080 --workers 4
+
+Эндпоинты:
+    GET  /health       — готовность модели и БД
+    GET  /stats        — статистика индекса
+    GET  /metrics      — гистограммы задержек по эндпоинтам и этапам бота (JSON)
+    GET  /metrics/prometheus — те же метрики в текстовом формате Prometheus
+    POST /search       — {"query": "...", "k": 3, "mode": "vector", "nprobe": 8,
+                          "sources": ["a.pdf"], "pages": "1-5, 8",
+                          "ingested_after": 1700000000, "ingested_before": 1800000000}
+                         (в режиме "rerank" ответ содержит отчет о бюджете запроса)
+    POST /search_many  — {"queries": ["...", "..."], "k": 3} (не больше MAX_BATCH_QUERIES запросов)
+    POST /ingest       — {"path": "notes.pdf"} (файл или папка внутри --ingest-dir на сервере;
+                         без --ingest-dir загрузка через HTTP отключена)
+
+Запросы принимает asyncio, а эмбеддинги и поиск выполняются в ограниченном пуле потоков.
+Если в очереди больше max_queue запросов, сервис сразу отвечает 503.
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import asyncio
+import argparse
+import traceback
+from dataclasses import asdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple, Union
+
+from rag_chatbot import SimpleRAGBot, SEARCH_MODES, EMBEDDING_BACKENDS
+from metrics import MetricsRegistry
+from search_filters import SearchFilter
+
+MAX_HEADER_BYTES = 64 * 1024
+MAX_BODY_BYTES = 10 * 1024 * 1024
+MAX_BATCH_QUERIES = 256
+
+_REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed",
+            413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class HttpError(Exception):
+    """Ошибка, которая возвращается клиенту с указанным кодом"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class RAGHttpService:
+    """Асинхронный HTTP-сервер с пулом потоков для работы бота"""
+
+    def __init__(self, bot: SimpleRAGBot, workers: int = 4, max_queue: int = 256,
+                 ingest_dir: Optional[str] = None):
+        self.bot = bot
+        self.max_queue = max_queue
+        # /ingest принимает только пути внутри этой папки (None — загрузка отключена)
+        self.ingest_dir = os.path.realpath(ingest_dir) if ingest_dir else None
+        self.pending = 0
+        self.search_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rag-search")
+        # Загрузка документов идет отдельно и не занимает потоки поиска
+        self.ingest_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rag-ingest")
+        # Задержки по эндпоинтам (этапы внутри бота считает bot.metrics)
+        self.metrics = MetricsRegistry()
+        self.routes = {
+            ("GET", "/health"): self.handle_health,
+            ("GET", "/stats"): self.handle_stats,
+            ("GET", "/metrics"): self.handle_metrics,
+            ("GET", "/metrics/prometheus"): self.handle_prometheus,
+            ("POST", "/search"): self.handle_search,
+            ("POST", "/search_many"): self.handle_search_many,
+            ("POST", "/ingest"): self.handle_ingest,
+        }
+
+    async def run_in_pool(self, pool: ThreadPoolExecutor, func, *args):
+        """Выполнение блокирующей функции в пуле с ограничением очереди"""
+        if self.pending >= self.max_queue:
+            raise HttpError(503, "Слишком много запросов, повторите позже")
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(pool, func, *args)
+        finally:
+            self.pending -= 1
+
+    # Обработчики эндпоинтов
+
+    async def handle_health(self, body: dict) -> dict:
+        return {"ready": self.bot.is_ready, "pending": self.pending}
+
+    async def handle_stats(self, body: dict) -> dict:
+        # chunks_count может ждать загрузки БД: не в цикле событий
+        chunks = await self.run_in_pool(self.search_pool, lambda: self.bot.chunks_count)
+        stats = self.bot.stats
+        return {
+            "chunks": chunks,
+            "index_version": self.bot.index_version,
+            "stats": asdict(stats) if stats else None,
+        }
+
+    async def handle_metrics(self, body: dict) -> dict:
+        return {"http": self.metrics.snapshot()["timers"], "bot": self.bot.metrics.snapshot()}
+
+    async def handle_prometheus(self, body: dict) -> str:
+        return self.metrics.to_prometheus(prefix="rag_http") + self.bot.metrics_text()
+
+    async def handle_search(self, body: dict) -> dict:
+        query = body.get("query")
+        if not isinstance(query, str) or not query.strip():
+            raise HttpError(400, "Поле query обязательно")
+        k, mode = self._parse_k_mode(body)
+        nprobe = self._parse_nprobe(body)
+        search_filter = self._parse_filter(body)
+
+        def search():
+            # Отчет о бюджете хранится в потоке, который выполнил поиск
+            return self.bot.search(query, k, mode, nprobe, search_filter), self.bot.last_rerank
+
+        chunks, rerank = await self.run_in_pool(self.search_pool, search)
+        response = {"results": [asdict(chunk) for chunk in chunks]}
+        if rerank is not None:
+            response["rerank"] = asdict(rerank)
+        return response
+
+    async def handle_search_many(self, body: dict) -> dict:
+        queries = body.get("queries")
+        if not isinstance(queries, list) or not all(isinstance(query, str) for query in queries):
+            raise HttpError(400, "Поле queries должно быть списком строк")
+        if len(queries) > MAX_BATCH_QUERIES:
+            raise HttpError(413, f"Не больше {MAX_BATCH_QUERIES} запросов в пакете")
+        k, mode = self._parse_k_mode(body)
+        nprobe = self._parse_nprobe(body)
+        search_filter = self._parse_filter(body)
+        batches = await self.run_in_pool(self.search_pool,
+                                         lambda: self.bot.search_many(queries, k, mode=mode, nprobe=nprobe,
+                                                                      filters=search_filter))
+        return {"results": [[asdict(chunk) for chunk in chunks] for chunks in batches]}
+
+    async def handle_ingest(self, body: dict) -> dict:
+        path = body.get("path")
+        if not isinstance(path, str) or not path:
+            raise HttpError(400, "Поле path обязательно")
+        path = self._resolve_ingest_path(path)
+        process = self.bot.process_folder if os.path.isdir(path) or glob.has_magic(path) else self.bot.process_pdf
+
+        def ingest():
+            return process(path), self.bot.chunks_count
+
+        success, chunks = await self.run_in_pool(self.ingest_pool, ingest)
+        return {"success": success, "chunks": chunks}
+
+    def _resolve_ingest_path(self, path: str) -> str:
+        """Путь (или шаблон) относительно папки загрузки; выход за ее пределы запрещен"""
+        if self.ingest_dir is None:
+            raise HttpError(403, "Загрузка через HTTP отключена (запустите сервис с --ingest-dir)")
+        resolved = os.path.realpath(os.path.join(self.ingest_dir, path))
+        if os.path.commonpath([self.ingest_dir, resolved]) != self.ingest_dir:
+            raise HttpError(403, "Путь вне папки загрузки")
+        return resolved
+
+    @staticmethod
+    def _parse_k_mode(body: dict) -> Tuple[int, Optional[str]]:
+        k = body.get("k", 3)
+        mode = body.get("mode")
+        if not isinstance(k, int) or isinstance(k, bool) or not 1 <= k <= 100:
+            raise HttpError(400, "k должно быть целым числом от 1 до 100")
+        if mode is not None and mode not in SEARCH_MODES:
+            raise HttpError(400, f"mode должен быть одним из: {', '.join(SEARCH_MODES)}")
+        return k, mode
+
+    @staticmethod
+    def _parse_nprobe(body: dict) -> Optional[int]:
+        nprobe = body.get("nprobe")
+        if nprobe is not None and (not isinstance(nprobe, int) or isinstance(nprobe, bool) or nprobe < 1):
+            raise HttpError(400, "nprobe должно быть положительным целым числом")
+        return nprobe
+
+    @staticmethod
+    def _parse_filter(body: dict) -> Optional[SearchFilter]:
+        sources = body.get("sources")
+        if sources is not None and (not isinstance(sources, list)
+                                    or not all(isinstance(source, str) for source in sources)):
+            raise HttpError(400, "Поле sources должно быть списком строк")
+        pages = body.get("pages")
+        if pages is not None and not isinstance(pages, (str, list)):
+            raise HttpError(400, "Поле pages должно быть строкой '1-5, 8' или списком пар [первая, последняя]")
+        bounds = [body.get("ingested_after"), body.get("ingested_before")]
+        if any(bound is not None and not isinstance(bound, (int, float)) for bound in bounds):
+            raise HttpError(400, "ingested_after и ingested_before — время в секундах (Unix time)")
+        try:
+            return SearchFilter.create(sources=sources, pages=pages,
+                                       ingested_after=bounds[0], ingested_before=bounds[1])
+        except (TypeError, ValueError) as e:
+            raise HttpError(400, f"Неверный фильтр: {e}")
+
+    # HTTP
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Обработка соединения (с поддержкой keep-alive)"""
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self._respond(writer, 413, {"error": "Слишком большие заголовки"}, False)
+                    break
+
+                request_line, *header_lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, target, version = request_line.split(" ", 2)
+                except ValueError:
+                    await self._respond(writer, 400, {"error": "Некорректный запрос"}, False)
+                    break
+                headers = {}
+                for line in header_lines:
+                    if ":" in line:
+                        name, value = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
+
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                length = headers.get("content-length", "0") or "0"
+                if not length.isdigit():
+                    await self._respond(writer, 400, {"error": "Некорректный Content-Length"}, False)
+                    break
+                length = int(length)
+                if length > MAX_BODY_BYTES:
+                    await self._respond(writer, 413, {"error": "Слишком большое тело запроса"}, False)
+                    break
+                try:
+                    raw_body = await reader.readexactly(length) if length else b""
+                except asyncio.IncompleteReadError:
+                    await self._respond(writer, 400, {"error": "Тело запроса короче Content-Length"}, False)
+                    break
+
+                status, payload = await self.dispatch(method, target.split("?", 1)[0], raw_body)
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+
+    async def dispatch(self, method: str, path: str, raw_body: bytes) -> Tuple[int, Union[dict, str]]:
+        """Вызов обработчика и учет задержки"""
+        started = time.perf_counter()
+        handler = self.routes.get((method, path))
+        try:
+            if handler is None:
+                known_path = any(route_path == path for _, route_path in self.routes)
+                raise HttpError(405 if known_path else 404, "Неизвестный эндпоинт")
+            try:
+                body = json.loads(raw_body) if raw_body else {}
+            except ValueError:
+                raise HttpError(400, "Тело запроса должно быть JSON")
+            if not isinstance(body, dict):
+                raise HttpError(400, "Тело запроса должно быть JSON-объектом")
+            status, payload = 200, await handler(body)
+        except HttpError as e:
+            status, payload = e.status, {"error": e.message}
+        except Exception:
+            # Подробности — в консоль сервиса; клиенту внутренние детали не отдаются
+            print(f"❌ Ошибка при обработке {method} {path}:", file=sys.stderr)
+            traceback.print_exc()
+            status, payload = 500, {"error": "Внутренняя ошибка сервиса"}
+
+        if handler is not None:
+            self.metrics.observe(path, (time.perf_counter() - started) * 1000)
+        return status, payload
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, payload: Union[dict, str],
+                       keep_alive: bool):
+        # Строка отдается как есть (формат Prometheus), остальное — как JSON
+        if isinstance(payload, str):
+            body = payload.encode("utf-8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            content_type = "application/json; charset=utf-8"
+        head = (
+            f"HTTP/1.1 {status} {_REASONS.get(status, 'Error')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        ).encode("latin-1")
+        writer.write(head + body)
+        await writer.drain()
+
+    async def serve(self, host: str, port: int):
+        server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_HEADER_BYTES)
+        print(f"🌐 Сервис запущен: http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="HTTP-сервис поиска по конспектам")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--persist-directory", default="./chroma_db")
+    parser.add_argument("--snapshot", help="файл снимка индекса (snapshot.py) вместо папки БД")
+    parser.add_argument("--shards", help="папка шардированного индекса (sharded.py) вместо папки БД")
+    parser.add_argument("--shard-workers", type=int, help="процессов для поиска по шардам")
+    parser.add_argument("--workers", type=int, default=4, help="потоков для поиска")
+    parser.add_argument("--max-queue", type=int, default=256, help="максимум запросов в очереди")
+    parser.add_argument("--ingest-dir", help="папка, из которой /ingest загружает PDF (без нее /ingest отключен)")
+    parser.add_argument("--embedding-backend", choices=EMBEDDING_BACKENDS, default="torch",
+                        help="onnx — квантованная int8 модель в onnxruntime")
+    parser.add_argument("--embedding-threads", type=int, help="потоков onnxruntime")
+    parser.add_argument("--search-mode", choices=SEARCH_MODES, default="vector",
+                        help="режим поиска по умолчанию")
+    parser.add_argument("--rerank-candidates", type=int, default=30,
+                        help="кандидатов для переранжирования в режиме rerank")
+    parser.add_argument("--rerank-budget-ms", type=float, default=200.0,
+                        help="бюджет времени запроса в режиме rerank (мс)")
+    args = parser.parse_args(argv)
+
+    bot = SimpleRAGBot(persist_directory=args.persist_directory, snapshot=args.snapshot, warm_up=True,
+                       shards=args.shards, shard_workers=args.shard_workers,
+                       search_mode=args.search_mode,
+                       embedding_backend=args.embedding_backend,
+                       embedding_threads=args.embedding_threads,
+                       rerank_candidates=args.rerank_candidates,
+                       rerank_budget_ms=args.rerank_budget_ms)
+    service = RAGHttpService(bot, workers=args.workers, max_queue=args.max_queue,
+                             ingest_dir=args.ingest_dir)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print("\n👋 Сервис остановлен")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
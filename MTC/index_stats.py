@@ -0,0 +1,103 @@
+"""
+Статистика индекса: число фрагментов и страниц по документам, размер БД, время загрузки.
+Обновляется инкрементально при обработке документов и хранится в маленьком JSON-файле,
+поэтому чтение статистики не зависит от размера индекса
+"""
+
+import os
+import json
+import time
+from dataclasses import dataclass, field, asdict
+from typing import Dict, Optional
+
+
+@dataclass
+class SourceStats:
+    """Статистика одного документа"""
+    chunks: int = 0
+    pages: int = 0
+    ingested_at: float = 0.0
+    # SHA-256 файла: повторная загрузка того же содержимого ничего не делает
+    content_hash: str = ""
+
+
+@dataclass
+class IndexStats:
+    """Сводная статистика индекса"""
+    total_chunks: int = 0
+    total_pages: int = 0
+    disk_bytes: int = 0
+    last_ingest: Optional[float] = None
+    sources: Dict[str, SourceStats] = field(default_factory=dict)
+
+    def update_source(self, source: str, chunks: int, pages: int, content_hash: str = ""):
+        """Новые значения для документа (итоги пересчитываются по разнице)"""
+        old = self.sources.get(source, SourceStats())
+        self.total_chunks += chunks - old.chunks
+        self.total_pages += pages - old.pages
+        self.last_ingest = time.time()
+        self.sources[source] = SourceStats(chunks=chunks, pages=pages, ingested_at=self.last_ingest,
+                                           content_hash=content_hash)
+
+    def find_by_hash(self, content_hash: str) -> Optional[str]:
+        """Документ с таким же содержимым (None, если его нет)"""
+        if not content_hash:
+            return None
+        for source, source_stats in self.sources.items():
+            if source_stats.content_hash == content_hash:
+                return source
+        return None
+
+    def add_chunks(self, source: str, count: int):
+        """Изменение числа чанков документа без повторной загрузки (например, при замене дубликата)"""
+        source_stats = self.sources.get(source)
+        if source_stats is not None:
+            source_stats.chunks += count
+            self.total_chunks += count
+
+    def remove_source(self, source: str):
+        old = self.sources.pop(source, None)
+        if old is not None:
+            self.total_chunks -= old.chunks
+            self.total_pages -= old.pages
+
+    def refresh_disk_size(self, directory: str):
+        """Пересчет размера БД на диске (вызывается после записи, а не при отображении)"""
+        self.disk_bytes = sum(
+            os.path.getsize(os.path.join(dirpath, filename))
+            for dirpath, _, filenames in os.walk(directory)
+            for filename in filenames
+        ) if os.path.isdir(directory) else 0
+
+    def reset(self):
+        self.__init__()
+
+    @property
+    def disk_mb(self) -> float:
+        return self.disk_bytes / 1024 / 1024
+
+    def save(self, path: str):
+        """Атомарная запись в JSON"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["IndexStats"]:
+        """Загрузка статистики (None, если файла нет или он поврежден)"""
+        try:
+            with open(path, encoding="utf-8") as f:
+                return cls.from_dict(json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "IndexStats":
+        data = dict(data)
+        data["sources"] = {source: SourceStats(**values)
+                           for source, values in data.get("sources", {}).items()}
+        return cls(**data)
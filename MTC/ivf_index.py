@@ -0,0 +1,152 @@
+"""
+Приближенный поиск ближайших соседей (IVF) для хранилища numpy
+Векторы разбиваются на кластеры сферическим k-means; запрос сравнивается только
+с векторами из nprobe ближайших кластеров. Индекс хранит лишь номера строк
+матрицы хранилища, сами векторы не дублируются
+"""
+
+import os
+import array
+import pickle
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Сколько строк назначается кластерам за один проход (ограничивает память)
+ASSIGN_BLOCK_ROWS = 65536
+
+
+def default_nlist(rows: int) -> int:
+    """Число кластеров по размеру коллекции: около 4 * sqrt(N)"""
+    return int(min(65536, max(16, 4 * np.sqrt(max(rows, 1)))))
+
+
+class IVFIndex:
+    """
+    Инвертированные списки: для каждого центроида — массив uint32 номеров строк.
+    Новые строки добавляются инкрементально (в ближайший кластер), переобучение
+    нужно только когда коллекция выросла в несколько раз с момента обучения.
+    """
+
+    def __init__(self, nlist: int = 0):
+        self.nlist = nlist
+        self.centroids: Optional[np.ndarray] = None
+        self.lists: List[array.array] = []
+        self.trained_rows = 0
+        self.indexed_rows = 0
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def train(self, matrix, nlist: Optional[int] = None, iterations: int = 10, seed: int = 0):
+        """
+        Обучение центроидов сферическим k-means по случайной выборке строк
+        и назначение кластеров всем строкам матрицы
+        """
+        rows = matrix.shape[0]
+        self.nlist = min(nlist or default_nlist(rows), rows)
+        rng = np.random.default_rng(seed)
+        sample_size = min(rows, self.nlist * 32)
+        sample = np.asarray(matrix[np.sort(rng.choice(rows, size=sample_size, replace=False))],
+                            dtype=np.float32)
+
+        centroids = sample[rng.choice(sample_size, size=self.nlist, replace=False)].copy()
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=self.nlist)
+            # Пустые кластеры получают случайную точку выборки
+            empty = counts == 0
+            if empty.any():
+                sums[empty] = sample[rng.choice(sample_size, size=int(empty.sum()))]
+            centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+
+        self.centroids = centroids.astype(np.float32)
+        self.trained_rows = rows
+        self.lists = [array.array('I') for _ in range(self.nlist)]
+        self.indexed_rows = 0
+        self.add(matrix, 0)
+
+    def add(self, matrix, start: int):
+        """Назначение кластеров строкам matrix[start:] (номера строк — в нумерации матрицы)"""
+        if not self.is_trained:
+            return
+        # Списки не меняются на месте: поиск, начатый раньше, читает прежние (см. NumpyBackend.query)
+        lists = list(self.lists)
+        copied = set()
+        for block_start in range(start, matrix.shape[0], ASSIGN_BLOCK_ROWS):
+            block = np.asarray(matrix[block_start:block_start + ASSIGN_BLOCK_ROWS], dtype=np.float32)
+            labels = np.argmax(block @ self.centroids.T, axis=1)
+            for offset, label in enumerate(labels.tolist()):
+                if label not in copied:
+                    lists[label] = array.array('I', lists[label])
+                    copied.add(label)
+                lists[label].append(block_start + offset)
+        self.lists = lists
+        self.indexed_rows = matrix.shape[0]
+
+    def reassign(self, matrix):
+        """Перестроение списков с прежними центроидами (после перенумерации строк)"""
+        if not self.is_trained:
+            return
+        self.lists = [array.array('I') for _ in range(self.nlist)]
+        self.indexed_rows = 0
+        self.add(matrix, 0)
+
+    def needs_training(self, rows: int, growth: float = 4.0) -> bool:
+        """Индекс не обучен или коллекция выросла в growth раз с момента обучения"""
+        return not self.is_trained or rows > self.trained_rows * growth
+
+    def probe(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        """Отсортированные номера строк из nprobe ближайших к запросу кластеров"""
+        nprobe = max(1, min(nprobe, self.nlist))
+        closest = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        parts = [np.frombuffer(self.lists[cluster], dtype=np.uint32)
+                 for cluster in closest.tolist() if len(self.lists[cluster])]
+        if not parts:
+            return np.zeros(0, dtype=np.int64)
+        return np.sort(np.concatenate(parts)).astype(np.int64)
+
+    def to_arrays(self) -> Tuple[dict, Dict[str, bytes]]:
+        """Индекс без pickle: поля JSON, центроиды float32 и списки (границы uint64, номера строк uint32)"""
+        offsets = np.cumsum([0] + [len(rows) for rows in self.lists], dtype=np.uint64)
+        rows = array.array('I')
+        for cluster_rows in self.lists:
+            rows.extend(cluster_rows)
+        centroids = self.centroids if self.centroids is not None else np.zeros((0, 0), dtype=np.float32)
+        meta = {"nlist": self.nlist, "dim": int(centroids.shape[1]) if centroids.ndim == 2 else 0,
+                "trained_rows": self.trained_rows, "indexed_rows": self.indexed_rows}
+        return meta, {"centroids": np.ascontiguousarray(centroids, dtype=np.float32).tobytes(),
+                      "offsets": offsets.tobytes(), "rows": rows.tobytes()}
+
+    @classmethod
+    def from_arrays(cls, meta: dict, arrays: Dict[str, bytes]) -> "IVFIndex":
+        """Индекс из результата to_arrays"""
+        index = cls(meta["nlist"])
+        index.trained_rows = meta["trained_rows"]
+        index.indexed_rows = meta["indexed_rows"]
+        if meta["dim"]:
+            index.centroids = np.frombuffer(arrays["centroids"], dtype=np.float32).reshape(-1, meta["dim"]).copy()
+        offsets = np.frombuffer(arrays["offsets"], dtype=np.uint64).tolist()
+        rows = array.array('I')
+        rows.frombytes(arrays["rows"])
+        index.lists = [rows[start:end] for start, end in zip(offsets, offsets[1:])]
+        return index
+
+    def save(self, path: str):
+        """Сохранение индекса на диск (атомарно, через временный файл)"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(self.__dict__, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "IVFIndex":
+        """Загрузка индекса (необученный индекс, если файла нет)"""
+        index = cls()
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                index.__dict__.update(pickle.load(f))
+        return index
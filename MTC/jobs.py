@@ -0,0 +1,150 @@
+"""
+Фоновые задачи загрузки документов
+Задачи выполняются по одной в отдельном потоке, поэтому интерфейс не блокируется,
+а поиск по уже существующему индексу продолжает работать во время загрузки.
+У каждой задачи есть id, состояние, реальный прогресс по страницам и чанкам и отмена.
+"""
+
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
+from typing import Callable, List, Optional
+
+from rag_chatbot import SimpleRAGBot, IngestProgress, PdfInput, _content_hash
+
+# Состояния задачи
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+
+@dataclass
+class Job:
+    """Задача загрузки документа"""
+    id: str
+    description: str
+    status: str = QUEUED
+    progress: Optional[IngestProgress] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+    content_hash: str = ""
+    cancel_event: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in FINISHED_STATES
+
+    @property
+    def fraction(self) -> float:
+        if self.status == DONE:
+            return 1.0
+        return self.progress.fraction if self.progress else 0.0
+
+    @property
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+
+class JobRunner:
+    """Очередь задач загрузки поверх одного экземпляра SimpleRAGBot"""
+
+    def __init__(self, bot: SimpleRAGBot, keep: int = 50):
+        """keep: сколько завершенных задач хранить для отображения"""
+        self.bot = bot
+        self.keep = keep
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Один поток: загрузки пишут в общий индекс и выполняются по очереди
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rag-job")
+
+    def submit_pdf(self, pdf: PdfInput, description: Optional[str] = None,
+                   cleanup: Optional[Callable[[], None]] = None, source: Optional[str] = None) -> str:
+        """
+        Постановка PDF (путь, байты или поток) в очередь. Возвращает id задачи.
+        Если тот же файл уже ждет в очереди или обрабатывается, возвращается id этой задачи.
+        cleanup вызывается после завершения задачи (например, удаление временного файла).
+        source — имя документа в БД.
+        """
+        content_hash = _content_hash(pdf)
+        with self._lock:
+            for job in self.jobs.values():
+                if job.content_hash == content_hash and not job.is_finished:
+                    if cleanup is not None:
+                        cleanup()
+                    return job.id
+            job = Job(id=uuid.uuid4().hex[:8], content_hash=content_hash,
+                      description=description or source or (pdf if isinstance(pdf, str) else "document.pdf"))
+            self.jobs[job.id] = job
+            self._trim()
+        self._pool.submit(self._run_pdf, job, pdf, source, cleanup)
+        return job.id
+
+    def _run_pdf(self, job: Job, pdf: PdfInput, source: Optional[str],
+                 cleanup: Optional[Callable[[], None]]):
+        try:
+            if job.cancel_event.is_set():
+                job.status = CANCELLED
+                return
+            job.status = RUNNING
+            job.started_at = time.time()
+
+            def on_progress(progress: IngestProgress):
+                # Копия: интерфейс читает прогресс из другого потока
+                job.progress = replace(progress)
+
+            success = self.bot.process_pdf(pdf, progress_callback=on_progress,
+                                           cancel_event=job.cancel_event, source=source)
+            if job.cancel_event.is_set() and not success:
+                job.status = CANCELLED
+            elif success:
+                job.status = DONE
+            else:
+                job.status = FAILED
+                job.error = "Ошибка при обработке документа"
+        except Exception as e:
+            job.status = FAILED
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            if cleanup is not None:
+                cleanup()
+
+    def cancel(self, job_id: str) -> bool:
+        """Запрос отмены (задача в очереди не запустится, выполняющаяся остановится)"""
+        job = self.jobs.get(job_id)
+        if job is None or job.is_finished:
+            return False
+        job.cancel_event.set()
+        if job.status == QUEUED:
+            job.status = CANCELLED
+            job.finished_at = time.time()
+        return True
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def list(self) -> List[Job]:
+        """Все задачи, новые первыми"""
+        with self._lock:
+            return list(reversed(self.jobs.values()))
+
+    def active(self) -> List[Job]:
+        return [job for job in self.list() if not job.is_finished]
+
+    def _trim(self):
+        """Удаление самых старых завершенных задач сверх лимита keep"""
+        finished = [job_id for job_id, job in self.jobs.items() if job.is_finished]
+        for job_id in finished[:max(0, len(finished) - self.keep)]:
+            del self.jobs[job_id]
+
+    def shutdown(self, cancel: bool = True):
+        if cancel:
+            for job in self.active():
+                self.cancel(job.id)
+        self._pool.shutdown(wait=True)
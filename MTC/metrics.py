@@ -0,0 +1,195 @@
+"""
+Метрики производительности: таймеры этапов, счетчики и скользящие гистограммы задержек
+Экспорт в JSON-словарь (для меню и веб-интерфейса) и в текстовый формат Prometheus.
+
+Выключенный реестр (enabled=False) возвращает общий пустой таймер и ничего не считает,
+так что инструментированный код почти ничего не теряет в скорости
+"""
+
+import time
+import threading
+from bisect import bisect_left
+from collections import deque
+from typing import Dict, Optional
+
+
+class LatencyHistogram:
+    """
+    Гистограмма задержек с фиксированными границами корзин (мс) за все время
+    и окно последних значений для точных скользящих квантилей
+    """
+
+    BOUNDS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000]
+
+    def __init__(self, window: int = 1024):
+        self.counts = [0] * (len(self.BOUNDS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, elapsed_ms: float):
+        with self._lock:
+            self.counts[bisect_left(self.BOUNDS_MS, elapsed_ms)] += 1
+            self.count += 1
+            self.total_ms += elapsed_ms
+            self.recent.append(elapsed_ms)
+
+    def quantile(self, q: float) -> float:
+        """Квантиль по окну последних значений"""
+        with self._lock:
+            ordered = sorted(self.recent)
+        if not ordered:
+            return 0.0
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            ordered = sorted(self.recent)
+            counts = list(self.counts)
+
+        def rank(q: float) -> float:
+            return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+        return {
+            "count": self.count,
+            "mean_ms": self.total_ms / self.count if self.count else 0.0,
+            "p50_ms": rank(0.50),
+            "p95_ms": rank(0.95),
+            "p99_ms": rank(0.99),
+            "buckets": {f"le_{bound}": count for bound, count in zip(self.BOUNDS_MS, counts)},
+        }
+
+
+class _Timer:
+    """Контекстный менеджер: время блока записывается в гистограмму"""
+
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram: LatencyHistogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe((time.perf_counter() - self.started) * 1000)
+        return False
+
+
+class _NullTimer:
+    """Таймер выключенного реестра"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class MetricsRegistry:
+    """Именованные гистограммы задержек ("search.embed", "ingest.parse", ...) и счетчики"""
+
+    def __init__(self, enabled: bool = True, window: int = 1024):
+        self.enabled = enabled
+        self.window = window
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self.counters: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str) -> LatencyHistogram:
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name, LatencyHistogram(self.window))
+        return histogram
+
+    def timer(self, name: str):
+        """with metrics.timer("search.vector"): ..."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self.histogram(name))
+
+    def timed_iter(self, name: str, iterable):
+        """Итератор, у которого замеряется получение каждого элемента (например, разбор страниц PDF)"""
+        if not self.enabled:
+            return iterable
+        return self._timed_iter(self.histogram(name), iterable)
+
+    @staticmethod
+    def _timed_iter(histogram: LatencyHistogram, iterable):
+        iterator = iter(iterable)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            histogram.observe((time.perf_counter() - started) * 1000)
+            yield item
+
+    def observe(self, name: str, elapsed_ms: float):
+        if self.enabled:
+            self.histogram(name).observe(elapsed_ms)
+
+    def count(self, name: str, value: float = 1):
+        if self.enabled:
+            with self._lock:
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def snapshot(self) -> dict:
+        """Все метрики в виде словаря (для JSON и отображения)"""
+        return {
+            "enabled": self.enabled,
+            "timers": {name: histogram.to_dict() for name, histogram in sorted(self.histograms.items())},
+            "counters": dict(sorted(self.counters.items())),
+        }
+
+    def to_prometheus(self, prefix: str = "rag", labels: Optional[Dict[str, str]] = None) -> str:
+        """Текстовый формат Prometheus: гистограммы в секундах и счетчики *_total"""
+        extra = "".join(f',{key}="{value}"' for key, value in (labels or {}).items())
+        lines = []
+        if self.histograms:
+            name = f"{prefix}_stage_seconds"
+            lines.append(f"# HELP {name} Время выполнения этапов")
+            lines.append(f"# TYPE {name} histogram")
+            for stage, histogram in sorted(self.histograms.items()):
+                with histogram._lock:
+                    counts = list(histogram.counts)
+                    count, total_ms = histogram.count, histogram.total_ms
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.BOUNDS_MS, counts):
+                    cumulative += bucket_count
+                    lines.append(f'{name}_bucket{{stage="{stage}"{extra},le="{bound / 1000:g}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{stage="{stage}"{extra},le="+Inf"}} {count}')
+                lines.append(f'{name}_sum{{stage="{stage}"{extra}}} {total_ms / 1000:.6f}')
+                lines.append(f'{name}_count{{stage="{stage}"{extra}}} {count}')
+        for counter, value in sorted(self.counters.items()):
+            name = f"{prefix}_{counter.replace('.', '_')}_total"
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{{{extra.lstrip(',')}}} {value:g}" if extra else f"{name} {value:g}")
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def format_table(self) -> str:
+        """Краткая таблица для консоли"""
+        rows = []
+        for name, histogram in sorted(self.histograms.items()):
+            stats = histogram.to_dict()
+            rows.append(f"   {name:<22} {stats['count']:>7} {stats['mean_ms']:>9.1f} "
+                        f"{stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f}")
+        if rows:
+            rows.insert(0, f"   {'этап':<22} {'вызовов':>7} {'сред.мс':>9} {'p50':>9} {'p95':>9} {'p99':>9}")
+        for name, value in sorted(self.counters.items()):
+            rows.append(f"   {name}: {value:g}")
+        return "\n".join(rows)
@@ -0,0 +1,128 @@
+"""
+Быстрые эмбеддинги на CPU: модель, экспортированная в ONNX и динамически квантованная в int8
+Интерфейс как у HuggingFaceEmbeddings (embed_documents / embed_query).
+
+При первом запуске модель экспортируется из transformers и сохраняется в локальный кеш,
+дальше загружается только готовый файл model_int8.onnx. Перед кодированием тексты
+сортируются по длине и группируются в пакеты близкой длины, поэтому короткие чанки
+не дополняются до длины самых длинных.
+
+Дополнительные зависимости: onnxruntime, onnx (для квантизации), torch и transformers
+(только для экспорта, они уже стоят вместе с sentence-transformers).
+"""
+
+import os
+import threading
+from typing import List, Optional
+
+DEFAULT_ONNX_DIR = os.path.join(os.path.expanduser("~"), ".cache", "rag_chatbot", "onnx")
+
+# all-MiniLM-L6-v2 обучена на последовательностях до 256 токенов
+MAX_SEQ_LENGTH = 256
+
+
+def _model_dir(cache_dir: str, model_name: str) -> str:
+    return os.path.join(cache_dir, model_name.replace("/", "__"))
+
+
+def export_model(model_name: str, cache_dir: str = DEFAULT_ONNX_DIR, quantize: bool = True) -> str:
+    """
+    Экспорт модели в ONNX (и квантизация весов в int8) в локальный кеш.
+    Возвращает путь к файлу модели; если файл уже есть, экспорт не выполняется.
+    """
+    directory = _model_dir(cache_dir, model_name)
+    fp32_path = os.path.join(directory, "model.onnx")
+    int8_path = os.path.join(directory, "model_int8.onnx")
+    target = int8_path if quantize else fp32_path
+    if os.path.exists(target):
+        return target
+
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(directory, exist_ok=True)
+    print(f"🔄 Экспорт модели {model_name} в ONNX...")
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name)
+    model.eval()
+    tokenizer.save_pretrained(directory)
+
+    sample = tokenizer(["пример текста"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    with torch.no_grad():
+        torch.onnx.export(
+            model, tuple(sample[name] for name in input_names), fp32_path,
+            input_names=input_names, output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes, opset_version=14,
+        )
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        print("🗜️ Квантизация весов в int8...")
+        quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    print(f"✅ Модель сохранена: {target}")
+    return target
+
+
+class OnnxEmbeddings:
+    """Эмбеддинги через onnxruntime: средний пулинг по токенам и L2-нормировка, как в sentence-transformers"""
+
+    def __init__(self, model_name: str, cache_dir: str = DEFAULT_ONNX_DIR,
+                 threads: Optional[int] = None, batch_size: int = 32, quantize: bool = True):
+        """
+        threads: число потоков onnxruntime (None — по числу ядер).
+        batch_size: размер пакета внутри одной группы близких по длине текстов.
+        """
+        import numpy as np
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.np = np
+        self.model_name = model_name
+        self.batch_size = batch_size
+        model_path = export_model(model_name, cache_dir, quantize)
+        self.tokenizer = AutoTokenizer.from_pretrained(os.path.dirname(model_path))
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = threads or os.cpu_count() or 1
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        # Сессия onnxruntime потокобезопасна, а токенизатор — нет
+        self._tokenizer_lock = threading.Lock()
+
+    def _encode_batch(self, texts: List[str]):
+        np = self.np
+        with self._tokenizer_lock:
+            encoded = self.tokenizer(texts, padding=True, truncation=True,
+                                     max_length=MAX_SEQ_LENGTH, return_tensors="np")
+        feed = {name: encoded[name].astype(np.int64) for name in self.input_names if name in encoded}
+        hidden = self.session.run(None, feed)[0]
+
+        mask = encoded["attention_mask"][..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        return pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        np = self.np
+        with self._tokenizer_lock:
+            lengths = [len(ids) for ids in self.tokenizer(list(texts), truncation=True,
+                                                          max_length=MAX_SEQ_LENGTH)["input_ids"]]
+        # Пакеты из текстов близкой длины: меньше паддинга, меньше лишних вычислений
+        order = np.argsort(lengths, kind="stable")
+        vectors = np.empty((len(texts), 0), dtype=np.float32)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            encoded = self._encode_batch([texts[i] for i in batch])
+            if vectors.shape[1] == 0:
+                vectors = np.empty((len(texts), encoded.shape[1]), dtype=np.float32)
+            vectors[batch] = encoded
+        return vectors.tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
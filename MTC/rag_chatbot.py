@@ -1,40 +1,55 @@
 """
 RAG Чат-бот по конспектам
 Запуск: python rag_chatbot.py
+
+Тяжелые библиотеки (langchain, chromadb, sentence-transformers) импортируются
+при первом использовании, поэтому импорт модуля и запуск меню занимают доли секунды
 """
 
+import time
+_MODULE_STARTED = time.perf_counter()
+
 import os
 import sys
+import gc
+import glob
+import array
+import hashlib
+import threading
 import subprocess
-from typing import List
-from dataclasses import dataclass
+import importlib.util
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import TYPE_CHECKING, BinaryIO, Callable, Dict, List, Optional, Set, Tuple, Union
+from dataclasses import dataclass, replace
 import warnings
 warnings.filterwarnings('ignore')
 
+REQUIRED_PACKAGES = [
+    'langchain',
+    'langchain-community',
+    'chromadb',
+    'pypdf',
+    'sentence-transformers'
+]
+
+def find_missing_dependencies() -> List[str]:
+    """Список неустановленных библиотек (без их импорта)"""
+    return [package for package in REQUIRED_PACKAGES
+            if importlib.util.find_spec(package.replace('-', '_')) is None]
+
 # Функция для проверки и установки библиотек
 def check_and_install_dependencies():
     """Проверяет наличие всех необходимых библиотек и устанавливает их при необходимости"""
     
-    required_packages = [
-        'langchain',
-        'langchain-community',
-        'chromadb',
-        'pypdf',
-        'sentence-transformers'
-    ]
-    
-    missing_packages = []
-    
     print("🔍 Проверка установленных библиотек...")
     
-    for package in required_packages:
-        package_import = package.replace('-', '_')
-        try:
-            __import__(package_import)
-            print(f"   ✅ {package} установлен")
-        except ImportError:
+    missing_packages = find_missing_dependencies()
+    for package in REQUIRED_PACKAGES:
+        if package in missing_packages:
             print(f"   ❌ {package} не найден")
-            missing_packages.append(package)
+        else:
+            print(f"   ✅ {package} установлен")
     
     if missing_packages:
         print(f"\n📦 Устанавливаю отсутствующие библиотеки: {', '.join(missing_packages)}")
@@ -48,80 +63,223 @@ def check_and_install_dependencies():
     
     return True
 
-# Проверяем зависимости перед импортом
-if not check_and_install_dependencies():
-    print("\n❌ Не удалось установить все зависимости. Попробуйте установить их вручную:")
-    print("pip install langchain langchain-community chromadb pypdf sentence-transformers")
-    input("\nНажмите Enter для выхода...")
-    sys.exit(1)
+class _SimpleDocument:
+    """Свой класс Document, если LangChain его не предоставляет"""
+    def __init__(self, page_content="", metadata=None):
+        self.page_content = page_content
+        self.metadata = metadata or {}
+
+# Заполняются в _import_dependencies() при первом использовании
+PyPDFLoader = HuggingFaceEmbeddings = None
+Document = _SimpleDocument
+_IMPORT_SECONDS = None
+_import_lock = threading.Lock()
 
-# Теперь импортируем все необходимые библиотеки с правильными путями
-try:
-    from langchain_community.document_loaders import PyPDFLoader
-    from langchain_community.embeddings import HuggingFaceEmbeddings
-    from langchain_community.vectorstores import Chroma
+def _import_dependencies():
+    """Ленивый импорт тяжелых библиотек (один раз на процесс, потокобезопасно)"""
+    global PyPDFLoader, HuggingFaceEmbeddings, Document, _IMPORT_SECONDS
     
-    # В новых версиях LangChain Document находится в langchain_core
-    try:
-        from langchain_core.documents import Document
-        print("✅ Импорт Document из langchain_core.documents")
-    except ImportError:
-        try:
-            from langchain.schema import Document
-            print("✅ Импорт Document из langchain.schema")
-        except ImportError:
-            # Создаем свой класс Document если ничего не работает
-            class Document:
-                def __init__(self, page_content="", metadata=None):
-                    self.page_content = page_content
-                    self.metadata = metadata or {}
-            print("✅ Используется встроенный класс Document")
-    
-    # В новых версиях text_splitter может быть в разных местах
-    try:
-        from langchain.text_splitter import RecursiveCharacterTextSplitter
-        print("✅ Импорт text_splitter из langchain.text_splitter")
-    except ImportError:
+    if _IMPORT_SECONDS is not None:
+        return
+    with _import_lock:
+        if _IMPORT_SECONDS is not None:
+            return
+        started = time.perf_counter()
+        
+        from langchain_community.document_loaders import PyPDFLoader
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+        
+        # В новых версиях LangChain Document находится в langchain_core
         try:
-            from langchain_community.text_splitter import RecursiveCharacterTextSplitter
-            print("✅ Импорт text_splitter из langchain_community.text_splitter")
+            from langchain_core.documents import Document
         except ImportError:
             try:
-                from langchain_text_splitters import RecursiveCharacterTextSplitter
-                print("✅ Импорт text_splitter из langchain_text_splitters")
+                from langchain.schema import Document
             except ImportError:
-                # Свой простой сплиттер
-                class RecursiveCharacterTextSplitter:
-                    def __init__(self, chunk_size=500, chunk_overlap=50, separators=None, length_function=len):
-                        self.chunk_size = chunk_size
-                        self.chunk_overlap = chunk_overlap
-                        self.separators = separators or ["\n\n", "\n", ".", "!", "?", ",", " ", ""]
-                        self.length_function = length_function
-                    
-                    def split_documents(self, documents):
-                        chunks = []
-                        for doc in documents:
-                            text = doc.page_content
-                            # Простое разбиение по символам
-                            for i in range(0, len(text), self.chunk_size - self.chunk_overlap):
-                                chunk_text = text[i:i + self.chunk_size]
-                                if chunk_text:
-                                    chunks.append(Document(
-                                        page_content=chunk_text,
-                                        metadata=doc.metadata
-                                    ))
-                        return chunks
-                
-                print("✅ Используется встроенный сплиттер")
+                Document = _SimpleDocument
+        
+        _IMPORT_SECONDS = time.perf_counter() - started
+
+from embedding_cache import CachedEmbeddings, EmbeddingCache, DEFAULT_CACHE_PATH, normalize_text
+from query_cache import LRUCache
+from bm25_index import BM25Index, reciprocal_rank_fusion, tokenize
+from index_stats import IndexStats
+from vector_backends import DUPLICATES_KEY, detect_backend, open_backend
+from metrics import MetricsRegistry
+from text_splitter import TokenBudgetSplitter, sentence_spans
+from search_filters import SearchFilter, parse_page_ranges
+from reranker import CrossEncoderReranker, RerankReport, DEFAULT_RERANK_MODEL
+from sentence_index import SentenceIndex, snippet
+
+# Снимки, шарды и индекс дубликатов (а с ними numpy) импортируются только при использовании
+if TYPE_CHECKING:
+    from dedup import NearDuplicateIndex, DedupReport
+
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+# Реализации модели эмбеддингов: PyTorch (sentence-transformers) или ONNX int8 (onnxruntime)
+EMBEDDING_BACKENDS = ("torch", "onnx")
+
+# Режимы поиска: векторный, лексический (BM25), гибридный (RRF) и автоматический выбор
+SEARCH_MODES = ("vector", "lexical", "hybrid", "auto", "rerank")
+
+def _hash_text(text: str) -> str:
+    """Хеш содержимого страницы или чанка"""
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+# PDF можно передать путем к файлу, байтами или открытым бинарным потоком (например, загрузкой Streamlit)
+PdfInput = Union[str, bytes, bytearray, memoryview, BinaryIO]
+
+def _pdf_stream(pdf: PdfInput) -> BinaryIO:
+    """Поток для чтения PDF из памяти (без копирования во временный файл)"""
+    if isinstance(pdf, (bytes, bytearray, memoryview)):
+        return BytesIO(pdf)
+    pdf.seek(0)
+    return pdf
+
+def _content_hash(pdf: PdfInput) -> str:
+    """SHA-256 содержимого PDF (файл читается блоками, буфер в памяти хешируется без копии)"""
+    digest = hashlib.sha256()
+    if isinstance(pdf, str):
+        with open(pdf, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+    elif isinstance(pdf, (bytes, bytearray, memoryview)):
+        digest.update(pdf)
+    elif hasattr(pdf, "getbuffer"):
+        digest.update(pdf.getbuffer())
+    else:
+        stream = _pdf_stream(pdf)
+        for block in iter(lambda: stream.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _make_chunk_id(source: str, page: int, chunk_hash: str, occurrence: int = 0) -> str:
+    """Стабильный id чанка: зависит только от документа, страницы и текста"""
+    return _hash_text(f"{source}|{page}|{chunk_hash}|{occurrence}")
+
+def _make_text_splitter():
+    """Сплиттер, которым режутся все документы: чанки по бюджету токенов модели эмбеддингов"""
+    return TokenBudgetSplitter.for_model(EMBEDDING_MODEL)
+
+def _iter_pdf_pages(pdf: PdfInput, source: Optional[str] = None):
+    """
+    Постраничное чтение PDF (страницы не накапливаются в памяти).
+    PDF из памяти разбирается тем же pypdf, что и в PyPDFLoader, поэтому хеши страниц совпадают
+    """
+    _import_dependencies()
+    if isinstance(pdf, str):
+        source = source or os.path.basename(pdf)
+        docs = PyPDFLoader(pdf).lazy_load()
+    else:
+        from pypdf import PdfReader
+        source = source or os.path.basename(getattr(pdf, "name", "") or "document.pdf")
+        docs = (Document(page_content=page.extract_text(), metadata={})
+                for page in PdfReader(_pdf_stream(pdf)).pages)
+    for i, doc in enumerate(docs):
+        # Добавляем номера страниц и хеши содержимого
+        doc.metadata["page"] = i + 1
+        doc.metadata["source"] = source
+        doc.metadata["page_hash"] = _hash_text(doc.page_content)
+        yield doc
+
+def _count_pdf_pages(pdf: PdfInput) -> int:
+    """Число страниц PDF без извлечения текста (0, если определить не удалось)"""
+    try:
+        from pypdf import PdfReader
+        return len(PdfReader(pdf if isinstance(pdf, str) else _pdf_stream(pdf)).pages)
+    except Exception:
+        return 0
+
+def _current_rss_mb() -> float:
+    """Текущее потребление памяти процессом (МБ)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # На macOS ru_maxrss в байтах, на Linux — в КБ
+        return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        return 0.0
+
+def _prepare_pdf(pdf_path: str, known_page_hashes: Dict[int, str]):
+    """
+    Загрузка и разбиение PDF (без эмбеддингов, можно запускать в отдельном процессе).
+    Страницы, хеш которых совпадает с known_page_hashes, не разбиваются.
+    Возвращает (число страниц, хеши всех страниц, чанки измененных страниц, время в секундах)
+    """
+    started = time.perf_counter()
+    splitter = _make_text_splitter()
+    page_hashes: Dict[int, str] = {}
+    chunks = []
+    for doc in _iter_pdf_pages(pdf_path):
+        page_hashes[doc.metadata["page"]] = doc.metadata["page_hash"]
+        if known_page_hashes.get(doc.metadata["page"]) != doc.metadata["page_hash"]:
+            chunks.extend(splitter.split_documents([doc]))
+    return len(page_hashes), page_hashes, chunks, time.perf_counter() - started
+
+class _IngestPlan:
+    """
+    Сравнение нового содержимого документа с индексом, страница за страницей.
+    Чанки получают стабильные id: один и тот же текст на той же странице — тот же id.
+    """
+    
+    def __init__(self, source: str, existing_pages: Dict[int, Tuple[str, List[str]]]):
+        self.source = source
+        self.existing_pages = existing_pages
+        self.existing_ids: Set[str] = {
+            chunk_id for _, ids in existing_pages.values() for chunk_id in ids
+        }
+        self.keep_ids: Set[str] = set()
+        self.new_count = 0
+        # Чанки с неизменным текстом на измененных страницах: нужно обновить только метаданные
+        self.moved_ids: List[str] = []
+        self.moved_metadatas: List[dict] = []
+        self._occurrences: Dict[Tuple[int, str], int] = {}
     
-    print("\n✅ Все библиотеки успешно загружены!")
+    def known_page_hashes(self) -> Dict[int, str]:
+        return {page: page_hash for page, (page_hash, _) in self.existing_pages.items()}
+    
+    def page_unchanged(self, page: int, page_hash: str) -> bool:
+        """Страница уже проиндексирована в том же виде (ее чанки остаются как есть)"""
+        old_hash, ids = self.existing_pages.get(page, ("", []))
+        if ids and old_hash == page_hash:
+            self.keep_ids.update(ids)
+            return True
+        return False
     
-except ImportError as e:
-    print(f"\n❌ Ошибка импорта: {e}")
-    print("\nПопробуйте выполнить команду:")
-    print("pip install --upgrade langchain langchain-community langchain-core")
-    input("\nНажмите Enter для выхода...")
-    sys.exit(1)
+    def add_chunks(self, chunks: list) -> Tuple[list, List[str]]:
+        """Чанки измененных страниц -> (чанки, которым нужны эмбеддинги, их id)"""
+        new_chunks, new_ids = [], []
+        for chunk in chunks:
+            chunk_hash = _hash_text(chunk.page_content)
+            key = (chunk.metadata["page"], chunk_hash)
+            occurrence = self._occurrences.get(key, 0)
+            self._occurrences[key] = occurrence + 1
+            chunk.metadata["chunk_hash"] = chunk_hash
+            chunk_id = _make_chunk_id(self.source, chunk.metadata["page"], chunk_hash, occurrence)
+            if chunk_id in self.existing_ids:
+                self.keep_ids.add(chunk_id)
+                self.moved_ids.append(chunk_id)
+                self.moved_metadatas.append(chunk.metadata)
+            elif chunk_id not in self.keep_ids:
+                self.keep_ids.add(chunk_id)
+                new_chunks.append(chunk)
+                new_ids.append(chunk_id)
+        self.new_count += len(new_chunks)
+        return new_chunks, new_ids
+    
+    def stale_ids(self) -> List[str]:
+        """Чанки, которых больше нет в документе (известно только после всех страниц)"""
+        return list(self.existing_ids - self.keep_ids)
+    
+    @property
+    def unchanged_count(self) -> int:
+        return len(self.keep_ids) - self.new_count
 
 @dataclass
 class ChunkInfo:
@@ -130,124 +288,1180 @@ class ChunkInfo:
     page: int
     source: str
     relevance_score: float = 0.0
+    chunk_id: str = ""
+
+class IngestCancelled(Exception):
+    """Обработка документа отменена (см. cancel_event в process_pdf)"""
+
+@dataclass
+class IngestProgress:
+    """Ход обработки документа (передается в progress_callback)"""
+    source: str
+    pages_total: int = 0
+    pages_done: int = 0
+    chunks_new: int = 0
+    chunks_embedded: int = 0
+    # Почти одинаковые чанки, которые не записаны (см. dedup.py)
+    chunks_duplicate: int = 0
+    memory_mb: float = 0.0
+    finished: bool = False
+    
+    @property
+    def fraction(self) -> float:
+        if self.finished:
+            return 1.0
+        if not self.pages_total:
+            return 0.0
+        return min(self.pages_done / self.pages_total, 1.0)
+
+def _chunk_from_record(text: str, metadata: dict, score: float, chunk_id: str = "") -> ChunkInfo:
+    """ChunkInfo из записи хранилища"""
+    metadata = metadata or {}
+    return ChunkInfo(
+        text=text,
+        page=metadata.get('page', 0),
+        source=metadata.get('source', 'unknown'),
+        relevance_score=score,
+        chunk_id=chunk_id
+    )
+
+class _LazyEmbeddings:
+    """Прокси модели эмбеддингов бота: модель загружается при первом вызове"""
+    
+    def __init__(self, bot: "SimpleRAGBot"):
+        self._bot = bot
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._bot.embeddings.embed_documents(texts)
+    
+    def embed_query(self, text: str) -> List[float]:
+        return self._bot.embeddings.embed_query(text)
 
 class SimpleRAGBot:
     """Простой RAG бот для работы с конспектами"""
     
-    def __init__(self, persist_directory: str = "./chroma_db"):
+    def __init__(self, persist_directory: str = "./chroma_db",
+                 embedding_cache_path: Optional[str] = DEFAULT_CACHE_PATH,
+                 search_mode: str = "vector", lazy: bool = True, warm_up: bool = False,
+                 backend: Optional[str] = None, quantization: Optional[str] = None,
+                 index: Optional[str] = None, nprobe: int = 8,
+                 embedding_backend: str = "torch", embedding_threads: Optional[int] = None,
+                 metrics: bool = True, rerank_model: str = DEFAULT_RERANK_MODEL,
+                 rerank_candidates: int = 30, rerank_budget_ms: float = 200.0,
+                 dedup: bool = True, dedup_threshold: float = 0.8, highlights: bool = True,
+                 snapshot: Optional[str] = None, shards: Optional[str] = None,
+                 shard_workers: Optional[int] = None):
+        """
+        lazy=True: модель и БД загружаются при первом обращении, а не в конструкторе.
+        warm_up=True: загрузка сразу запускается в фоновом потоке.
+        backend: "chroma" или "numpy" (memory-mapped матрица); по умолчанию определяется
+        по содержимому persist_directory, для новой БД — "chroma".
+        quantization: "float16", "int8" или "none" — сжатая копия векторов для хранилища numpy
+        (поиск по сжатой копии с точным пересчетом кандидатов); None — режим существующей БД.
+        index: "flat" или "ivf" — приближенный поиск по кластерам для хранилища numpy;
+        nprobe — сколько кластеров просматривается по умолчанию (больше — точнее, но медленнее).
+        embedding_backend: "torch" или "onnx" — квантованная int8 модель в onnxruntime
+        с пакетами по длине текстов; embedding_threads — число потоков для "onnx".
+        metrics: замеры времени этапов поиска и загрузки (bot.metrics).
+        rerank_*: режим поиска "rerank" — rerank_candidates кандидатов гибридного поиска
+        переранжируются моделью cross-encoder, пока запрос укладывается в rerank_budget_ms.
+        dedup: почти одинаковые чанки (сходство Жаккара по MinHash не меньше dedup_threshold)
+        при загрузке не записываются в БД, см. dedup.py.
+        highlights: при загрузке сохраняются эмбеддинги предложений чанков (через кеш
+        эмбеддингов, как и чанки), а в ответе показываются предложения, ближайшие к вопросу
+        (см. sentence_index.py).
+        snapshot: файл снимка индекса (snapshot.py) — поиск идет по нему, без Chroma и папки БД;
+        индекс в этом режиме только для чтения.
+        shards: папка шардированного индекса (sharded.py) — векторный поиск идет параллельно
+        в shard_workers процессах; тоже только для чтения.
+        """
+        if search_mode not in SEARCH_MODES:
+            raise ValueError(f"Неизвестный режим поиска: {search_mode}")
+        if embedding_backend not in EMBEDDING_BACKENDS:
+            raise ValueError(f"Неизвестная реализация эмбеддингов: {embedding_backend}")
+        started = time.perf_counter()
         self.persist_directory = persist_directory
+        if snapshot is not None and shards is not None:
+            raise ValueError("Укажите снимок или шардированный индекс, но не оба")
+        self.snapshot_path = snapshot
+        self.shards_path = shards
+        self.shard_workers = shard_workers
+        # Снимок или шарды: индекс только для чтения
+        self.read_only_path = snapshot or shards
+        if snapshot is not None:
+            from snapshot import SnapshotBackend, read_header
+            header, self.backend_name = read_header(snapshot), SnapshotBackend.name
+        elif shards is not None:
+            from sharded import ShardedBackend, read_manifest
+            header, self.backend_name = read_manifest(shards), ShardedBackend.name
+        else:
+            header, self.backend_name = {}, backend or detect_backend(persist_directory)
+        if self.read_only_path is not None:
+            # Индекс, построенный другой моделью, дал бы бессмысленные результаты
+            if header.get("model") and header["model"] != EMBEDDING_MODEL:
+                raise ValueError(f"Индекс построен моделью {header['model']}, а используется {EMBEDDING_MODEL}")
+            if header.get("embedding_backend") and header["embedding_backend"] != embedding_backend:
+                print(f"⚠️ Индекс построен реализацией эмбеддингов {header['embedding_backend']}, "
+                      f"а запросы будут считаться {embedding_backend}")
+        if quantization not in (None, "none") and self.backend_name != "numpy":
+            raise ValueError("Квантизация поддерживается только хранилищем numpy")
+        if index not in (None, "flat") and self.backend_name != "numpy":
+            raise ValueError("Индекс IVF поддерживается только хранилищем numpy")
+        self.quantization = quantization
+        self.index = index
+        self.nprobe = nprobe
+        self._quantization_report = None
+        self.search_mode = search_mode
+        self.embedding_cache_path = embedding_cache_path
+        self.embedding_backend = embedding_backend
+        self.embedding_threads = embedding_threads
+        self.reranker = CrossEncoderReranker(rerank_model)
+        self.rerank_candidates = rerank_candidates
+        self.rerank_budget_ms = rerank_budget_ms
+        # Отчет о бюджете последнего запроса в режиме "rerank" (свой у каждого потока)
+        self._trace = threading.local()
+        # Индекс MinHash/LSH для удаления дубликатов загружается при первой записи
+        self.dedup_enabled = dedup
+        self.dedup_threshold = dedup_threshold
+        self.dedup_path = os.path.join(persist_directory, "dedup_index.pkl")
+        self.dedup: Optional["NearDuplicateIndex"] = None
+        # Эмбеддинги предложений для подсветки ответа (загружаются при первом обращении)
+        self.highlights_enabled = highlights
+        self.sentences_path = os.path.join(persist_directory, "sentence_index")
+        self.sentences: Optional[SentenceIndex] = None
+        
+        # Таймеры и счетчики этапов; выключенный реестр почти ничего не стоит
+        self.metrics = MetricsRegistry(enabled=metrics)
+        
+        # Время запуска по этапам (секунды): импорт модуля, библиотек, модель, БД
+        self.startup_timings: Dict[str, float] = {"module": MODULE_IMPORT_SECONDS}
+        self._load_lock = threading.RLock()
+        self._embeddings = None
+        self._vector_store = None
+        self._db_ready = threading.Event()
+        self._db_loading = False
+        self._warm_up_thread = None
+        # Хранилище получает прокси: открытие БД не требует загрузки модели
+        self._lazy_embeddings = _LazyEmbeddings(self)
+        
+        # Кеши поиска: нормализованный запрос -> эмбеддинг,
+        # (эмбеддинг, k, версия индекса) -> результаты
+        self.index_version = 0
+        self.query_embedding_cache = LRUCache(max_size=2048, ttl=24 * 3600)
+        self.search_cache = LRUCache(max_size=1024, ttl=3600)
+        # id чанков, прошедших фильтр (для лексического поиска): ключ — (условие, версия индекса)
+        self.filter_ids_cache = LRUCache(max_size=64)
+        
+        # Лексический индекс BM25 хранится рядом с векторным хранилищем
+        self.lexical_index_path = os.path.join(persist_directory, "bm25_index.pkl")
+        self.lexical_index = BM25Index()
+        # Лексический индекс изменяется при загрузке и читается при поиске из разных потоков
+        self._index_lock = threading.RLock()
+        # Лексический индекс снимка читается в фоне: векторный поиск доступен сразу
+        self._lexical_ready = threading.Event()
+        self._lexical_ready.set()
+        
+        # Статистика читается из маленького JSON-файла без открытия хранилища
+        # (у снимка она хранится в заголовке и читается при открытии)
+        self.stats_path = os.path.join(persist_directory, "index_stats.json")
+        self.stats = IndexStats.load(self.stats_path) if self.read_only_path is None else None
+        
+        self.startup_timings["init"] = time.perf_counter() - started
+        if not lazy:
+            self.warm_up()
+        elif warm_up:
+            self.start_warm_up()
+    
+    @property
+    def embeddings(self):
+        """Модель эмбеддингов (загружается при первом обращении)"""
+        if self._embeddings is None:
+            with self._load_lock:
+                if self._embeddings is None:
+                    self._embeddings = self._load_embeddings()
+        return self._embeddings
+    
+    @property
+    def vector_store(self):
+        """Векторное хранилище (существующая БД открывается при первом обращении)"""
+        self._ensure_db_loaded()
+        return self._vector_store
+    
+    @vector_store.setter
+    def vector_store(self, value):
+        self._vector_store = value
+    
+    @property
+    def chunks_count(self) -> int:
+        """Число фрагментов в БД (из сохраненной статистики, за O(1))"""
+        if self.stats is None:
+            self._ensure_db_loaded()
+        return self.stats.total_chunks if self.stats else 0
+    
+    def _load_embeddings(self):
+        """Загрузка модели эмбеддингов"""
+        _import_dependencies()
+        self.startup_timings["imports"] = _IMPORT_SECONDS
         print("\n🔄 Загрузка модели эмбеддингов...")
+        started = time.perf_counter()
         
         try:
-            self.embeddings = HuggingFaceEmbeddings(
-                model_name="sentence-transformers/all-MiniLM-L6-v2",
-                model_kwargs={'device': 'cpu'}
-            )
+            if self.embedding_backend == "onnx":
+                from onnx_embeddings import OnnxEmbeddings
+                embeddings = OnnxEmbeddings(EMBEDDING_MODEL, threads=self.embedding_threads)
+                # Векторы int8 модели немного отличаются: в кеше они хранятся отдельно
+                cache_model_name = f"{EMBEDDING_MODEL}#onnx-int8"
+            else:
+                embeddings = HuggingFaceEmbeddings(
+                    model_name=EMBEDDING_MODEL,
+                    model_kwargs={'device': 'cpu'}
+                )
+                cache_model_name = EMBEDDING_MODEL
             print("✅ Модель эмбеддингов загружена")
+            
+            # Дисковый кеш эмбеддингов переживает очистку БД и повторные загрузки
+            if self.embedding_cache_path:
+                embeddings = CachedEmbeddings(
+                    embeddings, EmbeddingCache(self.embedding_cache_path), cache_model_name
+                )
         except Exception as e:
             print(f"❌ Ошибка загрузки модели: {e}")
             raise
         
-        self.vector_store = None
-        self.chunks_count = 0
-        
-        # Пробуем загрузить существующую БД
-        self._load_existing_db()
+        self.startup_timings["model"] = time.perf_counter() - started
+        return embeddings
+    
+    def _ensure_db_loaded(self):
+        """Однократная загрузка существующей БД (повторный вызов из самой загрузки игнорируется)"""
+        if self._db_ready.is_set():
+            return
+        with self._load_lock:
+            if self._db_ready.is_set() or self._db_loading:
+                return
+            self._db_loading = True
+            started = time.perf_counter()
+            try:
+                if self.read_only_path:
+                    self._load_snapshot()
+                else:
+                    _import_dependencies()
+                    self.startup_timings["imports"] = _IMPORT_SECONDS
+                    self.lexical_index = BM25Index.load(self.lexical_index_path)
+                    self._load_existing_db()
+            finally:
+                self.startup_timings["database"] = time.perf_counter() - started
+                self._db_loading = False
+                self._db_ready.set()
+    
+    def warm_up(self):
+        """Импорт библиотек, загрузка модели и БД заранее"""
+        try:
+            self._ensure_db_loaded()
+            self.embeddings
+            if self.search_mode == "rerank":
+                self.reranker.load()
+        except Exception as e:
+            print(f"⚠️ Ошибка фоновой загрузки: {e}")
+    
+    def start_warm_up(self) -> threading.Thread:
+        """Запуск warm_up() в фоновом потоке"""
+        if self._warm_up_thread is None:
+            self._warm_up_thread = threading.Thread(target=self.warm_up, name="rag-warm-up", daemon=True)
+            self._warm_up_thread.start()
+        return self._warm_up_thread
+    
+    @property
+    def last_rerank(self) -> Optional[RerankReport]:
+        """Распределение бюджета последнего запроса "rerank" в текущем потоке (None — из кеша)"""
+        return getattr(self._trace, "rerank", None)
+    
+    @property
+    def is_ready(self) -> bool:
+        """Модель и БД уже загружены"""
+        return self._embeddings is not None and self._db_ready.is_set()
+    
+    def metrics_text(self) -> str:
+        """Метрики в текстовом формате Prometheus (таймеры этапов, счетчики и состояние индекса)"""
+        gauges = {
+            "rag_chunks": self.stats.total_chunks if self.stats else 0,
+            "rag_index_version": self.index_version,
+            "rag_search_cache_entries": len(self.search_cache),
+            "rag_search_cache_hit_rate": self.search_cache.hit_rate,
+        }
+        lines = [f"# TYPE {name} gauge\n{name} {value:g}" for name, value in gauges.items()]
+        return self.metrics.to_prometheus() + "\n".join(lines) + "\n"
+    
+    def quantization_report(self, sample: int = 50, k: int = 10) -> Optional[dict]:
+        """
+        Экономия памяти и recall@k сжатого хранения векторов (None, если хранилище его не поддерживает).
+        Отчет запоминается до следующего изменения индекса: оценка recall требует полных просмотров.
+        """
+        store = self.vector_store
+        if store is None or not hasattr(store, "quantization_report"):
+            return None
+        key = (self.index_version, sample, k)
+        if self._quantization_report is None or self._quantization_report[0] != key:
+            self._quantization_report = (key, store.quantization_report(sample=sample, k=k))
+        return self._quantization_report[1]
     
     def _load_existing_db(self) -> bool:
         """Загрузка существующей базы данных"""
         if os.path.exists(self.persist_directory):
             try:
                 print("🔄 Загрузка существующей базы данных...")
-                self.vector_store = Chroma(
-                    persist_directory=self.persist_directory,
-                    embedding_function=self.embeddings
-                )
-                # Получаем количество чанков
-                self.chunks_count = len(self.vector_store.get()['ids'])
-                print(f"✅ Загружена существующая БД с {self.chunks_count} фрагментами")
+                self.vector_store = self._open_backend()
+                # БД, созданная до появления файла статистики: считаем один раз
+                if self.stats is None:
+                    self.stats = self._rebuild_stats()
+                    self.stats.save(self.stats_path)
+                print(f"✅ Загружена существующая БД с {self.stats.total_chunks} фрагментами")
+                
+                # БД, созданная до появления лексического индекса
+                if self.stats.total_chunks and not len(self.lexical_index):
+                    print("🔄 Построение лексического индекса...")
+                    existing = self._vector_store.get(include=["documents"])
+                    self.lexical_index.add(existing['ids'], existing['documents'])
+                    self.lexical_index.save(self.lexical_index_path)
                 return True
             except Exception as e:
                 print(f"⚠️ Ошибка загрузки БД: {e}")
                 return False
         return False
     
-    def process_pdf(self, pdf_path: str) -> bool:
-        """Обработка PDF файла"""
-        if not os.path.exists(pdf_path):
-            print(f"❌ Файл {pdf_path} не найден")
+    def _load_snapshot(self):
+        """
+        Открытие снимка или шардированного индекса: векторы отображаются в память,
+        тексты читаются по мере надобности, лексический индекс загружается в фоне
+        """
+        if self.shards_path:
+            from sharded import ShardedBackend
+            print(f"🔄 Загрузка шардированного индекса {self.shards_path}...")
+            store = ShardedBackend(self.shards_path, workers=self.shard_workers, nprobe=self.nprobe)
+        else:
+            from snapshot import SnapshotBackend
+            print(f"🔄 Загрузка снимка индекса {self.snapshot_path}...")
+            store = SnapshotBackend(self.snapshot_path, nprobe=self.nprobe)
+        self.vector_store = store
+        self.stats = store.stats or self._rebuild_stats()
+        self.stats.disk_bytes = store.disk_bytes
+        self._lexical_ready.clear()
+        threading.Thread(target=self._load_snapshot_lexical, args=(store,),
+                         name="rag-snapshot-bm25", daemon=True).start()
+        if self.shards_path:
+            print(f"✅ Загружено {len(store.paths)} шардов с {self.stats.total_chunks} фрагментами "
+                  f"(процессов поиска: {store.workers})")
+        else:
+            print(f"✅ Загружен снимок с {self.stats.total_chunks} фрагментами")
+    
+    def _load_snapshot_lexical(self, store):
+        """Чтение лексического индекса снимка (лексический поиск ждет его завершения)"""
+        try:
+            with self.metrics.timer("snapshot.load_bm25"):
+                lexical_index = store.lexical_index()
+                if lexical_index is None:
+                    lexical_index = BM25Index()
+                if not len(lexical_index) and store.count():
+                    existing = store.get(include=["documents"])
+                    lexical_index.add(existing['ids'], existing['documents'])
+            with self._index_lock:
+                self.lexical_index = lexical_index
+        except Exception as e:
+            print(f"⚠️ Ошибка загрузки лексического индекса снимка: {e}")
+        finally:
+            self._lexical_ready.set()
+    
+    def _check_writable(self) -> bool:
+        """Индекс из снимка или шардов только для чтения"""
+        if self.read_only_path:
+            print(f"❌ Индекс открыт из {'снимка' if self.snapshot_path else 'шардов'} только для чтения")
             return False
+        return True
+    
+    def export_snapshot(self, path: str) -> Optional[dict]:
+        """
+        Запись индекса (векторы, тексты, метаданные, BM25, статистика, модель) в один файл.
+        Возвращает сводку (строки, размер, время) или None, если БД пуста
+        """
+        from snapshot import write_snapshot
+        store = self.vector_store
+        if store is None or not store.count():
+            print("❌ База данных пуста, снимок не записан")
+            return None
+        print(f"📦 Запись снимка индекса: {path}")
+        # Лексический индекс не должен меняться, пока он сериализуется
+        self._lexical_ready.wait()
+        with self.metrics.timer("snapshot.export"), self._index_lock:
+            summary = write_snapshot(path, store, lexical_index=self.lexical_index, stats=self.stats,
+                                     model=EMBEDDING_MODEL, embedding_backend=self.embedding_backend)
+        print(f"✅ Снимок записан: {summary['rows']} фрагментов, {summary['size_mb']:.2f} MB "
+              f"за {summary['seconds']:.1f} с")
+        return summary
+    
+    def export_shards(self, directory: str, shards: int, by: str = "source") -> Optional[dict]:
+        """
+        Деление индекса на shards шардов (по документам или по хешу id) для параллельного поиска.
+        Возвращает сводку (строки, размеры шардов, время) или None, если БД пуста
+        """
+        from sharded import write_shards
+        store = self.vector_store
+        if store is None or not store.count():
+            print("❌ База данных пуста, шарды не записаны")
+            return None
+        print(f"🧩 Запись {shards} шардов в {directory}")
+        self._lexical_ready.wait()
+        with self.metrics.timer("snapshot.export_shards"), self._index_lock:
+            summary = write_shards(directory, store, shards, by=by, lexical_index=self.lexical_index,
+                                   stats=self.stats, model=EMBEDDING_MODEL,
+                                   embedding_backend=self.embedding_backend)
+        print(f"✅ Шарды записаны: {summary['rows']} фрагментов "
+              f"({', '.join(str(rows) for rows in summary['shards'])}) за {summary['seconds']:.1f} с")
+        return summary
+    
+    def _rebuild_stats(self) -> IndexStats:
+        """Полный пересчет статистики по метаданным коллекции"""
+        stats = IndexStats()
+        records = self._vector_store.get(include=["metadatas"])
+        per_source: Dict[str, Tuple[int, Set[int]]] = {}
+        for metadata in records['metadatas']:
+            chunks, pages = per_source.setdefault(metadata.get('source', 'unknown'), (0, set()))
+            pages.add(metadata.get('page', 0))
+            per_source[metadata.get('source', 'unknown')] = (chunks + 1, pages)
+        for source, (chunks, pages) in per_source.items():
+            stats.update_source(source, chunks, len(pages))
+        stats.refresh_disk_size(self.persist_directory)
+        return stats
+    
+    def _open_backend(self):
+        """Открытие (или создание) векторного хранилища выбранного типа"""
+        return open_backend(self.backend_name, self.persist_directory, self._lazy_embeddings,
+                            quantization=self.quantization, index=self.index, nprobe=self.nprobe)
+    
+    def _ensure_vector_store(self):
+        """Открывает (или создает пустое) векторное хранилище"""
+        if self.vector_store is None:
+            self.vector_store = self._open_backend()
+        return self.vector_store
+    
+    def _get_source_index(self, source: str) -> Dict[int, Tuple[str, List[str]]]:
+        """Уже проиндексированные страницы документа: {страница: (хеш страницы, [id чанков])}"""
+        existing = self.vector_store.get(where={"source": source}, include=["metadatas"])
+        pages: Dict[int, Tuple[str, List[str]]] = {}
+        records = list(zip(existing['ids'], existing['metadatas']))
+        if self.dedup_enabled:
+            # Отброшенные дубликаты тоже часть документа: иначе они считались бы новыми
+            records.extend((record.chunk_id, record.metadata)
+                           for record in self._dedup_index().dropped_for_source(source))
+        for chunk_id, metadata in records:
+            page = metadata.get('page', 0)
+            page_hash, ids = pages.get(page, (metadata.get('page_hash', ''), []))
+            ids.append(chunk_id)
+            pages[page] = (page_hash, ids)
+        return pages
+    
+    def _stats(self) -> IndexStats:
+        """Статистика для обновления (создается при первой записи в пустую БД)"""
+        if self.stats is None:
+            self.stats = IndexStats()
+        return self.stats
+    
+    def _apply_moved(self, plan: _IngestPlan):
+        """Обновление метаданных чанков, текст которых не изменился"""
+        if plan.moved_ids:
+            ids, metadatas = plan.moved_ids, plan.moved_metadatas
+            if self.dedup is not None:
+                ids, metadatas = self.dedup.update_metadata(ids, metadatas)
+            if ids:
+                self.vector_store.update(ids=ids, metadatas=self._with_duplicates(ids, metadatas))
+            self._sync_duplicates()
+            plan.moved_ids, plan.moved_metadatas = [], []
+    
+    def _dedup_index(self) -> "NearDuplicateIndex":
+        """Индекс дубликатов (для БД, созданной без него, подписи существующих чанков считаются один раз)"""
+        if self.dedup is None:
+            from dedup import NearDuplicateIndex
+            store = self._ensure_vector_store()
+            # Представитель из другого документа возможен, только если хранилище помнит места дубликатов
+            self.dedup = NearDuplicateIndex.load(self.dedup_path, threshold=self.dedup_threshold,
+                                                 cross_document=getattr(store, "supports_duplicates", False))
+            if not len(self.dedup) and store.count():
+                with self.metrics.timer("ingest.dedup_bootstrap"):
+                    records = store.get(include=["documents", "metadatas"])
+                    for chunk_id, text, metadata in zip(records['ids'], records['documents'],
+                                                        records['metadatas']):
+                        self.dedup.add(chunk_id, self.dedup.signature(text), (metadata or {}).get("source"))
+        return self.dedup
+    
+    def _with_duplicates(self, ids: List[str], metadatas: List[dict]) -> List[dict]:
+        """Метаданные с местами дубликатов, за которые стоят чанки (поле DUPLICATES_KEY)"""
+        if self.dedup is None or not getattr(self.vector_store, "supports_duplicates", False):
+            return metadatas
+        result = []
+        for chunk_id, metadata in zip(ids, metadatas):
+            locations = self.dedup.locations(chunk_id)
+            metadata = {key: value for key, value in metadata.items() if key != DUPLICATES_KEY}
+            if locations:
+                metadata[DUPLICATES_KEY] = locations
+            result.append(metadata)
+        return result
+    
+    def _sync_duplicates(self):
+        """Запись в хранилище мест дубликатов у представителей, группы которых изменились"""
+        if self.dedup is None:
+            return
+        touched = self.dedup.take_touched()
+        if touched and getattr(self.vector_store, "supports_duplicates", False):
+            records = self.vector_store.get(ids=sorted(touched), include=["metadatas"])
+            if records['ids']:
+                self.vector_store.update(ids=records['ids'],
+                                         metadatas=self._with_duplicates(records['ids'], records['metadatas']))
+    
+    def _sentence_index(self) -> SentenceIndex:
+        """Эмбеддинги предложений (с диска при первом обращении)"""
+        if self.sentences is None:
+            self.sentences = SentenceIndex.load(self.sentences_path)
+        return self.sentences
+    
+    def highlight(self, question: str, chunks: List[ChunkInfo], top: int = 2) -> List[List[Tuple[int, int]]]:
+        """
+        Лучшие предложения каждого фрагмента (границы в chunk.text, по убыванию сходства с вопросом).
+        Используется уже посчитанный при поиске эмбеддинг вопроса, модель не вызывается;
+        пустой список — для фрагмента нет сохраненных предложений или вектора вопроса
+        """
+        embedding = self.query_embedding_cache.get(normalize_text(question).lower())
+        if (embedding is None or not self.highlights_enabled or self.read_only_path
+                or not os.path.exists(self.sentences_path + ".json") and self.sentences is None):
+            return [[] for _ in chunks]
+        with self.metrics.timer("answer.highlight"):
+            return self._sentence_index().best_sentences([chunk.chunk_id for chunk in chunks], embedding, top)
+    
+    def dedup_report(self) -> Optional[dict]:
+        """Сколько чанков записано и сколько дубликатов отброшено (None — индекса еще нет)"""
+        if self.read_only_path or (
+                self.dedup is None and not (self.dedup_enabled and os.path.exists(self.dedup_path))):
+            return None
+        index = self._dedup_index()
+        return {
+            "stored": len(index),
+            "dropped": len(index.dropped),
+            "ratio": len(index.dropped) / max(len(index) + len(index.dropped), 1),
+        }
+    
+    def _dropped_count(self, source: str) -> int:
+        """Сколько чанков документа отброшено как дубликаты"""
+        return len(self.dedup.dropped_for_source(source)) if self.dedup is not None else 0
+    
+    def _upsert_chunks(self, chunks: list, ids: List[str], dedup: bool = True,
+                       report: Optional["DedupReport"] = None) -> int:
+        """
+        Эмбеддинг чанков одним пакетом и массовая запись в хранилище.
+        Почти одинаковые чанки отбрасываются до эмбеддинга. Возвращает число записанных чанков
+        """
+        if dedup and self.dedup_enabled and chunks:
+            with self.metrics.timer("ingest.dedup"):
+                kept = self._dedup_index().filter(ids, [chunk.page_content for chunk in chunks],
+                                                  [chunk.metadata for chunk in chunks], report)
+            self.metrics.count("ingest.chunks_deduplicated", len(chunks) - len(kept))
+            if len(kept) < len(chunks):
+                chunks = [chunks[i] for i in kept]
+                ids = [ids[i] for i in kept]
+            if not chunks:
+                return 0
+        texts = [chunk.page_content for chunk in chunks]
+        spans = [sentence_spans(text) for text in texts] if self.highlights_enabled else []
+        # Чанку из одного предложения хватает своего вектора
+        sentences = [text[start:end] for text, chunk_spans in zip(texts, spans) if len(chunk_spans) > 1
+                     for start, end in chunk_spans]
+        with self.metrics.timer("ingest.embed"):
+            # Предложения тоже через дисковый кеш: повторная загрузка и перестроение индекса
+            # не вызывают модель для уже виденных предложений
+            embeddings = self.embeddings.embed_documents(texts + sentences)
+            sentence_embeddings = iter(embeddings[len(texts):])
+            embeddings = embeddings[:len(texts)]
+        with self.metrics.timer("ingest.persist"):
+            self.vector_store.upsert(
+                ids=ids,
+                embeddings=embeddings,
+                metadatas=self._with_duplicates(ids, [chunk.metadata for chunk in chunks]),
+                documents=texts
+            )
+            if self.dedup is not None:
+                # Места дубликатов записанных сейчас чанков уже в их метаданных
+                self.dedup.touched.difference_update(ids)
+                self._sync_duplicates()
+        with self.metrics.timer("ingest.lexical"), self._index_lock:
+            self.lexical_index.add(ids, texts)
+        if spans:
+            self._sentence_index().add(ids, spans, [
+                [next(sentence_embeddings) for _ in chunk_spans] if len(chunk_spans) > 1 else [embedding]
+                for chunk_spans, embedding in zip(spans, embeddings)
+            ])
+            self.metrics.count("ingest.sentences_embedded", len(sentences))
+        self.metrics.count("ingest.chunks_embedded", len(chunks))
+        return len(chunks)
+    
+    def _delete_chunks(self, ids: List[str]):
+        """
+        Удаление чанков из векторного и лексического индексов.
+        Если удален представитель группы дубликатов, вместо него записывается один из дубликатов
+        """
+        with self.metrics.timer("ingest.delete"):
+            self.vector_store.delete(ids=ids)
+            with self._index_lock:
+                self.lexical_index.remove(ids)
+            if self.highlights_enabled:
+                self._sentence_index().remove(ids)
+        self.metrics.count("ingest.chunks_deleted", len(ids))
+        if self.dedup_enabled:
+            promoted = self._dedup_index().remove(ids)
+            if promoted:
+                self._upsert_chunks([Document(page_content=record.text, metadata=record.metadata)
+                                     for record in promoted],
+                                    [record.chunk_id for record in promoted], dedup=False)
+                if self.stats is not None:
+                    for record in promoted:
+                        self.stats.add_chunks(record.metadata.get("source", "unknown"), 1)
+                self.metrics.count("ingest.chunks_promoted", len(promoted))
+            self._sync_duplicates()
+    
+    def _lexical_search(self, query: str, k: int, where: Optional[dict] = None) -> List[Tuple[str, float]]:
+        allowed = self._filter_ids(where) if where else None
+        self._lexical_ready.wait()
+        with self.metrics.timer("search.lexical"), self._index_lock:
+            return self.lexical_index.search(query, k, allowed=allowed)
+    
+    def _filter_ids(self, where: dict) -> Set[str]:
+        """id чанков, подходящих под условие (хранилище выбирает их по разделам документов)"""
+        key = (repr(where), self.index_version)
+        ids = self.filter_ids_cache.get(key)
+        if ids is None:
+            with self.metrics.timer("search.filter"):
+                ids = set(self.vector_store.get(where=where, include=[])['ids'])
+            self.filter_ids_cache.put(key, ids)
+        return ids
+    
+    def _after_index_update(self):
+        """Вызывается после любого изменения индекса"""
+        # Результаты поиска из кеша больше не актуальны
+        self.index_version += 1
+        if os.path.isdir(self.persist_directory):
+            with self.metrics.timer("ingest.save_indexes"):
+                with self._index_lock:
+                    self.lexical_index.save(self.lexical_index_path)
+                if self.dedup is not None:
+                    self.dedup.save(self.dedup_path)
+                if self.sentences is not None:
+                    self.sentences.save()
+                if self.stats is not None:
+                    self.stats.refresh_disk_size(self.persist_directory)
+                    self.stats.save(self.stats_path)
+    
+    def indexed_sources(self) -> List[str]:
+        """Имена загруженных документов (для выбора области поиска)"""
+        self._ensure_db_loaded()
+        return sorted(self.stats.sources) if self.stats else []
+    
+    def indexed_as(self, pdf: PdfInput, content_hash: Optional[str] = None) -> Optional[str]:
+        """Имя документа в БД с точно таким же содержимым (None, если такого нет)"""
+        self._ensure_db_loaded()
+        if self.stats is None:
+            return None
+        return self.stats.find_by_hash(content_hash or _content_hash(pdf))
+    
+    def process_pdf(self, pdf: PdfInput, batch_size: int = 64,
+                    max_memory_mb: Optional[float] = None,
+                    progress_callback: Optional[Callable[[IngestProgress], None]] = None,
+                    cancel_event: Optional[threading.Event] = None,
+                    source: Optional[str] = None) -> bool:
+        """
+        Потоковая обработка PDF: страница -> чанки -> пакет эмбеддингов -> запись.
+        pdf — путь к файлу, байты или бинарный поток (разбирается прямо из памяти);
+        source — имя документа в БД (по умолчанию имя файла).
+        Файл с тем же содержимым, что уже есть в БД, повторно не обрабатывается.
+        В памяти одновременно находится не больше одного пакета чанков; если потребление
+        памяти превышает max_memory_mb, размер пакета уменьшается.
+        Эмбеддинги считаются только для новых и измененных чанков.
+        Если установлен cancel_event, обработка останавливается, а уже записанные
+        новые чанки удаляются: в индексе остается прежняя версия документа.
+        """
+        if not self._check_writable():
+            return False
+        if isinstance(pdf, str):
+            if not os.path.exists(pdf):
+                print(f"❌ Файл {pdf} не найден")
+                return False
+            source = source or os.path.basename(pdf)
+        else:
+            source = source or os.path.basename(getattr(pdf, "name", "") or "document.pdf")
         
-        print(f"\n📄 Загружаем PDF: {pdf_path}")
+        print(f"\n📄 Загружаем PDF: {pdf if isinstance(pdf, str) else source}")
+        
+        content_hash = _content_hash(pdf)
+        duplicate = self.indexed_as(pdf, content_hash)
+        if duplicate is not None:
+            print(f"   ⏭️ Этот файл уже в базе{'' if duplicate == source else f' (как {duplicate})'}, "
+                  f"обработка не нужна")
+            if progress_callback:
+                progress_callback(IngestProgress(source=source, finished=True))
+            return True
         
         try:
-            # Загрузка PDF
-            loader = PyPDFLoader(pdf_path)
-            documents = loader.load()
-            print(f"   ✅ Загружено {len(documents)} страниц")
+            self._ensure_vector_store()
+            plan = _IngestPlan(source, self._get_source_index(source))
+            progress = IngestProgress(source=source, pages_total=_count_pdf_pages(pdf))
+            print(f"   📄 Страниц: {progress.pages_total}")
+            splitter = _make_text_splitter()
+            pending_chunks, pending_ids = [], []
+            added_ids: List[str] = []
+            from dedup import DedupReport
+            dedup_report = DedupReport()
             
-            # Добавляем номера страниц
-            for i, doc in enumerate(documents):
-                doc.metadata["page"] = i + 1
-                doc.metadata["source"] = os.path.basename(pdf_path)
+            def notify():
+                if progress_callback:
+                    progress_callback(progress)
+                if cancel_event is not None and cancel_event.is_set() and not progress.finished:
+                    raise IngestCancelled()
             
-            # Разбиение на чанки
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=500,
-                chunk_overlap=50,
-                separators=["\n\n", "\n", ".", "!", "?", ",", " ", ""],
-                length_function=len
-            )
+            def flush():
+                nonlocal batch_size
+                if pending_chunks:
+                    dropped_before = dedup_report.dropped
+                    progress.chunks_embedded += self._upsert_chunks(pending_chunks, pending_ids,
+                                                                    report=dedup_report)
+                    progress.chunks_duplicate += dedup_report.dropped - dropped_before
+                    # Сюда входят и отброшенные дубликаты: при отмене их записи тоже удаляются
+                    added_ids.extend(pending_ids)
+                    pending_chunks.clear()
+                    pending_ids.clear()
+                progress.memory_mb = _current_rss_mb()
+                if max_memory_mb and progress.memory_mb > max_memory_mb and batch_size > 8:
+                    batch_size = max(8, batch_size // 2)
+                    gc.collect()
+                notify()
             
-            chunks = text_splitter.split_documents(documents)
-            print(f"   ✅ Создано {len(chunks)} фрагментов")
+            for doc in self.metrics.timed_iter("ingest.parse", _iter_pdf_pages(pdf, source)):
+                progress.pages_done += 1
+                if not plan.page_unchanged(doc.metadata["page"], doc.metadata["page_hash"]):
+                    # Разбиваем только измененные страницы
+                    with self.metrics.timer("ingest.split"):
+                        page_chunks = splitter.split_documents([doc])
+                    new_chunks, new_ids = plan.add_chunks(page_chunks)
+                    pending_chunks.extend(new_chunks)
+                    pending_ids.extend(new_ids)
+                    progress.chunks_new += len(new_chunks)
+                if len(pending_chunks) >= batch_size:
+                    flush()
+                else:
+                    notify()
+            flush()
             
-            # Создание векторного хранилища
-            print("🔄 Создаем векторное представление...")
-            self.vector_store = Chroma.from_documents(
-                documents=chunks,
-                embedding=self.embeddings,
-                persist_directory=self.persist_directory
-            )
-            self.vector_store.persist()
-            self.chunks_count = len(chunks)
+            # Точка фиксации: после нее отмены нет, поэтому метаданные перенесенных чанков
+            # обновляются только здесь (при отмене раньше откатывать их не нужно)
+            self._apply_moved(plan)
+            stale_ids = plan.stale_ids()
+            if stale_ids:
+                self._delete_chunks(stale_ids)
+            with self.metrics.timer("ingest.flush"):
+                self.vector_store.persist()
+            self.metrics.count("ingest.pages", progress.pages_done)
+            stored = plan.unchanged_count + plan.new_count - self._dropped_count(source)
+            self._stats().update_source(source, stored, progress.pages_done, content_hash)
             
+            progress.pages_total = progress.pages_done
+            progress.finished = True
+            notify()
+            print(f"   ✅ Фрагментов: {stored} (новых: {plan.new_count - dedup_report.dropped}, "
+                  f"без изменений: {plan.unchanged_count}, удалено: {len(stale_ids)})")
+            if dedup_report.dropped:
+                print(f"   🧹 Дубликатов не записано: {dedup_report.dropped} из {dedup_report.checked} "
+                      f"({dedup_report.ratio:.0%})")
             print(f"✅ Готово! База данных сохранена в {self.persist_directory}")
             return True
             
+        except IngestCancelled:
+            # Старые чанки измененных страниц удаляются, а метаданные перенесенных обновляются
+            # только в конце, поэтому удаления новых достаточно, чтобы вернуть прежнее состояние документа
+            if added_ids:
+                self._delete_chunks(added_ids)
+                self.vector_store.persist()
+            print(f"⏹️ Обработка {source} отменена")
+            return False
         except Exception as e:
             print(f"❌ Ошибка при обработке PDF: {e}")
             return False
+        finally:
+            self._after_index_update()
+    
+    def process_folder(self, path_or_pattern: str, workers: Optional[int] = None,
+                       batch_size: int = 512) -> bool:
+        """
+        Пакетная обработка всех PDF из папки или по маске (например, "notes/*.pdf").
+        Разбор и разбиение идут в пуле процессов, эмбеддинги считаются общими пакетами
+        по batch_size чанков и записываются в хранилище массовыми upsert.
+        """
+        if not self._check_writable():
+            return False
+        if os.path.isdir(path_or_pattern):
+            pdf_paths = sorted(glob.glob(os.path.join(path_or_pattern, "*.pdf")) +
+                               glob.glob(os.path.join(path_or_pattern, "*.PDF")))
+        else:
+            pdf_paths = sorted(glob.glob(path_or_pattern))
+        pdf_paths = [path for path in pdf_paths if path.lower().endswith('.pdf')]
+        
+        if not pdf_paths:
+            print(f"❌ PDF файлы не найдены: {path_or_pattern}")
+            return False
+        
+        print(f"\n📚 Пакетная обработка: {len(pdf_paths)} PDF")
+        started = time.perf_counter()
+        total_pages = total_chunks = failed = 0
+        pending_chunks, pending_ids = [], []
+        from dedup import DedupReport
+        dedup_report = DedupReport()
+        # Итоги по документам: число чанков уточняется, когда станет известно число дубликатов
+        totals: Dict[str, Tuple[int, int, str]] = {}
+        
+        try:
+            self._ensure_vector_store()
+            # Файлы, содержимое которых уже есть в БД, не разбираются вовсе
+            content_hashes = {path: _content_hash(path) for path in pdf_paths}
+            to_process = []
+            for path in pdf_paths:
+                duplicate = self.indexed_as(path, content_hashes[path])
+                if duplicate is not None:
+                    print(f"   ⏭️ {os.path.basename(path)}: уже в базе"
+                          f"{'' if duplicate == os.path.basename(path) else f' (как {duplicate})'}")
+                else:
+                    to_process.append(path)
+            plans = {path: _IngestPlan(os.path.basename(path),
+                                       self._get_source_index(os.path.basename(path)))
+                     for path in to_process}
+            
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {
+                    pool.submit(_prepare_pdf, path, plans[path].known_page_hashes()): path
+                    for path in to_process
+                }
+                for future in as_completed(futures):
+                    path = futures[future]
+                    source = os.path.basename(path)
+                    try:
+                        pages_count, page_hashes, chunks, elapsed = future.result()
+                    except Exception as e:
+                        failed += 1
+                        print(f"   ❌ {source}: {e}")
+                        continue
+                    
+                    # Разбор и разбиение шли в другом процессе: время приходит вместе с результатом
+                    self.metrics.observe("ingest.prepare", elapsed * 1000)
+                    self.metrics.count("ingest.pages", pages_count)
+                    plan = plans.pop(path)
+                    for page, page_hash in page_hashes.items():
+                        plan.page_unchanged(page, page_hash)
+                    new_chunks, new_ids = plan.add_chunks(chunks)
+                    self._apply_moved(plan)
+                    stale_ids = plan.stale_ids()
+                    unchanged = plan.unchanged_count
+                    if stale_ids:
+                        self._delete_chunks(stale_ids)
+                    self._stats().update_source(source, unchanged + len(new_chunks), pages_count,
+                                                content_hashes[path])
+                    totals[source] = (unchanged + len(new_chunks), pages_count, content_hashes[path])
+                    pending_chunks.extend(new_chunks)
+                    pending_ids.extend(new_ids)
+                    
+                    total_pages += pages_count
+                    total_chunks += unchanged + len(new_chunks)
+                    elapsed = max(elapsed, 1e-9)
+                    print(f"   ✅ {source}: {pages_count} стр., {unchanged + len(new_chunks)} фрагм. "
+                          f"(новых: {len(new_chunks)}, удалено: {len(stale_ids)}) — "
+                          f"{pages_count / elapsed:.1f} стр/с, {len(chunks) / elapsed:.1f} фрагм/с")
+                    
+                    # Общий этап эмбеддингов: пока пул разбирает следующие файлы
+                    while len(pending_chunks) >= batch_size:
+                        self._upsert_chunks(pending_chunks[:batch_size], pending_ids[:batch_size],
+                                            report=dedup_report)
+                        del pending_chunks[:batch_size], pending_ids[:batch_size]
+            
+            if pending_chunks:
+                self._upsert_chunks(pending_chunks, pending_ids, report=dedup_report)
+            for source, (chunks_count, pages_count, content_hash) in totals.items():
+                dropped = self._dropped_count(source)
+                if dropped:
+                    self._stats().update_source(source, chunks_count - dropped, pages_count, content_hash)
+                    total_chunks -= dropped
+            with self.metrics.timer("ingest.flush"):
+                self.vector_store.persist()
+        except Exception as e:
+            print(f"❌ Ошибка при пакетной обработке: {e}")
+            return False
+        finally:
+            # Часть файлов могла записаться и до ошибки
+            self._after_index_update()
+        
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        print(f"\n✅ Обработано файлов: {len(pdf_paths) - failed} из {len(pdf_paths)}")
+        print(f"📊 Всего: {total_pages} стр., {total_chunks} фрагм. за {elapsed:.1f} с "
+              f"({total_pages / elapsed:.1f} стр/с, {total_chunks / elapsed:.1f} фрагм/с)")
+        if dedup_report.dropped:
+            print(f"🧹 Дубликатов не записано: {dedup_report.dropped} из {dedup_report.checked} "
+                  f"({dedup_report.ratio:.0%})")
+        return failed == 0
+    
+    def clear_database(self) -> bool:
+        """Удаление базы данных с диска"""
+        import shutil
+        if not self._check_writable() or not os.path.exists(self.persist_directory):
+            return False
+        if self._vector_store is not None:
+            self._vector_store.close()
+        shutil.rmtree(self.persist_directory)
+        self.vector_store = None
+        self.stats = IndexStats()
+        self.lexical_index.clear()
+        self.dedup = None
+        self.sentences = None
+        self.index_version += 1
+        return True
+    
+    def _embed_query_cached(self, query: str) -> List[float]:
+        """Эмбеддинг запроса через кеш (модель MiniLM не различает регистр)"""
+        normalized = normalize_text(query).lower()
+        embedding = self.query_embedding_cache.get(normalized)
+        if embedding is None:
+            with self.metrics.timer("search.embed"):
+                embedding = tuple(self.embeddings.embed_query(normalized))
+            self.query_embedding_cache.put(normalized, embedding)
+        return list(embedding)
+    
+    def _vector_query(self, embeddings: List[List[float]], n: int, nprobe: Optional[int] = None,
+                      where: Optional[dict] = None) -> List[List[Tuple[str, ChunkInfo]]]:
+        """
+        Ближайшие соседи для каждого вектора запроса: списки (id чанка, ChunkInfo).
+        where отбирает чанки до оценки близости
+        """
+        with self.metrics.timer("search.vector"):
+            results = self.vector_store.query(
+                query_embeddings=embeddings,
+                n_results=max(1, min(n, self.chunks_count)),
+                where=where,
+                nprobe=nprobe
+            )
+        
+        batches = []
+        for ids, texts, metadatas, scores in zip(results['ids'], results['documents'],
+                                                 results['metadatas'], results['scores']):
+            batches.append([
+                (chunk_id, _chunk_from_record(text, metadata, score, chunk_id))
+                for chunk_id, text, metadata, score in zip(ids, texts, metadatas, scores)
+            ])
+        return batches
+    
+    def _chunks_by_ids(self, ids: List[str]) -> Dict[str, ChunkInfo]:
+        """Чтение чанков из хранилища по id (без оценки релевантности)"""
+        if not ids:
+            return {}
+        records = self.vector_store.get(ids=list(ids), include=["documents", "metadatas"])
+        return {
+            chunk_id: _chunk_from_record(text, metadata, 0.0, chunk_id)
+            for chunk_id, text, metadata in zip(records['ids'], records['documents'], records['metadatas'])
+        }
+    
+    def _is_keyword_query(self, query: str) -> bool:
+        """Короткий запрос из терминов, которые есть в лексическом индексе"""
+        terms = tokenize(query)
+        self._lexical_ready.wait()
+        return 0 < len(terms) <= 3 and all(term in self.lexical_index for term in terms)
+    
+    def _embed_queries_cached(self, queries: List[str], batch_size: int = 64):
+        """Пакетный эмбеддинг запросов, которых еще нет в кеше (результат — в кеше)"""
+        missing = []
+        seen = set()
+        for query in queries:
+            normalized = normalize_text(query).lower()
+            if normalized not in seen:
+                seen.add(normalized)
+                if self.query_embedding_cache.get(normalized) is None:
+                    missing.append(normalized)
+        
+        encode = getattr(self.embeddings, "embed_queries", self.embeddings.embed_documents)
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            with self.metrics.timer("search.embed_batch"):
+                vectors = encode(batch)
+            for normalized, embedding in zip(batch, vectors):
+                self.query_embedding_cache.put(normalized, tuple(embedding))
+    
+    def _search_cache_key(self, mode: str, query: str, embedding: Optional[List[float]], k: int,
+                          nprobe: Optional[int] = None, filters: Optional[SearchFilter] = None):
+        """Ключ кеша результатов: учитывает версию индекса, поэтому устаревших ответов не бывает"""
+        if embedding is None:
+            return (mode, normalize_text(query).lower(), k, filters, self.index_version)
+        return (mode, array.array('f', embedding).tobytes(), k, nprobe, filters, self.index_version)
     
-    def search(self, query: str, k: int = 3) -> List[ChunkInfo]:
-        """Поиск релевантных фрагментов"""
+    def _filter_where(self, filters: Optional[SearchFilter]) -> Tuple[Optional[dict], bool]:
+        """Условие where для фильтра и признак того, что под фильтр не подходит ни один документ"""
+        if filters is None or filters.is_empty:
+            return None, False
+        where = filters.to_where(self.stats)
+        sources = filters.resolve_sources(self.stats)
+        if where is not None and getattr(self.vector_store, "supports_duplicates", False):
+            # Под фильтр подходит и представитель, который стоит за отброшенный дубликат из выборки
+            where = {"$or": [where, {"$duplicates": where}]}
+        return where, sources is not None and not sources
+    
+    def search_many(self, queries: List[str], k: int = 3, batch_size: int = 64,
+                    mode: Optional[str] = None, nprobe: Optional[int] = None,
+                    filters: Optional[SearchFilter] = None) -> List[List[ChunkInfo]]:
+        """
+        Пакетный поиск: запросы кодируются пакетами по batch_size, а поиск ближайших
+        соседей выполняется одним запросом к хранилищу на пакет.
+        Возвращает списки результатов в порядке запросов.
+        """
         if not self.vector_store:
             print("❌ Сначала загрузите PDF!")
+            return [[] for _ in queries]
+        
+        where, nothing_selected = self._filter_where(filters)
+        if nothing_selected:
+            return [[] for _ in queries]
+        mode = mode or self.search_mode
+        results: List[List[ChunkInfo]] = [[] for _ in queries]
+        self.metrics.count("search.batch_queries", len(queries))
+        try:
+            # Запросы обрабатываются пакетами целиком, чтобы эмбеддинги пакета не вытеснялись из кеша
+            for start in range(0, len(queries), batch_size):
+                batch_queries = queries[start:start + batch_size]
+                if mode != "lexical":
+                    self._embed_queries_cached(batch_queries, batch_size)
+                if mode != "vector":
+                    # Эмбеддинги уже в кеше: search() не будет вызывать модель
+                    for i, query in enumerate(batch_queries, start):
+                        results[i] = self.search(query, k, mode, nprobe, filters)
+                    continue
+                
+                pending = []
+                for i, query in enumerate(batch_queries, start):
+                    embedding = self._embed_query_cached(query)
+                    cache_key = self._search_cache_key(mode, query, embedding, k, nprobe, filters)
+                    cached = self.search_cache.get(cache_key)
+                    if cached is not None:
+                        results[i] = list(cached)
+                    else:
+                        pending.append((i, embedding, cache_key))
+                
+                if pending:
+                    hits = self._vector_query([embedding for _, embedding, _ in pending], k, nprobe, where)
+                    for (i, _, cache_key), chunk_hits in zip(pending, hits):
+                        results[i] = [chunk for _, chunk in chunk_hits]
+                        self.search_cache.put(cache_key, tuple(results[i]))
+            return results
+        except Exception as e:
+            print(f"❌ Ошибка при пакетном поиске: {e}")
+            return results
+    
+    def search(self, query: str, k: int = 3, mode: Optional[str] = None,
+               nprobe: Optional[int] = None, filters: Optional[SearchFilter] = None) -> List[ChunkInfo]:
+        """
+        Поиск релевантных фрагментов.
+        mode: "vector" — по эмбеддингам, "lexical" — BM25 без вызова модели,
+        "hybrid" — объединение обоих ранжирований (RRF), "auto" — лексический поиск
+        для коротких запросов из известных терминов, иначе гибридный,
+        "rerank" — гибридный поиск rerank_candidates кандидатов и переранжирование
+        моделью cross-encoder в пределах rerank_budget_ms (см. last_rerank).
+        nprobe: число просматриваемых кластеров для индекса IVF (None — значение бота)
+        filters: ограничение по документам, страницам и дате загрузки (применяется до оценки)
+        """
+        if not self.vector_store:
+            print("❌ Сначала загрузите PDF!")
+            return []
+        
+        where, nothing_selected = self._filter_where(filters)
+        if nothing_selected:
             return []
+        mode = mode or self.search_mode
+        if mode == "auto":
+            mode = "lexical" if self._is_keyword_query(query) else "hybrid"
         
+        if mode == "rerank":
+            # Загрузка модели не входит в бюджет запроса
+            self.reranker.load()
+        with self.metrics.timer("search.total"):
+            return self._search(query, k, mode, nprobe, filters, where)
+    
+    def _search(self, query: str, k: int, mode: str, nprobe: Optional[int],
+                filters: Optional[SearchFilter] = None, where: Optional[dict] = None) -> List[ChunkInfo]:
+        """Поиск в уже выбранном режиме (с кешем результатов)"""
+        self.metrics.count("search.requests")
+        started = time.perf_counter()
+        self._trace.rerank = None
         try:
-            # Поиск с релевантностью
-            results = self.vector_store.similarity_search_with_relevance_scores(query, k=k)
+            embedding = None if mode == "lexical" else self._embed_query_cached(query)
+            cache_key = self._search_cache_key(mode, query, embedding, k, nprobe, filters)
+            cached = self.search_cache.get(cache_key)
+            if cached is not None:
+                self.metrics.count("search.cache_hits")
+                return list(cached)
             
-            chunks = []
-            for doc, score in results:
-                chunks.append(ChunkInfo(
-                    text=doc.page_content,
-                    page=doc.metadata.get('page', 0),
-                    source=doc.metadata.get('source', 'unknown'),
-                    relevance_score=score
-                ))
+            if mode == "vector":
+                chunks = [chunk for _, chunk in self._vector_query([embedding], k, nprobe, where)[0]]
+            elif mode == "lexical":
+                hits = self._lexical_search(query, k, where)
+                found = self._chunks_by_ids([chunk_id for chunk_id, _ in hits])
+                top_score = hits[0][1] if hits else 1.0
+                chunks = [replace(found[chunk_id], relevance_score=score / top_score)
+                          for chunk_id, score in hits if chunk_id in found]
+            elif mode == "hybrid":
+                chunks = self._hybrid_search(query, embedding, k, nprobe, where)
+            elif mode == "rerank":
+                # Каскад: широкий гибридный поиск, затем cross-encoder, пока есть бюджет
+                candidates = self._hybrid_search(query, embedding, self.rerank_candidates, nprobe, where)
+                report = RerankReport(budget_ms=self.rerank_budget_ms,
+                                      retrieve_ms=(time.perf_counter() - started) * 1000)
+                with self.metrics.timer("search.rerank"):
+                    chunks = self.reranker.rerank(query, candidates, k,
+                                                  started + self.rerank_budget_ms / 1000,
+                                                  self.metrics, report)
+                self._trace.rerank = report
+                if report.exhausted:
+                    # Неполное переранжирование не кешируется: в следующий раз бюджета может хватить
+                    return chunks
+            else:
+                raise ValueError(f"Неизвестный режим поиска: {mode}")
             
+            self.search_cache.put(cache_key, tuple(chunks))
             return chunks
         except Exception as e:
             print(f"❌ Ошибка при поиске: {e}")
             return []
     
+    def _hybrid_search(self, query: str, embedding: List[float], k: int, nprobe: Optional[int],
+                       where: Optional[dict]) -> List[ChunkInfo]:
+        """Объединение векторного и лексического ранжирований (RRF)"""
+        candidates = max(4 * k, 20)
+        vector_hits = self._vector_query([embedding], candidates, nprobe, where)[0]
+        lexical_hits = self._lexical_search(query, candidates, where)
+        with self.metrics.timer("search.fuse"):
+            fused = reciprocal_rank_fusion([
+                [chunk_id for chunk_id, _ in vector_hits],
+                [chunk_id for chunk_id, _ in lexical_hits],
+            ])[:k]
+            found = dict(vector_hits)
+            found.update(self._chunks_by_ids([chunk_id for chunk_id, _ in fused
+                                              if chunk_id not in found]))
+        # Оценка RRF нормируется на максимум (первое место в обоих списках)
+        best_possible = 2.0 / 61
+        return [replace(found[chunk_id], relevance_score=score / best_possible)
+                for chunk_id, score in fused if chunk_id in found]
+    
     def generate_answer(self, question: str, chunks: List[ChunkInfo]) -> str:
         """Генерация ответа на основе найденных фрагментов"""
         if not chunks:
             return "❌ Не найдено информации по вашему вопросу."
         
+        with self.metrics.timer("answer.format"):
+            return self._format_answer(question, chunks)
+    
+    def _format_answer(self, question: str, chunks: List[ChunkInfo]) -> str:
         answer = []
         answer.append(f"\n{'='*60}")
         answer.append(f"📝 Вопрос: {question}")
@@ -255,11 +1469,12 @@ class SimpleRAGBot:
         
         answer.append("🔍 Найдена следующая информация:\n")
         
-        for i, chunk in enumerate(chunks, 1):
+        highlights = self.highlight(question, chunks)
+        for i, (chunk, spans) in enumerate(zip(chunks, highlights), 1):
             answer.append(f"\n--- Источник {i} (Страница {chunk.page}) ---")
             answer.append(f"📊 Релевантность: {chunk.relevance_score:.3f}")
-            # Обрезаем длинный текст для читаемости
-            text_preview = chunk.text[:300] + "..." if len(chunk.text) > 300 else chunk.text
+            # Для читаемости — предложения, ближайшие к вопросу (или начало текста)
+            text_preview = snippet(chunk.text, spans, 300)
             answer.append(f"📄 Текст: {text_preview}")
             answer.append("-" * 40)
         
@@ -278,9 +1493,18 @@ def print_menu():
     print("2. ❓ Задать вопрос")
     print("3. 📊 Статистика")
     print("4. 🗑️ Очистить базу данных")
-    print("5. 🚪 Выход")
+    print("5. 📦 Экспорт снимка или шардов индекса")
+    print("6. 🚪 Выход")
     print("="*60)
 
+def print_progress(progress: IngestProgress):
+    """Вывод хода обработки в одну строку"""
+    end = "\n" if progress.finished else ""
+    print(f"\r   ⏳ Страниц: {progress.pages_done}/{progress.pages_total}, "
+          f"фрагментов записано: {progress.chunks_embedded}/{progress.chunks_new}"
+          f"{f' (дубликатов: {progress.chunks_duplicate})' if progress.chunks_duplicate else ''}, "
+          f"память: {progress.memory_mb:.0f} MB", end=end, flush=True)
+
 def find_pdf_files():
     """Поиск PDF файлов в текущей директории"""
     pdf_files = [f for f in os.listdir('.') if f.lower().endswith('.pdf')]
@@ -294,8 +1518,20 @@ def main():
     print("🚀 ЗАПУСК RAG ЧАТ-БОТА")
     print("="*60)
     
+    # Проверка без импорта библиотек; установка — только с согласия пользователя
+    missing = find_missing_dependencies()
+    if missing:
+        print(f"\n❌ Не найдены библиотеки: {', '.join(missing)}")
+        answer = input("Установить их сейчас? (да/нет): ").strip().lower()
+        if answer not in ['да', 'yes', 'y'] or not check_and_install_dependencies():
+            print("\nПопробуйте установить их вручную:")
+            print("pip install langchain langchain-community chromadb pypdf sentence-transformers")
+            input("\nНажмите Enter для выхода...")
+            return
+    
     try:
-        bot = SimpleRAGBot()
+        # Модель и БД загружаются в фоне, пока пользователь смотрит меню
+        bot = SimpleRAGBot(warm_up=True)
     except Exception as e:
         print(f"\n❌ Ошибка при инициализации: {e}")
         input("\nНажмите Enter для выхода...")
@@ -317,7 +1553,7 @@ def main():
             print("   Положите PDF файл в эту папку и выберите пункт 1")
         
         print("\n" + "-"*60)
-        choice = input("🔹 Выберите действие (1-5): ").strip()
+        choice = input("🔹 Выберите действие (1-6): ").strip()
         
         if choice == '1':
             clear_screen()
@@ -330,10 +1566,16 @@ def main():
                     size = os.path.getsize(pdf) / 1024
                     print(f"{i}. {pdf} ({size:.1f} KB)")
                 print("0. Указать свой путь")
+                print("A. Все PDF из папки или по маске (пакетная загрузка)")
                 
                 file_choice = input("\nВыберите номер файла: ").strip()
                 
-                if file_choice.isdigit():
+                if file_choice.lower() in ['a', 'а']:
+                    pattern = input("Папка или маска (Enter — текущая папка): ").strip() or '.'
+                    bot.process_folder(pattern)
+                    input("\nНажмите Enter для продолжения...")
+                    continue
+                elif file_choice.isdigit():
                     idx = int(file_choice)
                     if 1 <= idx <= len(pdf_files):
                         pdf_path = pdf_files[idx-1]
@@ -346,7 +1588,11 @@ def main():
                 pdf_path = input("Введите полный путь к PDF файлу: ").strip()
             
             if pdf_path and pdf_path.lower() != 'exit':
-                bot.process_pdf(pdf_path)
+                # Папку или маску обрабатываем пакетно
+                if os.path.isdir(pdf_path) or glob.has_magic(pdf_path):
+                    bot.process_folder(pdf_path)
+                else:
+                    bot.process_pdf(pdf_path, progress_callback=print_progress)
             
             input("\nНажмите Enter для продолжения...")
         
@@ -362,8 +1608,27 @@ def main():
             question = input("Ваш вопрос: ").strip()
             
             if question and question.lower() != 'exit':
+                # Область поиска: выбранные документы и страницы (Enter — искать везде)
+                filters = None
+                sources = bot.indexed_sources()
+                if len(sources) > 1:
+                    for i, source in enumerate(sources, 1):
+                        print(f"{i}. {source}")
+                    picked = input("Документы (номера через запятую, Enter — все): ").strip()
+                    pages = input("Страницы (например 1-5, 8; Enter — все): ").strip()
+                    numbers = [int(i) for i in picked.split(",") if i.strip().isdigit()]
+                    try:
+                        page_ranges = parse_page_ranges(pages)
+                    except ValueError as e:
+                        print(f"⚠️ {e}, поиск по всем страницам")
+                        page_ranges = None
+                    filters = SearchFilter.create(
+                        sources=[sources[i - 1] for i in numbers if 0 < i <= len(sources)] if numbers else None,
+                        pages=page_ranges)
+                    if filters:
+                        print(f"🎯 {filters.describe()}")
                 print("\n🔍 Ищем ответ...")
-                chunks = bot.search(question)
+                chunks = bot.search(question, filters=filters)
                 answer = bot.generate_answer(question, chunks)
                 print(answer)
             
@@ -372,24 +1637,62 @@ def main():
         elif choice == '3':
             clear_screen()
             print("📊 СТАТИСТИКА\n")
-            print(f"📁 База данных: {bot.persist_directory}")
+            print(f"📁 База данных: {bot.read_only_path or bot.persist_directory}")
             print(f"📊 Фрагментов в БД: {bot.chunks_count}")
-            print(f"🤖 Модель эмбеддингов: all-MiniLM-L6-v2")
+            stats = bot.stats
+            if stats and stats.sources:
+                print(f"📄 Документов: {len(stats.sources)}, страниц: {stats.total_pages}")
+                for source, source_stats in sorted(stats.sources.items()):
+                    print(f"   • {source}: {source_stats.chunks} фрагм., {source_stats.pages} стр.")
+                print(f"🕒 Последняя загрузка: "
+                      f"{time.strftime('%d.%m.%Y %H:%M', time.localtime(stats.last_ingest))}")
+            print(f"🤖 Модель эмбеддингов: all-MiniLM-L6-v2 ({bot.embedding_backend})")
+            print(f"🗄️ Хранилище: {bot.backend_name}")
+            ivf = getattr(bot.vector_store, "ivf", None)
+            if ivf is not None and ivf.is_trained:
+                print(f"🧭 Индекс IVF: {ivf.nlist} кластеров, nprobe = {bot.nprobe}")
+            report = bot.quantization_report()
+            if report and report["mode"] != "none":
+                print(f"🗜️ Квантизация {report['mode']}: {report['compressed_mb']:.2f} MB "
+                      f"вместо {report['full_mb']:.2f} MB (в {report['ratio']:.1f} раза меньше), "
+                      f"recall@{report['k']} = {report['recall']:.3f}")
+            timings = bot.startup_timings
+            print("⏱️ Время запуска: " + ", ".join(
+                f"{name} {timings[name] * 1000:.0f} мс"
+                for name in ["module", "init", "imports", "model", "database"] if name in timings
+            ))
+            if isinstance(bot._embeddings, CachedEmbeddings):
+                cache = bot._embeddings.cache
+                print(f"💾 Кеш эмбеддингов: {len(cache)} векторов "
+                      f"(попаданий: {cache.hits}, промахов: {cache.misses})")
+            dedup = bot.dedup_report()
+            if dedup and dedup["dropped"]:
+                print(f"🧹 Дубликатов не записано: {dedup['dropped']} "
+                      f"({dedup['ratio']:.1%} фрагментов документов)")
+            print(f"⚡ Кеш запросов: {len(bot.search_cache)} записей "
+                  f"(попаданий: {bot.search_cache.hits}, промахов: {bot.search_cache.misses})")
             
-            if bot.vector_store:
+            if bot.chunks_count:
                 print("✅ Статус: Активна")
             else:
                 print("❌ Статус: Не активна (загрузите PDF)")
             
-            # Показываем размер базы данных
-            if os.path.exists(bot.persist_directory):
-                import shutil
-                size = sum(os.path.getsize(os.path.join(dirpath, filename)) 
-                          for dirpath, _, filenames in os.walk(bot.persist_directory) 
-                          for filename in filenames) / 1024 / 1024  # в МБ
-                print(f"💾 Размер БД: {size:.2f} MB")
+            # Размер БД хранится в статистике и обновляется после загрузки документов
+            if stats:
+                print(f"💾 Размер БД: {stats.disk_mb:.2f} MB")
             
-            input("\nНажмите Enter для продолжения...")
+            # Время этапов поиска и загрузки за текущий сеанс
+            table = bot.metrics.format_table()
+            if table:
+                print("\n⏱️ Этапы (мс, последние 1024 вызова):")
+                print(table)
+            
+            path = input("\nФайл для метрик Prometheus (Enter — продолжить): ").strip()
+            if path:
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(bot.metrics_text())
+                print(f"✅ Метрики сохранены: {path}")
+                input("\nНажмите Enter для продолжения...")
         
         elif choice == '4':
             clear_screen()
@@ -398,11 +1701,7 @@ def main():
             confirm = input("Вы уверены? Все данные будут удалены! (да/нет): ").strip().lower()
             
             if confirm in ['да', 'yes', 'y', 'да']:
-                import shutil
-                if os.path.exists(bot.persist_directory):
-                    shutil.rmtree(bot.persist_directory)
-                    bot.vector_store = None
-                    bot.chunks_count = 0
+                if bot.clear_database():
                     print("✅ База данных очищена")
                 else:
                     print("❌ База данных не найдена")
@@ -410,13 +1709,33 @@ def main():
             input("\nНажмите Enter для продолжения...")
         
         elif choice == '5':
+            clear_screen()
+            print("📦 ЭКСПОРТ СНИМКА ИНДЕКСА\n")
+            print("Снимок — один файл с векторами, текстами и метаданными для копирования на другие узлы")
+            print("Шарды — несколько снимков для параллельного поиска в нескольких процессах")
+            count = input("Число шардов (Enter — один файл снимка): ").strip()
+            try:
+                if count.isdigit() and int(count) > 1:
+                    directory = input("Папка для шардов (Enter — shards): ").strip() or "shards"
+                    by = input("Делить по документам или по хешу? (документы/хеш): ").strip().lower()
+                    bot.export_shards(directory, int(count), by="hash" if by in ["хеш", "hash"] else "source")
+                else:
+                    path = input("Файл снимка (Enter — notes.ragsnap): ").strip() or "notes.ragsnap"
+                    bot.export_snapshot(path)
+            except Exception as e:
+                print(f"❌ Ошибка записи: {e}")
+            input("\nНажмите Enter для продолжения...")
+        
+        elif choice == '6':
             print("\n👋 До свидания!")
             break
         
         else:
-            print("❌ Неверный выбор! Введите число от 1 до 5")
+            print("❌ Неверный выбор! Введите число от 1 до 6")
             input("\nНажмите Enter для продолжения...")
 
+MODULE_IMPORT_SECONDS = time.perf_counter() - _MODULE_STARTED
+
 if __name__ == "__main__":
     try:
         main()
@@ -0,0 +1,131 @@
+"""
+Переранжирование кандидатов небольшой локальной моделью cross-encoder
+Каскад: дешевый поиск отбирает широкий список кандидатов, а cross-encoder оценивает
+пары (вопрос, фрагмент) пакетами в порядке исходного ранга. Перед каждым пакетом
+проверяется бюджет времени запроса: если следующий пакет в него не укладывается,
+переранжирование останавливается, а неоцененные кандидаты остаются ниже оцененных
+в исходном порядке.
+
+Модель загружается через transformers при первом использовании (torch и transformers
+уже стоят вместе с sentence-transformers).
+"""
+
+import math
+import time
+import threading
+from dataclasses import dataclass, replace
+from typing import List, Optional, Sequence
+
+DEFAULT_RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+
+@dataclass
+class RerankReport:
+    """Куда ушел бюджет запроса (мс)"""
+    candidates: int = 0
+    scored: int = 0
+    batches: int = 0
+    budget_ms: float = 0.0
+    retrieve_ms: float = 0.0
+    rerank_ms: float = 0.0
+    # Бюджет кончился раньше, чем были оценены все кандидаты
+    exhausted: bool = False
+
+    @property
+    def total_ms(self) -> float:
+        return self.retrieve_ms + self.rerank_ms
+
+    def describe(self) -> str:
+        text = (f"поиск {self.retrieve_ms:.0f} мс, переранжирование {self.scored}/{self.candidates} "
+                f"за {self.rerank_ms:.0f} мс (бюджет {self.budget_ms:.0f} мс)")
+        return text + ", бюджет исчерпан" if self.exhausted else text
+
+
+class CrossEncoderReranker:
+    """Оценка релевантности пар (вопрос, фрагмент) моделью cross-encoder"""
+
+    def __init__(self, model_name: str = DEFAULT_RERANK_MODEL, batch_size: int = 8,
+                 max_length: int = 256, threads: Optional[int] = None):
+        """
+        batch_size: пар в одном пакете (бюджет проверяется между пакетами).
+        max_length: длина пары в токенах (вопрос и фрагмент обрезаются вместе).
+        """
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.threads = threads
+        self.model = None
+        self.tokenizer = None
+        self._load_lock = threading.Lock()
+        self._tokenizer_lock = threading.Lock()
+
+    def load(self):
+        """Загрузка модели (один раз; вызывается до начала отсчета бюджета)"""
+        if self.model is not None:
+            return
+        with self._load_lock:
+            if self.model is not None:
+                return
+            import torch
+            from transformers import AutoModelForSequenceClassification, AutoTokenizer
+            print(f"🔄 Загрузка модели переранжирования {self.model_name}...")
+            if self.threads:
+                torch.set_num_threads(self.threads)
+            self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+            model = AutoModelForSequenceClassification.from_pretrained(self.model_name)
+            model.eval()
+            self.model = model
+            print("✅ Модель переранжирования загружена")
+
+    def score(self, query: str, texts: Sequence[str]) -> List[float]:
+        """Оценки пар в диапазоне (0, 1): сигмоида от выхода модели"""
+        import torch
+        self.load()
+        with self._tokenizer_lock:
+            encoded = self.tokenizer([query] * len(texts), list(texts), padding=True,
+                                     truncation="only_second", max_length=self.max_length,
+                                     return_tensors="pt")
+        with torch.inference_mode():
+            logits = self.model(**encoded).logits
+        return [1.0 / (1.0 + math.exp(-value)) for value in logits[:, 0].tolist()]
+
+    def rerank(self, query: str, chunks: list, k: int, deadline: float,
+               metrics=None, report: Optional[RerankReport] = None) -> list:
+        """
+        Переранжирование кандидатов (ChunkInfo в порядке исходного ранга) до момента deadline
+        (time.perf_counter()). Возвращает k лучших; relevance_score — итоговая оценка.
+        Неоцененные кандидаты получают исходную оценку, умноженную на худшую оценку модели,
+        поэтому остаются ниже оцененных.
+        """
+        report = report if report is not None else RerankReport()
+        report.candidates = len(chunks)
+        started = time.perf_counter()
+        scored = []
+        slowest = 0.0
+        for start in range(0, len(chunks), self.batch_size):
+            now = time.perf_counter()
+            # Первый пакет запускается, если бюджет еще не исчерпан; следующие — если укладываются
+            # в остаток (оценка — по самому медленному пакету этого запроса)
+            if now >= deadline or now + slowest > deadline:
+                report.exhausted = True
+                break
+            batch = chunks[start:start + self.batch_size]
+            scores = self.score(query, [chunk.text for chunk in batch])
+            elapsed = time.perf_counter() - now
+            slowest = max(slowest, elapsed)
+            if metrics is not None:
+                metrics.observe("search.rerank_batch", elapsed * 1000)
+            scored.extend(replace(chunk, relevance_score=score) for chunk, score in zip(batch, scores))
+            report.batches += 1
+
+        report.scored = len(scored)
+        report.rerank_ms = (time.perf_counter() - started) * 1000
+        scored.sort(key=lambda chunk: chunk.relevance_score, reverse=True)
+        floor = scored[-1].relevance_score if scored else 1.0
+        rest = [replace(chunk, relevance_score=chunk.relevance_score * floor)
+                for chunk in chunks[len(scored):]]
+        if metrics is not None:
+            metrics.count("search.rerank_scored", report.scored)
+            if report.exhausted:
+                metrics.count("search.rerank_budget_exhausted")
+        return (scored + rest)[:k]
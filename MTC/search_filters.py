@@ -0,0 +1,111 @@
+"""
+Фильтры поиска: по документам, диапазонам страниц и дате загрузки документа
+Фильтр превращается в условие where в стиле Chroma и применяется хранилищем до оценки
+близости, поэтому поиск идет только среди выбранных чанков.
+
+Дата загрузки берется из статистики индекса (index_stats.py) и сводится к списку
+документов, так что ее проверка не требует просмотра чанков
+"""
+
+import re
+from dataclasses import dataclass
+from typing import Iterable, Optional, Tuple
+
+from index_stats import IndexStats
+
+_RANGE_PATTERN = re.compile(r"^\s*(\d+)\s*(?:[-–—]\s*(\d+)\s*)?$")
+
+
+def parse_page_ranges(text: str) -> Tuple[Tuple[int, int], ...]:
+    """'1-5, 8, 10-12' -> ((1, 5), (8, 8), (10, 12))"""
+    ranges = []
+    for part in text.split(","):
+        if not part.strip():
+            continue
+        match = _RANGE_PATTERN.match(part)
+        if match is None:
+            raise ValueError(f"Неверный диапазон страниц: {part.strip()}")
+        first = int(match.group(1))
+        last = int(match.group(2) or first)
+        ranges.append((min(first, last), max(first, last)))
+    return tuple(ranges)
+
+
+@dataclass(frozen=True)
+class SearchFilter:
+    """Ограничения поиска (неизменяемый, поэтому годится как часть ключа кеша)"""
+    sources: Optional[Tuple[str, ...]] = None
+    # Включительные диапазоны номеров страниц
+    pages: Optional[Tuple[Tuple[int, int], ...]] = None
+    # Время загрузки документа (Unix time)
+    ingested_after: Optional[float] = None
+    ingested_before: Optional[float] = None
+
+    @classmethod
+    def create(cls, sources: Optional[Iterable[str]] = None, pages=None,
+               ingested_after: Optional[float] = None,
+               ingested_before: Optional[float] = None) -> Optional["SearchFilter"]:
+        """
+        Фильтр из значений интерфейса; None, если ничего не ограничено.
+        pages — строка '1-5, 8' или последовательность пар (первая, последняя)
+        """
+        if isinstance(pages, str):
+            pages = parse_page_ranges(pages)
+        search_filter = cls(
+            sources=tuple(sorted(set(sources))) if sources is not None else None,
+            pages=tuple((int(first), int(last)) for first, last in pages) if pages else None,
+            ingested_after=ingested_after,
+            ingested_before=ingested_before,
+        )
+        return None if search_filter.is_empty else search_filter
+
+    @property
+    def is_empty(self) -> bool:
+        return (self.sources is None and not self.pages
+                and self.ingested_after is None and self.ingested_before is None)
+
+    def resolve_sources(self, stats: Optional[IndexStats]) -> Optional[Tuple[str, ...]]:
+        """Документы, прошедшие фильтр по имени и дате загрузки (None — все документы)"""
+        if self.ingested_after is None and self.ingested_before is None:
+            return self.sources
+        candidates = self.sources if self.sources is not None else tuple((stats.sources if stats else {}).keys())
+        selected = []
+        for source in candidates:
+            source_stats = stats.sources.get(source) if stats else None
+            if source_stats is None:
+                continue
+            if self.ingested_after is not None and source_stats.ingested_at < self.ingested_after:
+                continue
+            if self.ingested_before is not None and source_stats.ingested_at > self.ingested_before:
+                continue
+            selected.append(source)
+        return tuple(selected)
+
+    def to_where(self, stats: Optional[IndexStats] = None) -> Optional[dict]:
+        """
+        Условие where для хранилища (None — без ограничений).
+        Если ни один документ не подходит, возвращается условие с пустым списком $in
+        """
+        conditions = []
+        sources = self.resolve_sources(stats)
+        if sources is not None:
+            conditions.append({"source": {"$in": list(sources)}})
+        if self.pages:
+            ranges = [{"$and": [{"page": {"$gte": first}}, {"page": {"$lte": last}}]}
+                      for first, last in self.pages]
+            conditions.append(ranges[0] if len(ranges) == 1 else {"$or": ranges})
+        if not conditions:
+            return None
+        return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+    def describe(self) -> str:
+        """Краткое описание для вывода в консоль"""
+        parts = []
+        if self.sources is not None:
+            parts.append(f"документы: {', '.join(self.sources) or '—'}")
+        if self.pages:
+            parts.append("страницы: " + ", ".join(
+                str(first) if first == last else f"{first}-{last}" for first, last in self.pages))
+        if self.ingested_after is not None or self.ingested_before is not None:
+            parts.append("загружены в выбранный период")
+        return "; ".join(parts)
@@ -0,0 +1,294 @@
+"""
+Подсветка лучших предложений ответа по эмбеддингам, посчитанным при загрузке
+При записи чанка его предложения (границы из text_splitter.sentence_spans) кодируются
+моделью через дисковый кеш эмбеддингов (как и сами чанки) и хранятся сжатыми:
+int8 с масштабом на строку (как квантизация хранилища numpy) и смещения предложений
+в тексте чанка.
+
+При ответе предложения всех найденных фрагментов оцениваются одним матричным
+произведением с уже посчитанным вектором запроса — без вызовов модели.
+Индекс хранится рядом с БД в плоских файлах, которые только дописываются
+(без pickle и без перезаписи всего индекса при каждом сохранении).
+"""
+
+import os
+import html
+import json
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from vector_backends import quantize_vectors
+
+Span = Tuple[int, int]
+
+# Файлы переписываются, только если мертвых строк больше этого числа и больше, чем живых
+COMPACT_MIN_DEAD = 4096
+
+
+class SentenceIndex:
+    """
+    Границы и сжатые эмбеддинги предложений каждого чанка.
+    Строки (предложения) только дописываются в файлы данных: векторы int8, масштабы
+    float32 и границы uint32. Журнал JSON Lines хранит, какие строки принадлежат чанку
+    ({"id", "row", "count"}; {"delete": [id]}), заголовок — размеры зафиксированной части.
+    Файлы переписываются целиком (новое поколение) только когда мертвых строк стало больше живых
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # id чанка -> (первая строка, число предложений)
+        self.entries: Dict[str, Tuple[int, int]] = {}
+        self.dim = 0
+        self.rows = 0
+        self.dead = 0
+        self.generation = 0
+        self._log_size = 0
+        self._pending: List[str] = []
+        self._maps = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, chunk_id: str) -> bool:
+        return chunk_id in self.entries
+
+    def _file(self, suffix: str, generation: Optional[int] = None) -> str:
+        generation = self.generation if generation is None else generation
+        return f"{self.path}-{generation}.{suffix}"
+
+    def add(self, ids: List[str], spans: List[List[Span]], vectors: list):
+        """Запись предложений чанков: vectors[i] — эмбеддинги предложений spans[i] (строка на предложение)"""
+        import numpy as np
+        blocks = []
+        for chunk_spans, chunk_vectors in zip(spans, vectors):
+            if chunk_spans:
+                matrix = np.asarray(chunk_vectors, dtype=np.float32).reshape(len(chunk_spans), -1)
+                # Нормировка до сжатия: оценки предложений разной длины сравнимы
+                matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+                blocks.append((np.asarray(chunk_spans, dtype=np.uint32), *quantize_vectors(matrix, "int8")))
+            else:
+                blocks.append(None)
+        with self._lock:
+            present = [block for block in blocks if block is not None]
+            if present:
+                self.dim = self.dim or present[0][1].shape[1]
+                for suffix, part in (("spans", 0), ("i8", 1), ("f32", 2)):
+                    with open(self._file(suffix), "ab") as f:
+                        for block in present:
+                            f.write(np.ascontiguousarray(block[part]).tobytes())
+            self._remove_locked([chunk_id for chunk_id, block in zip(ids, blocks) if block is None])
+            for chunk_id, block in zip(ids, blocks):
+                if block is None:
+                    continue
+                self._forget(chunk_id)
+                self.entries[chunk_id] = (self.rows, len(block[0]))
+                self._pending.append(json.dumps({"id": chunk_id, "row": self.rows, "count": len(block[0])},
+                                                ensure_ascii=False))
+                self.rows += len(block[0])
+            self._maps = None
+
+    def _forget(self, chunk_id: str) -> bool:
+        entry = self.entries.pop(chunk_id, None)
+        if entry is not None:
+            self.dead += entry[1]
+        return entry is not None
+
+    def _remove_locked(self, ids: List[str]):
+        removed = [chunk_id for chunk_id in ids if self._forget(chunk_id)]
+        if removed:
+            self._pending.append(json.dumps({"delete": removed}, ensure_ascii=False))
+
+    def remove(self, ids: List[str]):
+        with self._lock:
+            self._remove_locked(ids)
+
+    def clear(self):
+        with self._lock:
+            self._remove_locked(list(self.entries))
+
+    def _arrays(self):
+        """Файлы данных, отображенные в память (до текущего числа строк)"""
+        import numpy as np
+        if self._maps is None or self._maps[0].shape[0] != self.rows:
+            self._maps = (
+                np.memmap(self._file("spans"), dtype=np.uint32, mode="r", shape=(self.rows, 2)),
+                np.memmap(self._file("i8"), dtype=np.int8, mode="r", shape=(self.rows, self.dim)),
+                np.memmap(self._file("f32"), dtype=np.float32, mode="r", shape=(self.rows,)),
+            )
+        return self._maps
+
+    def best_sentences(self, ids: Sequence[str], query_embedding: Sequence[float],
+                       top: int = 2) -> List[List[Span]]:
+        """
+        Лучшие предложения каждого чанка по сходству с запросом (по убыванию оценки).
+        Для чанков без записанных предложений — пустой список
+        """
+        import numpy as np
+        with self._lock:
+            found = [self.entries.get(chunk_id) for chunk_id in ids]
+            present = [entry for entry in found if entry is not None]
+            if not present:
+                return [[] for _ in ids]
+            spans_map, vectors_map, scales_map = self._arrays()
+            rows = np.concatenate([np.arange(row, row + count) for row, count in present])
+            spans, vectors, scales = spans_map[rows], vectors_map[rows], scales_map[rows]
+        # Все предложения всех чанков — одно произведение матрицы на вектор запроса
+        scores = (vectors.astype(np.float32) @ np.asarray(query_embedding, dtype=np.float32)) * scales
+        results = []
+        offset = 0
+        for entry in found:
+            if entry is None:
+                results.append([])
+                continue
+            chunk_spans = spans[offset:offset + entry[1]]
+            chunk_scores = scores[offset:offset + entry[1]]
+            offset += entry[1]
+            order = np.argsort(-chunk_scores, kind="stable")[:top]
+            results.append([(int(chunk_spans[i][0]), int(chunk_spans[i][1])) for i in order])
+        return results
+
+    def save(self):
+        """
+        Фиксация записанного: дописывание журнала и заголовка.
+        Если мертвых строк больше половины — перезапись живых строк в новое поколение файлов
+        """
+        with self._lock:
+            if self.dead > COMPACT_MIN_DEAD and self.dead * 2 > self.rows:
+                self._compact()
+            elif self._pending or not os.path.exists(self.path + ".json"):
+                log_path = self._file("jsonl")
+                # Хвост, не попавший в заголовок (сбой до его записи), отбрасывается
+                if os.path.exists(log_path) and os.path.getsize(log_path) > self._log_size:
+                    os.truncate(log_path, self._log_size)
+                data = "".join(line + "\n" for line in self._pending).encode("utf-8")
+                with open(log_path, "ab") as f:
+                    f.write(data)
+                self._log_size += len(data)
+                self._pending = []
+                self._write_header()
+
+    def _compact(self):
+        import numpy as np
+        generation = self.generation + 1
+        ids = list(self.entries)
+        entries = [self.entries[chunk_id] for chunk_id in ids]
+        rows = (np.concatenate([np.arange(row, row + count) for row, count in entries])
+                if entries else np.zeros(0, dtype=np.int64))
+        arrays = self._arrays() if self.rows else None
+        for suffix, part in (("spans", 0), ("i8", 1), ("f32", 2)):
+            with open(self._file(suffix, generation), "wb") as f:
+                if arrays is not None:
+                    f.write(np.ascontiguousarray(arrays[part][rows]).tobytes())
+        del arrays
+        self.entries = {}
+        lines = []
+        row = 0
+        for chunk_id, (_, count) in zip(ids, entries):
+            self.entries[chunk_id] = (row, count)
+            lines.append(json.dumps({"id": chunk_id, "row": row, "count": count}, ensure_ascii=False))
+            row += count
+        data = "".join(line + "\n" for line in lines).encode("utf-8")
+        with open(self._file("jsonl", generation), "wb") as f:
+            f.write(data)
+
+        old_generation = self.generation
+        self._maps = None
+        self.generation, self.rows, self.dead = generation, row, 0
+        self._log_size = len(data)
+        self._pending = []
+        # Новое поколение начинает действовать с записью заголовка, затем старое удаляется
+        self._write_header()
+        for suffix in ("spans", "i8", "f32", "jsonl"):
+            old_path = self._file(suffix, old_generation)
+            if os.path.exists(old_path):
+                os.remove(old_path)
+
+    def _write_header(self):
+        tmp_path = self.path + ".json.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "dim": self.dim, "rows": self.rows, "dead": self.dead,
+                       "generation": self.generation, "log_size": self._log_size}, f)
+        os.replace(tmp_path, self.path + ".json")
+
+    @classmethod
+    def load(cls, path: str) -> "SentenceIndex":
+        """
+        Загрузка индекса по префиксу файлов (пустой индекс, если заголовка нет).
+        Строки и записи журнала после зафиксированных в заголовке (сбой до save) отбрасываются
+        """
+        index = cls(path)
+        if not os.path.exists(path + ".json"):
+            return index
+        with open(path + ".json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        index.dim, index.rows, index.dead = meta["dim"], meta["rows"], meta["dead"]
+        index.generation, index._log_size = meta["generation"], meta["log_size"]
+        for suffix, row_size in (("spans", 8), ("i8", index.dim), ("f32", 4)):
+            data_path = index._file(suffix)
+            if os.path.exists(data_path) and os.path.getsize(data_path) > index.rows * row_size:
+                os.truncate(data_path, index.rows * row_size)
+        log_path = index._file("jsonl")
+        if not os.path.exists(log_path):
+            return index
+        with open(log_path, "rb") as f:
+            data = f.read(index._log_size)
+        if os.path.getsize(log_path) > index._log_size:
+            os.truncate(log_path, index._log_size)
+        for line in data.split(b"\n"):
+            if not line:
+                continue
+            record = json.loads(line)
+            if "delete" in record:
+                for chunk_id in record["delete"]:
+                    index.entries.pop(chunk_id, None)
+            else:
+                index.entries[record["id"]] = (record["row"], record["count"])
+        return index
+
+
+def snippet(text: str, spans: List[Span], limit: int = 300) -> str:
+    """
+    Короткий фрагмент для ответа: лучшие предложения (spans по убыванию оценки), пока
+    укладываются в limit символов, в порядке текста; пропуски отмечаются многоточием.
+    Без предложений — начало текста, как раньше
+    """
+    if not spans:
+        return text[:limit] + "..." if len(text) > limit else text
+    picked = [spans[0]]
+    total = spans[0][1] - spans[0][0]
+    for start, end in spans[1:]:
+        if total + end - start > limit:
+            break
+        picked.append((start, end))
+        total += end - start
+    picked.sort()
+    result = ""
+    previous_end = picked[0][0]
+    for start, end in picked:
+        # Соседние предложения идут подряд, между далекими — многоточие
+        result += (" " if not text[previous_end:start].strip() else " ... ") if result else ""
+        result += text[start:end]
+        previous_end = end
+    truncated = len(result) > limit
+    if truncated:
+        result = result[:limit]
+    if text[:picked[0][0]].strip():
+        result = "..." + result
+    if truncated or text[previous_end:].strip():
+        result += "..."
+    return result
+
+
+def highlight_html(text: str, spans: List[Span]) -> str:
+    """Текст фрагмента для HTML: лучшие предложения выделены тегом <mark>"""
+    parts = []
+    position = 0
+    for start, end in sorted(spans):
+        if start < position:
+            continue
+        parts.append(html.escape(text[position:start]))
+        parts.append(f"<mark>{html.escape(text[start:end])}</mark>")
+        position = end
+    parts.append(html.escape(text[position:]))
+    return "".join(parts)
@@ -0,0 +1,308 @@
+"""
+Шардированный индекс: поиск параллельно в нескольких процессах (scatter-gather)
+Чанки делятся на N шардов — по документам (документ целиком в одном шарде) или по хешу id.
+Каждый шард — файл снимка (snapshot.py), поэтому процессы открывают его за миллисекунды,
+а векторы, отображенные в память, делят между собой через страничный кеш ОС.
+
+Запрос отправляется во все шарды (при фильтре по документам — только в шарды с этими
+документами), каждый процесс пула ищет top-k в своем шарде, а итоговый top-k собирается
+слиянием отсортированных списков (heapq.merge). ShardedBackend реализует интерфейс
+хранилищ из vector_backends.py, так что режимы поиска и фильтры SimpleRAGBot работают
+без изменений; лексический индекс остается общим в основном процессе.
+
+Запуск:
+    python sharded.py build --persist-directory ./chroma_db --shards 4 --by source ./shards
+"""
+
+import os
+import sys
+import json
+import zlib
+import heapq
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Dict, List, Optional
+
+from index_stats import IndexStats
+from vector_backends import DUPLICATES_KEY, where_sources
+
+MANIFEST_NAME = "manifest.json"
+# Общий лексический индекс: поля JSON и массивы BM25Index.to_arrays в npz (без pickle —
+# папку шардов копируют между узлами, и ее загрузка не должна выполнять код)
+LEXICAL_NAME = "bm25_index.npz"
+MANIFEST_VERSION = 1
+# Способы деления: документ целиком в одном шарде или по хешу id чанка
+SHARD_MODES = ("source", "hash")
+
+# Шарды, открытые в процессе пула (номер -> SnapshotBackend)
+_worker_paths: List[str] = []
+_worker_shards: Dict[int, object] = {}
+_worker_nprobe = 8
+
+
+def read_manifest(directory: str) -> dict:
+    """Описание шардов (ValueError, если папка не содержит шардированный индекс)"""
+    path = os.path.join(directory, MANIFEST_NAME)
+    if not os.path.exists(path):
+        raise ValueError(f"В папке {directory} нет шардированного индекса")
+    with open(path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError(f"Неподдерживаемая версия шардированного индекса: {manifest.get('version')}")
+    return manifest
+
+
+class _StoreView:
+    """Часть хранилища (заданные id) с интерфейсом, который нужен write_snapshot"""
+
+    def __init__(self, store, ids: List[str]):
+        self.store = store
+        self.ids = ids
+        self.quantization = getattr(store, "quantization", None)
+        self.ivf = getattr(store, "ivf", None)
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[dict] = None,
+            include: Optional[List[str]] = None) -> dict:
+        return self.store.get(ids=self.ids if ids is None else ids, include=include)
+
+
+def assign_shards(ids: List[str], metadatas: List[dict], shards: int, by: str = "source") -> List[List[str]]:
+    """
+    Распределение id по шардам. "source": документы целиком, самые большие — в наименее
+    заполненный шард (шарды получаются примерно равными); "hash": crc32(id) % shards
+    """
+    if by not in SHARD_MODES:
+        raise ValueError(f"Неизвестный способ деления на шарды: {by}")
+    assigned: List[List[str]] = [[] for _ in range(shards)]
+    if by == "hash":
+        for chunk_id in ids:
+            assigned[zlib.crc32(chunk_id.encode("utf-8")) % shards].append(chunk_id)
+        return assigned
+    groups: Dict[object, List[str]] = {}
+    for chunk_id, metadata in zip(ids, metadatas):
+        groups.setdefault(metadata.get("source"), []).append(chunk_id)
+    sizes = [(0, shard) for shard in range(shards)]
+    for group in sorted(groups.values(), key=len, reverse=True):
+        size, shard = heapq.heappop(sizes)
+        assigned[shard].extend(group)
+        heapq.heappush(sizes, (size + len(group), shard))
+    return assigned
+
+
+def write_shards(directory: str, store, shards: int, by: str = "source", lexical_index=None,
+                 stats: Optional[IndexStats] = None, model: str = "", embedding_backend: str = "") -> dict:
+    """Запись шардов (файлы снимков), общего лексического индекса и описания в пустую папку"""
+    import time
+    from snapshot import write_snapshot
+    started = time.perf_counter()
+    if shards < 1:
+        raise ValueError("Число шардов должно быть положительным")
+    if os.path.isdir(directory) and os.listdir(directory):
+        raise ValueError(f"Папка {directory} не пуста")
+    os.makedirs(directory, exist_ok=True)
+
+    catalog = store.get(include=["metadatas"])
+    # Документы строки: свой и документы дубликатов, за которые она стоит (фильтр $duplicates)
+    sources_by_id = {chunk_id: {metadata.get("source")} | {source for source, _ in metadata.get(DUPLICATES_KEY) or ()}
+                     for chunk_id, metadata in zip(catalog["ids"], catalog["metadatas"])}
+    entries = []
+    for shard, shard_ids in enumerate(assign_shards(catalog["ids"], catalog["metadatas"], shards, by)):
+        filename = f"shard_{shard:03d}.ragsnap"
+        write_snapshot(os.path.join(directory, filename), _StoreView(store, shard_ids),
+                       model=model, embedding_backend=embedding_backend)
+        entries.append({
+            "file": filename,
+            "rows": len(shard_ids),
+            # Для деления по документам запрос с фильтром идет только в нужные шарды
+            "sources": sorted(set().union(*(sources_by_id[chunk_id] for chunk_id in shard_ids)), key=str)
+                       if by == "source" else None,
+        })
+    if lexical_index is not None and len(lexical_index):
+        _write_lexical(os.path.join(directory, LEXICAL_NAME), lexical_index)
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "model": model,
+        "embedding_backend": embedding_backend,
+        "by": by,
+        "shards": entries,
+        "stats": stats.to_dict() if stats is not None else None,
+    }
+    tmp_path = os.path.join(directory, MANIFEST_NAME + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, os.path.join(directory, MANIFEST_NAME))
+    return {
+        "rows": len(catalog["ids"]),
+        "shards": [entry["rows"] for entry in entries],
+        "seconds": time.perf_counter() - started,
+    }
+
+
+def _write_lexical(path: str, lexical_index):
+    import numpy as np
+    meta, arrays = lexical_index.to_arrays()
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, meta=np.frombuffer(json.dumps(meta, ensure_ascii=False).encode("utf-8"), dtype=np.uint8),
+                 **{key: np.frombuffer(data, dtype=np.uint8) for key, data in arrays.items()})
+    os.replace(tmp_path, path)
+
+
+def _read_lexical(path: str):
+    import numpy as np
+    from bm25_index import BM25Index
+    with np.load(path, allow_pickle=False) as data:
+        meta = json.loads(data["meta"].tobytes().decode("utf-8"))
+        arrays = {key: data[key].tobytes() for key in data.files if key != "meta"}
+    return BM25Index.from_arrays(meta, arrays)
+
+
+def _init_worker(paths: List[str], nprobe: int):
+    """
+    Инициализация процесса пула: один поток BLAS (параллельность дают сами процессы)
+    и открытие всех шардов, чтобы первый запрос к любому процессу их не ждал
+    """
+    global _worker_paths, _worker_nprobe
+    _worker_paths = paths
+    _worker_nprobe = nprobe
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(1)
+    except ImportError:
+        pass
+    for shard in range(len(paths)):
+        _worker_shard(shard)
+
+
+def _worker_shard(shard: int):
+    store = _worker_shards.get(shard)
+    if store is None:
+        from snapshot import SnapshotBackend
+        store = _worker_shards[shard] = SnapshotBackend(_worker_paths[shard], nprobe=_worker_nprobe)
+    return store
+
+
+def _query_shard(shard: int, queries, n_results: int, where: Optional[dict], nprobe: Optional[int]) -> dict:
+    return _worker_shard(shard).query(queries, n_results, where=where, nprobe=nprobe)
+
+
+def _get_shard(shard: int, ids: Optional[List[str]], where: Optional[dict], include: List[str]) -> dict:
+    return _worker_shard(shard).get(ids=ids, where=where, include=include)
+
+
+class ShardedBackend:
+    """Хранилище только для чтения: шарды-снимки, поиск в пуле процессов"""
+
+    name = "sharded"
+    supports_duplicates = True
+
+    def __init__(self, directory: str, workers: Optional[int] = None, nprobe: int = 8):
+        """workers: процессов в пуле (по умолчанию — по числу шардов, но не больше числа ядер)"""
+        self.directory = directory
+        self.manifest = read_manifest(directory)
+        self.paths = [os.path.join(directory, entry["file"]) for entry in self.manifest["shards"]]
+        self.rows = [entry["rows"] for entry in self.manifest["shards"]]
+        self.shard_sources = [set(entry["sources"]) if entry.get("sources") is not None else None
+                              for entry in self.manifest["shards"]]
+        self.workers = workers or max(1, min(len(self.paths), os.cpu_count() or 1))
+        # spawn, а не fork: в процессе бота работают фоновые потоки (загрузка, HTTP-сервис)
+        self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                         mp_context=multiprocessing.get_context("spawn"),
+                                         initializer=_init_worker, initargs=(self.paths, nprobe))
+        # Процессы запускаются сразу, а не при первом запросе (шарды открывает _init_worker)
+        for _ in range(self.workers):
+            self._pool.submit(os.getpid)
+
+    @property
+    def model(self) -> str:
+        return self.manifest.get("model", "")
+
+    @property
+    def stats(self) -> Optional[IndexStats]:
+        data = self.manifest.get("stats")
+        return IndexStats.from_dict(data) if data else None
+
+    @property
+    def disk_bytes(self) -> int:
+        return sum(os.path.getsize(os.path.join(self.directory, filename))
+                   for filename in os.listdir(self.directory))
+
+    def lexical_index(self):
+        """Общий лексический индекс шардов (None, если он не записан)"""
+        path = os.path.join(self.directory, LEXICAL_NAME)
+        if not os.path.exists(path):
+            return None
+        return _read_lexical(path)
+
+    def count(self) -> int:
+        return sum(self.rows)
+
+    def _shards_for(self, where: Optional[dict]) -> List[int]:
+        """Шарды, в которых могут быть подходящие строки"""
+        sources = where_sources(where)
+        return [shard for shard, shard_sources in enumerate(self.shard_sources)
+                if self.rows[shard] and (sources is None or shard_sources is None or shard_sources & sources)]
+
+    def query(self, query_embeddings: List[List[float]], n_results: int,
+              where: Optional[dict] = None, nprobe: Optional[int] = None) -> dict:
+        futures = [self._pool.submit(_query_shard, shard, query_embeddings, n_results, where, nprobe)
+                   for shard in self._shards_for(where)]
+        parts = [future.result() for future in futures]
+        results = {"ids": [], "documents": [], "metadatas": [], "scores": []}
+        for column in range(len(query_embeddings)):
+            # Списки шардов уже отсортированы по убыванию оценки: слияние вместо полной сортировки
+            ranked = [[(score, shard, position) for position, score in enumerate(part["scores"][column])]
+                      for shard, part in enumerate(parts)]
+            top = list(islice(heapq.merge(*ranked, key=lambda item: -item[0]), n_results))
+            for key in results:
+                results[key].append([parts[shard][key][column][position] for _, shard, position in top])
+        return results
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[dict] = None,
+            include: Optional[List[str]] = None) -> dict:
+        include = include if include is not None else ["documents", "metadatas"]
+        futures = [self._pool.submit(_get_shard, shard, ids, where, include)
+                   for shard in self._shards_for(where)]
+        results = {"ids": [], "documents": [], "metadatas": [], "embeddings": []}
+        for future in futures:
+            part = future.result()
+            for key in results:
+                if part.get(key) is not None:
+                    results[key].extend(part[key])
+        for key in ("documents", "metadatas", "embeddings"):
+            if key not in include:
+                results[key] = None
+        return results
+
+    def _read_only(self, *args, **kwargs):
+        raise RuntimeError("Шардированный индекс открыт только для чтения")
+
+    upsert = update = delete = _read_only
+
+    def persist(self):
+        pass
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Шардированный индекс для параллельного поиска")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_parser = commands.add_parser("build", help="деление существующей БД на шарды")
+    build_parser.add_argument("directory")
+    build_parser.add_argument("--persist-directory", default="./chroma_db")
+    build_parser.add_argument("--shards", type=int, default=os.cpu_count() or 1)
+    build_parser.add_argument("--by", choices=SHARD_MODES, default="source")
+    args = parser.parse_args(argv)
+
+    from rag_chatbot import SimpleRAGBot
+    bot = SimpleRAGBot(persist_directory=args.persist_directory, embedding_cache_path=None)
+    return 0 if bot.export_shards(args.directory, args.shards, by=args.by) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
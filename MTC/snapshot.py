@@ -0,0 +1,538 @@
+"""
+Снимок индекса в одном файле: векторы, тексты, метаданные, BM25, статистика и модель
+Индекс строится один раз, а затем файл копируется на узлы, которые только отвечают
+на запросы: SimpleRAGBot(snapshot="notes.ragsnap") открывает его без Chroma и без папки БД.
+При открытии читаются только заголовок, id строк и каталог документов; векторы и числовые
+поля метаданных отображаются в память (mmap), а тексты и метаданные распаковываются
+по блокам при выдаче результатов.
+
+Формат (версия 1):
+    RAGSNAP\\0 | длина заголовка (uint32 LE) | заголовок JSON | ... | секции
+Заголовок занимает первые SNAPSHOT_HEADER_BYTES байт и содержит версию, модель эмбеддингов,
+размерность, число строк и таблицу секций {имя: [смещение, длина]}.
+Строки упорядочены по документам. Секции выровнены по 64 байтам:
+    vectors         — нормированные float32 векторы (строки x размерность) подряд
+    quant, scales   — сжатая копия векторов (если хранилище использовало квантизацию)
+    ids             — id строк через \\0
+    catalog         — статистика, документы и их диапазоны строк, строки представителей
+                      по документам их дубликатов (JSON, zlib)
+    column:<поле>   — числовое поле метаданных (float64, NaN — нет значения), column:source — коды документов
+    texts, metadata — тексты и метаданные (JSON) блоками по BLOCK_ROWS строк, каждый блок сжат zlib;
+                      *_lengths — длины значений (uint32), *_blocks — смещения блоков (uint64)
+    bm25, ivf       — лексический индекс и IVF: поля JSON (zlib) и их массивы в секциях bm25:<имя>,
+                      ivf:<имя> (списки вхождений и номера строк uint32, центроиды float32).
+                      Pickle не используется: открытие чужого снимка не выполняет код
+
+Запуск:
+    python snapshot.py export --persist-directory ./chroma_db notes.ragsnap
+    python snapshot.py import notes.ragsnap --persist-directory ./replica_db
+    python snapshot.py info notes.ragsnap
+"""
+
+import os
+import sys
+import json
+import zlib
+import time
+import struct
+import argparse
+import threading
+from typing import Dict, List, Optional
+
+from index_stats import IndexStats
+from ivf_index import IVFIndex
+from query_cache import LRUCache
+from vector_backends import DUPLICATES_KEY, NumpyBackend, QUANTIZATION_MODES, quantize_vectors
+
+SNAPSHOT_MAGIC = b"RAGSNAP\0"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER_BYTES = 4096
+# Строк в одном сжатом блоке: для выдачи результата распаковывается только его блок
+BLOCK_ROWS = 64
+# Строк, читаемых из хранилища за один раз при записи снимка (кратно BLOCK_ROWS)
+EXPORT_BATCH_ROWS = 4096
+
+_ALIGNMENT = 64
+
+
+def read_header(path: str) -> dict:
+    """Заголовок снимка (ValueError, если файл не является снимком поддерживаемой версии)"""
+    with open(path, "rb") as f:
+        prefix = f.read(len(SNAPSHOT_MAGIC) + 4)
+        if len(prefix) < len(SNAPSHOT_MAGIC) + 4 or not prefix.startswith(SNAPSHOT_MAGIC):
+            raise ValueError(f"{path} не является снимком индекса")
+        (length,) = struct.unpack("<I", prefix[len(SNAPSHOT_MAGIC):])
+        header = json.loads(f.read(length).decode("utf-8"))
+    if header.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"Неподдерживаемая версия снимка: {header.get('version')}")
+    return header
+
+
+class _SectionWriter:
+    """Последовательная запись секций после зарезервированного заголовка"""
+
+    def __init__(self, f):
+        self.f = f
+        self.sections: Dict[str, List[int]] = {}
+        self._current: Optional[str] = None
+        f.seek(SNAPSHOT_HEADER_BYTES)
+
+    def begin(self, name: str):
+        position = self.f.tell()
+        padding = -position % _ALIGNMENT
+        if padding:
+            self.f.write(b"\0" * padding)
+        self.sections[name] = [position + padding, 0]
+        self._current = name
+
+    def write(self, data: bytes):
+        self.f.write(data)
+        self.sections[self._current][1] += len(data)
+
+    def add(self, name: str, data: bytes):
+        self.begin(name)
+        self.write(data)
+
+    def add_arrays(self, name: str, meta: dict, arrays: Dict[str, bytes]):
+        """Поля JSON (zlib) в секции name и каждый массив — в своей секции name:<массив>"""
+        self.add(name, zlib.compress(json.dumps(meta, ensure_ascii=False).encode("utf-8")))
+        for key, data in arrays.items():
+            self.add(f"{name}:{key}", data)
+
+
+class _BlockWriter:
+    """Значения переменной длины, сжатые блоками по BLOCK_ROWS строк (блоки копятся в памяти)"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.lengths: List[int] = []
+        self.offsets: List[int] = [0]
+        self.blocks: List[bytes] = []
+        self._pending: List[bytes] = []
+
+    def append(self, data: bytes):
+        self._pending.append(data)
+        self.lengths.append(len(data))
+        if len(self._pending) == BLOCK_ROWS:
+            self._flush()
+
+    def _flush(self):
+        if self._pending:
+            block = zlib.compress(b"".join(self._pending), 6)
+            self.blocks.append(block)
+            self.offsets.append(self.offsets[-1] + len(block))
+            self._pending = []
+
+    def write(self, sections: _SectionWriter):
+        import numpy as np
+        self._flush()
+        sections.add(f"{self.name}_lengths", np.asarray(self.lengths, dtype=np.uint32).tobytes())
+        sections.add(f"{self.name}_blocks", np.asarray(self.offsets, dtype=np.uint64).tobytes())
+        sections.begin(self.name)
+        for block in self.blocks:
+            sections.write(block)
+
+
+class _BlockReader:
+    """Чтение значений, записанных _BlockWriter; распакованные блоки хранятся в LRU-кеше"""
+
+    def __init__(self, snapshot: "SnapshotBackend", name: str, cached_blocks: int):
+        np = snapshot.np
+        self.snapshot = snapshot
+        self.offset = snapshot.sections[name][0]
+        lengths = np.frombuffer(snapshot._read_section(f"{name}_lengths"), dtype=np.uint32).astype(np.int64)
+        self.block_offsets = np.frombuffer(snapshot._read_section(f"{name}_blocks"), dtype=np.uint64).astype(np.int64)
+        # Смещение значения внутри распакованного блока
+        starts = np.zeros(len(lengths), dtype=np.int64)
+        if len(lengths):
+            starts[1:] = np.cumsum(lengths)[:-1]
+            starts -= starts[(np.arange(len(lengths)) // BLOCK_ROWS) * BLOCK_ROWS]
+        self.starts = starts
+        self.lengths = lengths
+        self.blocks = LRUCache(max_size=cached_blocks)
+
+    def _block(self, block: int) -> bytes:
+        data = self.blocks.get(block)
+        if data is None:
+            start, end = int(self.block_offsets[block]), int(self.block_offsets[block + 1])
+            with open(self.snapshot.path, "rb") as f:
+                f.seek(self.offset + start)
+                data = zlib.decompress(f.read(end - start))
+            self.blocks.put(block, data)
+        return data
+
+    def read(self, row: int) -> bytes:
+        data = self._block(row // BLOCK_ROWS)
+        start = int(self.starts[row])
+        return data[start:start + int(self.lengths[row])]
+
+
+class _LazyMetadatas:
+    """Метаданные строк снимка: JSON строки разбирается при обращении к ней"""
+
+    def __init__(self, reader: _BlockReader, rows: int):
+        self.reader = reader
+        self.rows = rows
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def __getitem__(self, row: int) -> dict:
+        if not 0 <= row < self.rows:
+            raise IndexError(row)
+        return json.loads(self.reader.read(row))
+
+    def __iter__(self):
+        for row in range(self.rows):
+            yield self[row]
+
+
+def _numeric_columns(metadatas: List[dict]) -> List[str]:
+    """Поля, значения которых во всех строках — числа или отсутствуют"""
+    keys = set()
+    for metadata in metadatas:
+        keys.update(metadata)
+    return sorted(key for key in keys if key != "source" and all(
+        isinstance(metadata.get(key), (int, float, type(None))) and not isinstance(metadata.get(key), bool)
+        for metadata in metadatas))
+
+
+def write_snapshot(path: str, store, lexical_index=None, stats: Optional[IndexStats] = None,
+                   model: str = "", embedding_backend: str = "") -> dict:
+    """
+    Запись снимка хранилища (любого из vector_backends) в один файл (атомарно, через временный).
+    Возвращает сводку: строки, размер файла и время записи
+    """
+    import numpy as np
+    started = time.perf_counter()
+    quantization = getattr(store, "quantization", None) or "none"
+
+    # Строки упорядочиваются по документам: раздел документа — непрерывный диапазон
+    catalog = store.get(include=["metadatas"])
+    sort_keys = [json.dumps(metadata.get("source"), ensure_ascii=False) for metadata in catalog["metadatas"]]
+    order = sorted(range(len(catalog["ids"])), key=sort_keys.__getitem__)
+    ids = [catalog["ids"][i] for i in order]
+    metadatas = [catalog["metadatas"][i] for i in order]
+    del catalog
+    rows = len(ids)
+    sources: List[object] = []
+    partitions: List[list] = []
+    source_codes = np.zeros(rows, dtype=np.uint32)
+    for row, metadata in enumerate(metadatas):
+        source = metadata.get("source")
+        if not partitions or partitions[-1][0] != source:
+            sources.append(source)
+            partitions.append([source, row, row])
+        partitions[-1][2] = row + 1
+        source_codes[row] = len(sources) - 1
+    duplicate_rows: Dict[object, List[int]] = {}
+    for row, metadata in enumerate(metadatas):
+        for source in {source for source, _ in metadata.get(DUPLICATES_KEY) or ()}:
+            duplicate_rows.setdefault(source, []).append(row)
+    numeric = _numeric_columns(metadatas)
+    dim = None
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        sections = _SectionWriter(f)
+        texts = _BlockWriter("texts")
+        sections.begin("vectors")
+        for start in range(0, rows, EXPORT_BATCH_ROWS):
+            requested = ids[start:start + EXPORT_BATCH_ROWS]
+            batch = store.get(ids=requested, include=["documents", "embeddings"])
+            # Хранилище может вернуть строки в другом порядке
+            position = {chunk_id: i for i, chunk_id in enumerate(batch["ids"])}
+            picked = [position[chunk_id] for chunk_id in requested]
+            vectors = np.asarray(batch["embeddings"], dtype=np.float32)[picked]
+            vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+            dim = vectors.shape[1]
+            sections.write(vectors.tobytes())
+            for i in picked:
+                texts.append(batch["documents"][i].encode("utf-8"))
+
+        f.flush()
+        matrix = None
+        if rows:
+            offset, _ = sections.sections["vectors"]
+            matrix = np.memmap(tmp_path, dtype=np.float32, mode="r", offset=offset, shape=(rows, dim))
+        if quantization != "none" and matrix is not None:
+            scale_parts = []
+            sections.begin("quant")
+            for start in range(0, rows, EXPORT_BATCH_ROWS):
+                quantized, scales = quantize_vectors(np.asarray(matrix[start:start + EXPORT_BATCH_ROWS]),
+                                                     quantization)
+                sections.write(quantized.tobytes())
+                if scales is not None:
+                    scale_parts.append(scales.tobytes())
+            if scale_parts:
+                sections.add("scales", b"".join(scale_parts))
+
+        sections.add("ids", "\0".join(ids).encode("utf-8"))
+        sections.add("catalog", zlib.compress(json.dumps({
+            "stats": stats.to_dict() if stats is not None else None,
+            "sources": sources,
+            "partitions": partitions,
+            "duplicate_rows": [[source, rows] for source, rows in duplicate_rows.items()],
+            "columns": numeric,
+        }, ensure_ascii=False).encode("utf-8")))
+        sections.add("column:source", source_codes.tobytes())
+        for key in numeric:
+            column = np.array([np.nan if metadata.get(key) is None else metadata[key] for metadata in metadatas],
+                              dtype=np.float64)
+            sections.add(f"column:{key}", column.tobytes())
+        texts.write(sections)
+        metadata_blocks = _BlockWriter("metadata")
+        for metadata in metadatas:
+            metadata_blocks.append(json.dumps(metadata, ensure_ascii=False).encode("utf-8"))
+        metadata_blocks.write(sections)
+        if lexical_index is not None and len(lexical_index):
+            sections.add_arrays("bm25", *lexical_index.to_arrays())
+
+        ivf = getattr(store, "ivf", None)
+        if ivf is not None and ivf.is_trained and matrix is not None:
+            # Номера строк в снимке другие: списки строятся заново с прежними центроидами
+            snapshot_ivf = IVFIndex(ivf.nlist)
+            snapshot_ivf.centroids = ivf.centroids
+            snapshot_ivf.trained_rows = ivf.trained_rows
+            snapshot_ivf.reassign(matrix)
+            sections.add_arrays("ivf", *snapshot_ivf.to_arrays())
+        del matrix
+
+        header = {
+            "version": SNAPSHOT_VERSION,
+            "model": model,
+            "embedding_backend": embedding_backend,
+            "dim": dim or 0,
+            "rows": rows,
+            "quantization": quantization,
+            "index": "ivf" if "ivf" in sections.sections else "flat",
+            "created_at": time.time(),
+            "sections": sections.sections,
+        }
+        encoded_header = json.dumps(header, ensure_ascii=False).encode("utf-8")
+        if len(SNAPSHOT_MAGIC) + 4 + len(encoded_header) > SNAPSHOT_HEADER_BYTES:
+            raise ValueError("Заголовок снимка не помещается в отведенное место")
+        f.seek(0)
+        f.write(SNAPSHOT_MAGIC + struct.pack("<I", len(encoded_header)) + encoded_header)
+    os.replace(tmp_path, path)
+    return {
+        "rows": rows,
+        "size_mb": os.path.getsize(path) / 1024 / 1024,
+        "seconds": time.perf_counter() - started,
+    }
+
+
+class SnapshotBackend(NumpyBackend):
+    """
+    Хранилище только для чтения поверх файла снимка.
+    Поиск, фильтры, квантизация и IVF — те же, что у NumpyBackend; отличается только
+    источник данных, поэтому конструктор NumpyBackend (он работает с папкой БД) не вызывается.
+    """
+
+    name = "snapshot"
+
+    def __init__(self, path: str, nprobe: int = 8, rescore_factor: int = 4,
+                 ivf_min_rows: int = 20000, cached_blocks: int = 256):
+        """cached_blocks: сколько распакованных блоков текстов (и метаданных) держать в памяти"""
+        import numpy as np
+        self.np = np
+        self.path = path
+        self.persist_directory = os.path.dirname(os.path.abspath(path))
+        self.header = read_header(path)
+        self.sections = self.header["sections"]
+        self.dim = self.header["dim"] or None
+        self.quantization = self.header["quantization"]
+        if self.quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"Неизвестный режим квантизации: {self.quantization}")
+        self.index = self.header["index"]
+        self.rescore_factor = rescore_factor
+        self.nlist = None
+        self.nprobe = nprobe
+        self.ivf_min_rows = ivf_min_rows
+        self._lock = threading.RLock()
+        self._readers = 0
+        self._readers_done = threading.Condition(self._lock)
+        self._columns: Dict[str, object] = {}
+        self._id_to_row: Optional[Dict[str, int]] = None
+
+        rows = self.header["rows"]
+        self.ids = self._read_section("ids").decode("utf-8").split("\0") if rows else []
+        self.alive = np.ones(rows, dtype=bool)
+        self.catalog = json.loads(zlib.decompress(self._read_section("catalog")).decode("utf-8"))
+        self.source_rows = {source: range(start, stop) for source, start, stop in self.catalog["partitions"]}
+        self.duplicate_rows = {source: rows for source, rows in self.catalog["duplicate_rows"]}
+        self.texts = _BlockReader(self, "texts", cached_blocks)
+        self.metadatas = _LazyMetadatas(_BlockReader(self, "metadata", cached_blocks), rows)
+
+        self._matrix = self._map("vectors", np.float32, (rows, self.dim or 0))
+        self._quant = self._scales = None
+        if self.quantization != "none":
+            dtype = np.float16 if self.quantization == "float16" else np.int8
+            self._quant = self._map("quant", dtype, (rows, self.dim or 0))
+            if self.quantization == "int8":
+                self._scales = self._map("scales", np.float32, (rows,))
+
+        self.ivf = IVFIndex.from_arrays(*self._read_arrays("ivf")) if "ivf" in self.sections else IVFIndex()
+
+    def _read_section(self, name: str) -> bytes:
+        offset, length = self.sections[name]
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def _read_arrays(self, name: str):
+        """Поля JSON секции name и массивы из секций name:<массив> (см. _SectionWriter.add_arrays)"""
+        meta = json.loads(zlib.decompress(self._read_section(name)).decode("utf-8"))
+        prefix = name + ":"
+        arrays = {key[len(prefix):]: self._read_section(key) for key in self.sections if key.startswith(prefix)}
+        return meta, arrays
+
+    def _map(self, name: str, dtype, shape):
+        np = self.np
+        if not shape[0] or not self.dim:
+            return np.zeros(shape, dtype=dtype)
+        offset, _ = self.sections[name]
+        return np.memmap(self.path, dtype=dtype, mode="r", offset=offset, shape=shape)
+
+    @property
+    def model(self) -> str:
+        return self.header.get("model", "")
+
+    @property
+    def stats(self) -> Optional[IndexStats]:
+        data = self.catalog.get("stats")
+        return IndexStats.from_dict(data) if data else None
+
+    @property
+    def disk_bytes(self) -> int:
+        return os.path.getsize(self.path)
+
+    @property
+    def id_to_row(self) -> Dict[str, int]:
+        # Нужен только для выборки по id (лексический поиск): строится при первом обращении
+        if self._id_to_row is None:
+            self._id_to_row = dict(zip(self.ids, range(len(self.ids))))
+        return self._id_to_row
+
+    def count(self) -> int:
+        return len(self.ids)
+
+    def lexical_index(self):
+        """BM25Index из снимка (None, если снимок записан без него)"""
+        from bm25_index import BM25Index
+        if "bm25" not in self.sections:
+            return None
+        return BM25Index.from_arrays(*self._read_arrays("bm25"))
+
+    @property
+    def matrix(self):
+        return self._matrix
+
+    @property
+    def quant_matrix(self):
+        return self._quant
+
+    def _column(self, key: str):
+        """Документ и числовые поля берутся из готовых столбцов снимка, остальные — из метаданных"""
+        np = self.np
+        column = self._columns.get(key)
+        if column is not None:
+            return column
+        if key == "source":
+            categories = np.empty(len(self.catalog["sources"]), dtype=object)
+            categories[:] = self.catalog["sources"]
+            codes = np.frombuffer(self._read_section("column:source"), dtype=np.uint32)
+            column = categories[codes] if len(codes) else np.empty(0, dtype=object)
+        elif key in self.catalog["columns"]:
+            column = self._map(f"column:{key}", np.float64, (len(self.ids),))
+        else:
+            return super()._column(key)
+        self._columns[key] = column
+        return column
+
+    def _read_texts(self, rows: List[int]) -> List[str]:
+        return [self.texts.read(row).decode("utf-8") for row in rows]
+
+    def _read_only(self, *args, **kwargs):
+        raise RuntimeError("Снимок индекса открыт только для чтения")
+
+    upsert = update = delete = build_ivf = _read_only
+
+    def persist(self):
+        pass
+
+    def close(self):
+        self._matrix = self._quant = self._scales = None
+        self._columns = {}
+        self.texts.blocks.clear()
+        self.metadatas.reader.blocks.clear()
+
+
+def import_snapshot(path: str, persist_directory: str) -> dict:
+    """
+    Распаковка снимка в папку БД хранилища numpy (для узла, который будет дописывать индекс).
+    Векторы копируются без пересчета эмбеддингов
+    """
+    started = time.perf_counter()
+    if os.path.isdir(persist_directory) and os.listdir(persist_directory):
+        raise ValueError(f"Папка {persist_directory} не пуста")
+    snapshot = SnapshotBackend(path)
+    store = NumpyBackend(persist_directory, quantization=snapshot.quantization, index=snapshot.index)
+    rows = len(snapshot.ids)
+    for start in range(0, rows, EXPORT_BATCH_ROWS):
+        batch_rows = list(range(start, min(rows, start + EXPORT_BATCH_ROWS)))
+        store.upsert([snapshot.ids[row] for row in batch_rows],
+                     snapshot.np.asarray(snapshot.matrix[batch_rows]),
+                     [snapshot.metadatas[row] for row in batch_rows],
+                     snapshot._read_texts(batch_rows))
+    if snapshot.index == "ivf" and snapshot.ivf.is_trained:
+        # Нумерация строк совпадает со снимком, списки IVF переносятся как есть
+        store.ivf = snapshot.ivf
+    store.persist()
+    store.close()
+
+    lexical_index = snapshot.lexical_index()
+    if lexical_index is not None:
+        lexical_index.save(os.path.join(persist_directory, "bm25_index.pkl"))
+    stats = snapshot.stats
+    if stats is not None:
+        stats.refresh_disk_size(persist_directory)
+        stats.save(os.path.join(persist_directory, "index_stats.json"))
+    snapshot.close()
+    return {"rows": rows, "seconds": time.perf_counter() - started}
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Снимок индекса в одном файле")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="запись снимка из папки БД")
+    export_parser.add_argument("path")
+    export_parser.add_argument("--persist-directory", default="./chroma_db")
+    import_parser = commands.add_parser("import", help="распаковка снимка в папку БД (хранилище numpy)")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--persist-directory", default="./chroma_db")
+    info_parser = commands.add_parser("info", help="заголовок снимка")
+    info_parser.add_argument("path")
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        from rag_chatbot import SimpleRAGBot
+        bot = SimpleRAGBot(persist_directory=args.persist_directory, embedding_cache_path=None)
+        return 0 if bot.export_snapshot(args.path) else 1
+    if args.command == "import":
+        summary = import_snapshot(args.path, args.persist_directory)
+        print(f"✅ Снимок распакован в {args.persist_directory}: {summary['rows']} фрагментов "
+              f"за {summary['seconds']:.1f} с")
+        return 0
+    header = read_header(args.path)
+    print(f"📦 {args.path}: версия {header['version']}, {header['rows']} фрагментов, "
+          f"размерность {header['dim']}, модель {header['model'] or '?'} ({header['embedding_backend'] or '?'})")
+    print(f"   Квантизация: {header['quantization']}, индекс: {header['index']}, "
+          f"создан {time.strftime('%d.%m.%Y %H:%M', time.localtime(header['created_at']))}")
+    for name, (offset, length) in header["sections"].items():
+        print(f"   • {name:<18} {length / 1024 / 1024:9.2f} MB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
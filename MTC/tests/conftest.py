@@ -0,0 +1,89 @@
+"""Общие фикстуры тестов: модули проекта лежат в папке MTC (на уровень выше)"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_vectors(rows: int, dim: int = 16, seed: int = 0):
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    return rng.normal(size=(rows, dim)).astype(np.float32)
+
+
+@pytest.fixture
+def numpy_store(tmp_path):
+    """Хранилище numpy с тремя документами по 10 чанков (страницы 1-10)"""
+    from vector_backends import NumpyBackend
+    store = NumpyBackend(str(tmp_path / "db"))
+    vectors = make_vectors(30)
+    ids = [f"{source}:{page}" for source in ("a.pdf", "b.pdf", "c.pdf") for page in range(1, 11)]
+    store.upsert(
+        ids=ids,
+        embeddings=vectors.tolist(),
+        metadatas=[{"source": chunk_id.split(":")[0], "page": int(chunk_id.split(":")[1])} for chunk_id in ids],
+        documents=[f"текст чанка {chunk_id}" for chunk_id in ids],
+    )
+    store.persist()
+    yield store
+    store.close()
+
+
+class FakeEmbeddings:
+    """Эмбеддинги без модели: мешок слов, хешированный в 64 измерения"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def embed_documents(self, texts):
+        self.calls += len(texts)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        self.calls += 1
+        return self._vector(text)
+
+    def _vector(self, text):
+        import re
+        import zlib
+        vector = [0.0] * 64
+        for word in re.findall(r"\w+", text.lower()):
+            vector[zlib.crc32(word.encode("utf-8")) % 64] += 1.0
+        return vector
+
+
+@pytest.fixture
+def make_bot(tmp_path, monkeypatch):
+    """
+    Фабрика SimpleRAGBot на хранилище numpy без модели и без чтения PDF:
+    содержимое "PDF" — ключ словаря pages, значение — тексты страниц
+    """
+    import rag_chatbot
+    pages = {}
+
+    def iter_pages(pdf, source=None):
+        for page, text in enumerate(pages[pdf], 1):
+            yield rag_chatbot._SimpleDocument(text, {"page": page, "source": source,
+                                                     "page_hash": rag_chatbot._hash_text(text)})
+
+    monkeypatch.setattr(rag_chatbot, "_IMPORT_SECONDS", 0.0)
+    monkeypatch.setattr(rag_chatbot, "_iter_pdf_pages", iter_pages)
+    monkeypatch.setattr(rag_chatbot, "_count_pdf_pages", lambda pdf: len(pages[pdf]))
+    monkeypatch.setattr(rag_chatbot, "_content_hash", lambda pdf: rag_chatbot._hash_text(repr(pages[pdf])))
+    bots = []
+
+    def factory(**kwargs):
+        kwargs.setdefault("persist_directory", str(tmp_path / "bot_db"))
+        bot = rag_chatbot.SimpleRAGBot(backend="numpy", lazy=True, embedding_cache_path=None, **kwargs)
+        bot._embeddings = FakeEmbeddings()
+        bots.append(bot)
+        return bot
+
+    factory.pages = pages
+    yield factory
+    for bot in bots:
+        if bot.vector_store is not None:
+            bot.vector_store.close()
@@ -0,0 +1,73 @@
+from bm25_index import BM25Index, normalize_token, reciprocal_rank_fusion
+
+
+def test_search_ranks_matching_chunks():
+    index = BM25Index()
+    index.add(["a", "b", "c"], ["градиентный спуск и нейросети", "регуляризация моделей", "спуск по склону"])
+    ranked = [chunk_id for chunk_id, _ in index.search("градиентный спуск", k=3)]
+    assert ranked[0] == "a"
+    assert set(ranked) == {"a", "c"}
+
+
+def test_replace_and_remove_update_postings():
+    index = BM25Index()
+    index.add(["a", "b"], ["кошка", "собака"])
+    index.add(["a"], ["попугай"])
+    assert len(index) == 2
+    assert "кошк" not in index and normalize_token("кошка") not in index
+    assert [chunk_id for chunk_id, _ in index.search("попугай")] == ["a"]
+
+    index.remove(["a", "missing"])
+    assert len(index) == 1
+    assert index.search("попугай") == []
+    assert index.total_length == 1
+    assert [chunk_id for chunk_id, _ in index.search("собака")] == ["b"]
+
+
+def test_duplicate_id_in_batch_keeps_last_text():
+    index = BM25Index()
+    index.add(["a", "a"], ["первый", "второй"])
+    assert len(index) == 1
+    assert index.search("первый") == []
+    assert [chunk_id for chunk_id, _ in index.search("второй")] == ["a"]
+
+
+def test_compaction_keeps_search_results():
+    index = BM25Index()
+    ids = [f"c{i}" for i in range(1500)]
+    index.add(ids, [f"слово{i % 7} общий" for i in range(1500)])
+    index.remove(ids[:1000])
+    assert len(index.slot_ids) == 500
+    assert {chunk_id for chunk_id, _ in index.search("слово3", k=1000)} == {
+        chunk_id for i, chunk_id in enumerate(ids) if i >= 1000 and i % 7 == 3}
+
+
+def test_allowed_and_save_load(tmp_path):
+    index = BM25Index()
+    index.add(["a", "b"], ["общий текст", "общий текст"])
+    assert [chunk_id for chunk_id, _ in index.search("общий", allowed={"b"})] == ["b"]
+
+    path = str(tmp_path / "bm25.pkl")
+    index.save(path)
+    loaded = BM25Index.load(path)
+    assert loaded.search("общий") == index.search("общий")
+    loaded.remove(["a"])
+    assert [chunk_id for chunk_id, _ in loaded.search("общий")] == ["b"]
+
+
+def test_reciprocal_rank_fusion():
+    fused = reciprocal_rank_fusion([["a", "b"], ["b", "c"]])
+    assert fused[0][0] == "b"
+    assert [chunk_id for chunk_id, _ in fused] == ["b", "a", "c"]
+
+
+def test_arrays_round_trip():
+    index = BM25Index()
+    index.add(["a", "b", "c"], ["градиентный спуск", "регуляризация моделей", "спуск по склону"])
+    index.remove(["b"])
+    restored = BM25Index.from_arrays(*index.to_arrays())
+    assert restored.search("спуск") == index.search("спуск")
+    assert [terms and sorted(terms) for terms in restored.slot_terms] == \
+        [terms and sorted(terms) for terms in index.slot_terms]
+    restored.remove(["a"])
+    assert [chunk_id for chunk_id, _ in restored.search("спуск")] == ["c"]
@@ -0,0 +1,124 @@
+import pytest
+
+from dedup import DedupReport, NearDuplicateIndex
+from search_filters import SearchFilter
+from vector_backends import DUPLICATES_KEY, matches_where
+
+BASE = ("градиентный спуск минимизирует функцию потерь по параметрам модели "
+        "шаг обучения выбирается так чтобы потери уменьшались на каждой итерации")
+NEAR = BASE + " обучения"
+OTHER = "регуляризация снижает переобучение и улучшает обобщение модели на новых данных"
+
+
+def test_near_duplicates_dropped_within_document():
+    index = NearDuplicateIndex()
+    report = DedupReport()
+    kept = index.filter(["a1", "a2", "a3"], [BASE, NEAR, OTHER],
+                        [{"source": "a.pdf"}] * 3, report)
+    assert kept == [0, 2]
+    assert report.checked == 3 and report.dropped == 1
+    assert report.per_source == {"a.pdf": 1}
+    assert index.dropped["a2"].representative == "a1"
+    assert [record.chunk_id for record in index.dropped_for_source("a.pdf")] == ["a2"]
+
+
+def test_same_text_in_other_document_is_merged():
+    index = NearDuplicateIndex()
+    assert index.filter(["a1"], [BASE], [{"source": "a.pdf", "page": 1}]) == [0]
+    assert index.take_touched() == set()
+    assert index.filter(["b1"], [BASE], [{"source": "b.pdf", "page": 4}]) == []
+    assert len(index) == 1
+    assert index.dropped["b1"].representative == "a1"
+    assert index.locations("a1") == [["b.pdf", 4]]
+    assert index.take_touched() == {"a1"}
+
+    # Без cross_document дубликаты ищутся только внутри документа
+    local = NearDuplicateIndex(cross_document=False)
+    local.filter(["a1"], [BASE], [{"source": "a.pdf"}])
+    assert local.filter(["b1"], [BASE], [{"source": "b.pdf"}]) == [0]
+
+
+def test_locations_follow_removal_and_metadata_updates():
+    index = NearDuplicateIndex()
+    index.filter(["a1", "b1", "c1"], [BASE, BASE, BASE],
+                 [{"source": "a.pdf", "page": 1}, {"source": "b.pdf", "page": 2}, {"source": "c.pdf", "page": 3}])
+    assert index.locations("a1") == [["b.pdf", 2], ["c.pdf", 3]]
+    index.update_metadata(["b1"], [{"source": "b.pdf", "page": 5}])
+    assert index.locations("a1") == [["b.pdf", 5], ["c.pdf", 3]]
+    index.take_touched()
+    index.remove(["c1"])
+    assert index.locations("a1") == [["b.pdf", 5]]
+    assert index.take_touched() == {"a1"}
+
+
+def test_duplicates_condition_matches_locations():
+    metadata = {"source": "a.pdf", "page": 1, DUPLICATES_KEY: [["b.pdf", 2]]}
+    where = {"$and": [{"source": {"$in": ["b.pdf"]}}, {"page": {"$lte": 3}}]}
+    assert not matches_where(metadata, where)
+    assert matches_where(metadata, {"$or": [where, {"$duplicates": where}]})
+    assert not matches_where(metadata, {"$duplicates": {"source": "b.pdf", "page": 7}})
+    assert not matches_where({"source": "a.pdf", "page": 1}, {"$duplicates": {"source": "a.pdf"}})
+
+
+def test_removing_representative_promotes_duplicate():
+    index = NearDuplicateIndex()
+    index.filter(["a1", "a2"], [BASE, BASE], [{"source": "a.pdf", "page": 1}] * 2)
+    promoted = index.remove(["a1"])
+    assert [record.chunk_id for record in promoted] == ["a2"]
+    assert "a2" in index.signatures and not index.dropped
+    assert index.find(index.signature(BASE), "a.pdf") == "a2"
+    assert index.remove(["a2"]) == []
+    assert len(index) == 0
+
+
+def test_update_metadata_and_save_load(tmp_path):
+    index = NearDuplicateIndex()
+    index.filter(["a1", "a2", "a3"], [BASE, BASE, OTHER], [{"source": "a.pdf", "page": 1}] * 3)
+    rest_ids, _ = index.update_metadata(["a2", "a3"], [{"source": "a.pdf", "page": 2}] * 2)
+    assert rest_ids == ["a3"]
+    assert index.dropped["a2"].metadata["page"] == 2
+
+    path = str(tmp_path / "dedup.pkl")
+    index.save(path)
+    loaded = NearDuplicateIndex.load(path)
+    assert len(loaded) == 2
+    assert loaded.find(loaded.signature(NEAR), "a.pdf") == "a1"
+    assert [record.chunk_id for record in loaded.dropped_for_source("a.pdf")] == ["a2"]
+
+
+def test_load_applies_explicit_parameters(tmp_path):
+    path = str(tmp_path / "dedup.pkl")
+    index = NearDuplicateIndex(threshold=0.8)
+    index.filter(["a1"], [BASE], [{"source": "a.pdf"}])
+    index.save(path)
+
+    loaded = NearDuplicateIndex.load(path, threshold=0.95, cross_document=False)
+    assert loaded.threshold == 0.95
+    # Корзины перестроены под новый ключ: представитель находится из своего документа
+    assert loaded.find(loaded.signature(BASE), "a.pdf") == "a1"
+    assert loaded.find(loaded.signature(BASE), "b.pdf") is None
+    assert NearDuplicateIndex.load(path).threshold == 0.8
+    with pytest.raises(ValueError):
+        NearDuplicateIndex.load(path, num_perm=128, bands=8)
+
+
+def test_filtered_search_finds_text_dropped_in_other_document(make_bot):
+    make_bot.pages[b"a"] = [BASE, OTHER]
+    make_bot.pages[b"b"] = ["введение в курс машинного обучения", BASE]
+    bot = make_bot()
+    bot.process_pdf(b"a", source="a.pdf")
+    bot.process_pdf(b"b", source="b.pdf")
+    assert bot.chunks_count == 3
+
+    filters = SearchFilter.create(sources=["b.pdf"], pages="2")
+    for mode in ("vector", "lexical", "hybrid"):
+        found = bot.search("градиентный спуск", k=3, mode=mode, filters=filters)
+        assert [(chunk.source, chunk.page) for chunk in found] == [("a.pdf", 1)]
+
+    # Документ-представитель изменился: текст переходит к дубликату из b.pdf
+    make_bot.pages[b"a2"] = ["новая первая страница про нейросети", OTHER]
+    bot.process_pdf(b"a2", source="a.pdf")
+    found = bot.search("градиентный спуск", k=1, mode="lexical")
+    assert [(chunk.source, chunk.page) for chunk in found] == [("b.pdf", 2)]
+    metadatas = bot.vector_store.get(include=["metadatas"])["metadatas"]
+    assert not any(metadata.get(DUPLICATES_KEY) for metadata in metadatas)
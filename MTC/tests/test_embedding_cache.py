@@ -0,0 +1,34 @@
+from conftest import FakeEmbeddings
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+
+
+def test_cache_round_trip_and_key_normalization(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"))
+    cache.put_many("model-a", ["первый  текст", "второй"], [[1.0, 2.0], [3.0, 4.0]])
+    assert cache.get_many("model-a", ["первый текст", "второй", "третий"]) == [[1.0, 2.0], [3.0, 4.0], None]
+    # Векторы разных моделей не смешиваются
+    assert cache.get_many("model-b", ["второй"]) == [None]
+    assert (cache.hits, cache.misses) == (2, 2)
+
+    reopened = EmbeddingCache(str(tmp_path / "cache.sqlite"))
+    assert len(reopened) == 2
+    assert reopened.get_many("model-a", ["второй"]) == [[3.0, 4.0]]
+
+
+def test_eviction_keeps_recently_used(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"), max_entries=10)
+    cache.put_many("m", [f"старый {i}" for i in range(10)], [[float(i)] for i in range(10)])
+    cache.get_many("m", ["старый 9"])
+    cache.put_many("m", ["новый"], [[42.0]])
+    assert len(cache) == 9
+    assert cache.get_many("m", ["старый 9", "новый"]) == [[9.0], [42.0]]
+
+
+def test_cached_embeddings_call_model_only_for_misses(tmp_path):
+    model = FakeEmbeddings()
+    embeddings = CachedEmbeddings(model, EmbeddingCache(str(tmp_path / "cache.sqlite")), "fake")
+    first = embeddings.embed_documents(["альфа", "бета"])
+    assert model.calls == 2
+    second = embeddings.embed_documents(["бета", "гамма", "альфа"])
+    assert model.calls == 3
+    assert second[0] == first[1] and second[2] == first[0]
@@ -0,0 +1,121 @@
+import asyncio
+import threading
+
+import pytest
+
+import http_service
+from http_service import RAGHttpService
+
+
+class _Bot:
+    """Заглушка бота: запоминает запросы поиска и потоки, в которых читали chunks_count"""
+    is_ready = True
+    last_rerank = None
+    index_version = 0
+    stats = None
+
+    def __init__(self):
+        self.batches = []
+        self.count_threads = []
+
+    @property
+    def chunks_count(self):
+        self.count_threads.append(threading.current_thread())
+        return 0
+
+    def search_many(self, queries, k, mode=None, nprobe=None, filters=None):
+        self.batches.append(list(queries))
+        return [[] for _ in queries]
+
+    def search(self, query, k, mode=None, nprobe=None, filters=None):
+        raise RuntimeError("секретный путь /srv/db")
+
+
+async def _exchange(service, raw: bytes) -> bytes:
+    """Отправка сырого запроса (соединение закрывается клиентом после записи)"""
+    server = await asyncio.start_server(service.handle_connection, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(raw)
+        writer.write_eof()
+        response = await asyncio.wait_for(reader.read(), 10)
+        writer.close()
+        return response
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+def _status(response: bytes) -> int:
+    return int(response.split(b" ", 2)[1])
+
+
+@pytest.fixture
+def service(tmp_path):
+    service = RAGHttpService(_Bot(), workers=1, ingest_dir=str(tmp_path))
+    yield service
+    service.search_pool.shutdown()
+    service.ingest_pool.shutdown()
+
+
+@pytest.mark.parametrize("headers, body", [
+    (b"Content-Length: abc\r\n", b""),
+    (b"Content-Length: -5\r\n", b""),
+    (b"Content-Length: 50\r\n", b'{"queries": ['),
+])
+def test_bad_content_length_gets_400(service, headers, body):
+    raw = b"POST /search_many HTTP/1.1\r\n" + headers + b"\r\n" + body
+    assert _status(asyncio.run(_exchange(service, raw))) == 400
+
+
+def test_body_too_large(service):
+    raw = b"POST /search HTTP/1.1\r\nContent-Length: %d\r\n\r\n" % (http_service.MAX_BODY_BYTES + 1)
+    assert _status(asyncio.run(_exchange(service, raw))) == 413
+
+
+def test_search_many_batch_limit(service):
+    status, _ = asyncio.run(service.dispatch(
+        "POST", "/search_many", b'{"queries": [%s]}' % b",".join([b'"q"'] * (http_service.MAX_BATCH_QUERIES + 1))))
+    assert status == 413
+    status, payload = asyncio.run(service.dispatch("POST", "/search_many", b'{"queries": ["a", "b"], "k": 2}'))
+    assert status == 200 and payload == {"results": [[], []]}
+    assert service.bot.batches == [["a", "b"]]
+
+
+@pytest.mark.parametrize("body, status", [
+    (b"not json", 400),
+    (b"[1, 2]", 400),
+    (b'{"queries": "a"}', 400),
+    (b'{"queries": ["a"], "k": 0}', 400),
+    (b'{"queries": ["a"], "k": true}', 400),
+    (b'{"queries": ["a"], "nprobe": true}', 400),
+    (b'{"queries": ["a"], "pages": "1-x"}', 400),
+])
+def test_invalid_bodies(service, body, status):
+    assert asyncio.run(service.dispatch("POST", "/search_many", body))[0] == status
+
+
+def test_unknown_routes(service):
+    assert asyncio.run(service.dispatch("GET", "/nope", b""))[0] == 404
+    assert asyncio.run(service.dispatch("GET", "/search", b""))[0] == 405
+
+
+def test_ingest_paths_confined(service, tmp_path):
+    assert asyncio.run(service.dispatch("POST", "/ingest", b'{"path": "../outside.pdf"}'))[0] == 403
+    assert asyncio.run(service.dispatch("POST", "/ingest", b'{"path": "/etc/passwd"}'))[0] == 403
+    service.ingest_dir = None
+    assert asyncio.run(service.dispatch("POST", "/ingest", b'{"path": "a.pdf"}'))[0] == 403
+
+
+def test_stats_counts_chunks_off_the_event_loop(service):
+    status, payload = asyncio.run(service.dispatch("GET", "/stats", b""))
+    assert status == 200 and payload["chunks"] == 0
+    assert service.bot.count_threads and threading.main_thread() not in service.bot.count_threads
+
+
+def test_internal_error_is_not_exposed(service, capsys):
+    status, payload = asyncio.run(service.dispatch("POST", "/search", b'{"query": "q"}'))
+    assert status == 500
+    assert "/srv/db" not in payload["error"]
+    assert "/srv/db" in capsys.readouterr().err
@@ -0,0 +1,66 @@
+from rag_chatbot import _IngestPlan, _SimpleDocument, _hash_text, _make_chunk_id
+
+PAGE_1 = "Нейросети состоят из слоев нейронов. Каждый слой преобразует входные данные."
+PAGE_2 = "Градиентный спуск минимизирует функцию потерь по параметрам модели."
+PAGE_3 = "Регуляризация снижает переобучение и улучшает обобщение модели."
+
+
+def _chunk(text: str, page: int) -> _SimpleDocument:
+    return _SimpleDocument(text, {"page": page, "source": "a.pdf"})
+
+
+def test_plan_ids_are_stable_and_count_occurrences():
+    plan = _IngestPlan("a.pdf", {})
+    chunks, ids = plan.add_chunks([_chunk(PAGE_1, 1), _chunk(PAGE_1, 1), _chunk(PAGE_1, 2)])
+    assert len(chunks) == 3 and len(set(ids)) == 3
+    assert ids[0] == _make_chunk_id("a.pdf", 1, _hash_text(PAGE_1), 0)
+    assert ids[1] == _make_chunk_id("a.pdf", 1, _hash_text(PAGE_1), 1)
+    assert _IngestPlan("a.pdf", {}).add_chunks([_chunk(PAGE_1, 1)])[1] == ids[:1]
+
+
+def test_plan_detects_changed_pages_and_stale_chunks():
+    old_ids = [_make_chunk_id("a.pdf", page, _hash_text(text), 0)
+               for page, text in ((1, PAGE_1), (2, PAGE_2))]
+    plan = _IngestPlan("a.pdf", {1: (_hash_text(PAGE_1), [old_ids[0]]),
+                                 2: (_hash_text(PAGE_2), [old_ids[1]])})
+    assert plan.known_page_hashes() == {1: _hash_text(PAGE_1), 2: _hash_text(PAGE_2)}
+    assert plan.page_unchanged(1, _hash_text(PAGE_1))
+    assert not plan.page_unchanged(2, _hash_text(PAGE_3))
+    chunks, ids = plan.add_chunks([_chunk(PAGE_3, 2)])
+    assert [chunk.page_content for chunk in chunks] == [PAGE_3]
+    assert plan.stale_ids() == [old_ids[1]]
+    assert plan.unchanged_count == 1
+
+
+def test_plan_keeps_text_that_moved_within_changed_page():
+    chunk_id = _make_chunk_id("a.pdf", 2, _hash_text(PAGE_2), 0)
+    plan = _IngestPlan("a.pdf", {2: ("old page hash", [chunk_id])})
+    assert not plan.page_unchanged(2, "new page hash")
+    chunks, ids = plan.add_chunks([_chunk(PAGE_2, 2), _chunk(PAGE_3, 2)])
+    assert [chunk.page_content for chunk in chunks] == [PAGE_3]
+    assert plan.moved_ids == [chunk_id]
+    assert plan.stale_ids() == []
+
+
+def test_reingest_embeds_only_changed_pages(make_bot):
+    make_bot.pages[b"v1"] = [PAGE_1, PAGE_2, PAGE_3]
+    make_bot.pages[b"v2"] = [PAGE_1, PAGE_3, PAGE_3]
+    bot = make_bot(highlights=False, dedup=False)
+    bot.process_pdf(b"v1", source="a.pdf")
+    before = set(bot.vector_store.get(include=[])["ids"])
+    assert len(before) == 3
+
+    calls = bot.embeddings.calls
+    bot.process_pdf(b"v2", source="a.pdf")
+    assert bot.embeddings.calls - calls == 1
+    after = set(bot.vector_store.get(include=[])["ids"])
+    assert len(after) == 3
+    # Страницы 1 и 3 не изменились: их чанки остались с прежними id
+    assert len(before & after) == 2
+    assert not bot.vector_store.get(ids=list(before - after))["ids"]
+    assert bot.lexical_index.search("градиентный спуск", 3) == []
+    assert bot.stats.sources["a.pdf"].chunks == 3
+
+    calls = bot.embeddings.calls
+    bot.process_pdf(b"v2", source="a.pdf")
+    assert bot.embeddings.calls == calls
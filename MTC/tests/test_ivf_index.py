@@ -0,0 +1,66 @@
+import numpy as np
+
+from ivf_index import IVFIndex
+from vector_backends import NumpyBackend
+
+
+def _clustered(rows: int, dim: int = 16, clusters: int = 20, seed: int = 0):
+    """Векторы вокруг clusters центров (как эмбеддинги тематически близких чанков)"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    vectors = centers[rng.integers(0, clusters, rows)] + 0.3 * rng.normal(size=(rows, dim))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def _ivf_store(directory: str, vectors) -> NumpyBackend:
+    store = NumpyBackend(directory, index="ivf", nlist=16, ivf_min_rows=100)
+    ids = [f"doc.pdf:{row}" for row in range(len(vectors))]
+    store.upsert(ids=ids, embeddings=vectors.tolist(),
+                 metadatas=[{"source": "doc.pdf", "page": row} for row in range(len(vectors))],
+                 documents=[f"чанк {row}" for row in range(len(vectors))])
+    store.persist()
+    return store
+
+
+def test_train_assigns_every_row_once():
+    vectors = _clustered(500)
+    ivf = IVFIndex()
+    ivf.train(vectors, nlist=8)
+    assert ivf.is_trained and ivf.nlist == 8
+    assert sorted(row for rows in ivf.lists for row in rows) == list(range(500))
+    # Все кластеры — кандидаты: просматривается вся коллекция
+    assert ivf.probe(vectors[0], 8).tolist() == list(range(500))
+
+
+def test_recall_grows_with_nprobe(tmp_path):
+    store = _ivf_store(str(tmp_path / "db"), _clustered(2000))
+    try:
+        assert store.ivf.is_trained
+        report = store.ann_report([1, 4, 16], sample=50, k=10)
+        recalls = [entry["recall"] for entry in report]
+        assert recalls == sorted(recalls)
+        assert recalls[1] >= 0.8
+        assert recalls[2] == 1.0
+    finally:
+        store.close()
+
+
+def test_rows_added_after_training_are_searchable(tmp_path):
+    directory = str(tmp_path / "db")
+    vectors = _clustered(600)
+    store = _ivf_store(directory, vectors[:500])
+    try:
+        store.upsert(ids=[f"new.pdf:{row}" for row in range(100)], embeddings=vectors[500:].tolist(),
+                     metadatas=[{"source": "new.pdf", "page": row} for row in range(100)],
+                     documents=[f"новый {row}" for row in range(100)])
+        assert store.ivf.indexed_rows == 600
+        assert store.query(vectors[550:551].tolist(), 1, nprobe=4)["ids"] == [["new.pdf:50"]]
+        store.persist()
+    finally:
+        store.close()
+    reopened = NumpyBackend(directory)
+    try:
+        assert reopened.index == "ivf" and reopened.ivf.indexed_rows == 600
+        assert reopened.query(vectors[550:551].tolist(), 1, nprobe=4)["ids"] == [["new.pdf:50"]]
+    finally:
+        reopened.close()
@@ -0,0 +1,73 @@
+import threading
+
+import pytest
+
+from jobs import CANCELLED, DONE, FAILED, RUNNING, JobRunner
+from rag_chatbot import IngestProgress
+
+
+class _Bot:
+    """Заглушка бота: обработка документа ждет разрешения (или отмены)"""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.processed = []
+
+    def process_pdf(self, pdf, progress_callback=None, cancel_event=None, source=None):
+        self.started.set()
+        progress_callback(IngestProgress(source=source, pages_total=4, pages_done=1))
+        while not self.release.wait(0.01):
+            if cancel_event.is_set():
+                return False
+        if pdf == b"broken":
+            raise ValueError("битый PDF")
+        self.processed.append(source)
+        return True
+
+
+@pytest.fixture
+def runner():
+    runner = JobRunner(_Bot())
+    yield runner
+    runner.bot.release.set()
+    runner.shutdown()
+
+
+def _wait(runner, job_id):
+    runner._pool.submit(lambda: None).result(5)
+    return runner.get(job_id)
+
+
+def test_job_reports_progress_and_finishes(runner):
+    job_id = runner.submit_pdf(b"first", source="a.pdf")
+    assert runner.bot.started.wait(5)
+    job = runner.get(job_id)
+    assert job.status == RUNNING
+    assert job.progress.pages_done == 1 and job.fraction == 0.25
+    # Тот же файл, пока он в работе, не ставится в очередь второй раз
+    assert runner.submit_pdf(b"first", source="a.pdf") == job_id
+    runner.bot.release.set()
+    job = _wait(runner, job_id)
+    assert job.status == DONE and job.fraction == 1.0
+    assert runner.bot.processed == ["a.pdf"]
+
+
+def test_cancel_running_and_queued_jobs(runner):
+    running = runner.submit_pdf(b"first", source="a.pdf")
+    queued = runner.submit_pdf(b"second", source="b.pdf")
+    assert runner.bot.started.wait(5)
+    assert [job.id for job in runner.active()] == [queued, running]
+
+    assert runner.cancel(queued)
+    assert runner.get(queued).status == CANCELLED
+    assert runner.cancel(running)
+    assert _wait(runner, running).status == CANCELLED
+    assert not runner.cancel(running)
+    assert runner.bot.processed == [] and runner.active() == []
+
+
+def test_failure_is_recorded(runner):
+    runner.bot.release.set()
+    job = _wait(runner, runner.submit_pdf(b"broken", source="c.pdf"))
+    assert job.status == FAILED and job.error == "битый PDF"
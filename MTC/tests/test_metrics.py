@@ -0,0 +1,44 @@
+from metrics import MetricsRegistry
+
+
+def test_snapshot_quantiles_and_buckets():
+    metrics = MetricsRegistry()
+    for elapsed_ms in range(1, 101):
+        metrics.observe("search.vector", elapsed_ms)
+    metrics.count("search.requests", 3)
+    with metrics.timer("search.fuse"):
+        pass
+
+    snapshot = metrics.snapshot()
+    vector = snapshot["timers"]["search.vector"]
+    assert vector["count"] == 100 and vector["mean_ms"] == 50.5
+    assert (vector["p50_ms"], vector["p95_ms"], vector["p99_ms"]) == (51, 96, 100)
+    # В JSON корзины не накопительные: (5, 10] — пять значений
+    assert vector["buckets"]["le_10"] == 5 and vector["buckets"]["le_100"] == 50
+    assert snapshot["timers"]["search.fuse"]["count"] == 1
+    assert snapshot["counters"] == {"search.requests": 3}
+
+
+def test_prometheus_export():
+    metrics = MetricsRegistry()
+    metrics.observe("ingest.embed", 3)
+    metrics.observe("ingest.embed", 40)
+    metrics.count("ingest.chunks_embedded", 12)
+    lines = metrics.to_prometheus(prefix="rag", labels={"node": "a"}).splitlines()
+    assert "# TYPE rag_stage_seconds histogram" in lines
+    # Корзины накопительные, границы — в секундах
+    assert 'rag_stage_seconds_bucket{stage="ingest.embed",node="a",le="0.002"} 0' in lines
+    assert 'rag_stage_seconds_bucket{stage="ingest.embed",node="a",le="0.005"} 1' in lines
+    assert 'rag_stage_seconds_bucket{stage="ingest.embed",node="a",le="0.05"} 2' in lines
+    assert 'rag_stage_seconds_bucket{stage="ingest.embed",node="a",le="+Inf"} 2' in lines
+    assert 'rag_stage_seconds_sum{stage="ingest.embed",node="a"} 0.043000' in lines
+    assert 'rag_ingest_chunks_embedded_total{node="a"} 12' in lines
+    assert MetricsRegistry().to_prometheus() == ""
+
+
+def test_disabled_registry_records_nothing():
+    metrics = MetricsRegistry(enabled=False)
+    with metrics.timer("search.total"):
+        metrics.count("search.requests")
+    assert list(metrics.timed_iter("ingest.parse", [1, 2])) == [1, 2]
+    assert metrics.snapshot()["timers"] == {} and metrics.snapshot()["counters"] == {}
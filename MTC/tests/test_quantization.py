@@ -0,0 +1,71 @@
+import os
+
+import numpy as np
+import pytest
+
+from conftest import make_vectors
+from vector_backends import NumpyBackend, quantize_vectors
+
+
+def test_quantize_vectors_error_is_bounded():
+    vectors = make_vectors(50)
+    half, no_scales = quantize_vectors(vectors, "float16")
+    assert half.dtype == np.float16 and no_scales is None
+    assert np.abs(half.astype(np.float32) - vectors).max() < 1e-2
+
+    quantized, scales = quantize_vectors(vectors, "int8")
+    assert quantized.dtype == np.int8 and scales.shape == (50,)
+    restored = quantized.astype(np.float32) * scales[:, None]
+    # Ошибка округления — не больше половины шага квантизации
+    assert np.all(np.abs(restored - vectors) <= scales[:, None] / 2 + 1e-6)
+
+
+def _fill(store, rows: int = 300):
+    vectors = make_vectors(rows, dim=32)
+    ids = [f"doc.pdf:{row}" for row in range(rows)]
+    store.upsert(ids=ids, embeddings=vectors.tolist(),
+                 metadatas=[{"source": "doc.pdf", "page": row % 10} for row in range(rows)],
+                 documents=[f"чанк {row}" for row in range(rows)])
+    store.persist()
+
+
+@pytest.mark.parametrize("mode", ["float16", "int8"])
+def test_quantized_search_matches_exact_top_k(tmp_path, mode):
+    exact = NumpyBackend(str(tmp_path / "exact"))
+    quantized = NumpyBackend(str(tmp_path / mode), quantization=mode)
+    try:
+        _fill(exact)
+        _fill(quantized)
+        queries = make_vectors(5, dim=32, seed=7).tolist()
+        expected = exact.query(queries, 10)
+        found = quantized.query(queries, 10, where={"page": {"$lte": 9}})
+        assert found["ids"] == expected["ids"]
+        # Кандидаты пересчитываются по полным векторам: оценки совпадают с точными
+        for found_scores, expected_scores in zip(found["scores"], expected["scores"]):
+            assert found_scores == pytest.approx(expected_scores, abs=1e-5)
+        itemsize = 2 if mode == "float16" else 1
+        assert os.path.getsize(quantized.quant_path) == 300 * 32 * itemsize
+    finally:
+        exact.close()
+        quantized.close()
+
+
+def test_quantization_can_be_changed_on_reopen(tmp_path):
+    directory = str(tmp_path / "db")
+    store = NumpyBackend(directory)
+    _fill(store)
+    store.close()
+
+    store = NumpyBackend(directory, quantization="int8")
+    try:
+        assert store.quantization == "int8"
+        assert os.path.getsize(store.scales_path) == 300 * 4
+    finally:
+        store.close()
+    store = NumpyBackend(directory)
+    try:
+        # Без явного режима используется сохраненный
+        assert store.quantization == "int8"
+        assert store.count() == 300
+    finally:
+        store.close()
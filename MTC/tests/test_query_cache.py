@@ -0,0 +1,42 @@
+import query_cache
+from query_cache import LRUCache
+
+
+def test_lru_eviction_and_hit_rate():
+    cache = LRUCache(max_size=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert len(cache) == 2
+    assert cache.hit_rate == 3 / 4
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(query_cache.time, "monotonic", lambda: now[0])
+    cache = LRUCache(ttl=10)
+    cache.put("a", 1)
+    now[0] += 5
+    assert cache.get("a") == 1
+    now[0] += 10
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_search_results_cached_until_index_changes(make_bot):
+    make_bot.pages[b"a"] = ["Градиентный спуск минимизирует функцию потерь."]
+    make_bot.pages[b"b"] = ["Градиентный бустинг строит ансамбль деревьев."]
+    bot = make_bot()
+    bot.process_pdf(b"a", source="a.pdf")
+    first = bot.search("градиентный спуск", k=2, mode="lexical")
+    hits = bot.search_cache.hits
+    assert bot.search("градиентный спуск", k=2, mode="lexical") == first
+    assert bot.search_cache.hits == hits + 1
+
+    # Новый документ меняет версию индекса: закешированный ответ не используется
+    bot.process_pdf(b"b", source="b.pdf")
+    assert len(bot.search("градиентный спуск", k=2, mode="lexical")) == 2
+    assert bot.search_cache.hits == hits + 1
@@ -0,0 +1,57 @@
+import time
+from dataclasses import dataclass
+
+from reranker import CrossEncoderReranker, RerankReport
+
+
+@dataclass
+class _Chunk:
+    text: str
+    relevance_score: float = 0.5
+
+
+class _TimedReranker(CrossEncoderReranker):
+    """Модель не загружается: время пакета задается тестом"""
+
+    def __init__(self, batch_seconds):
+        super().__init__(batch_size=2)
+        self.batch_seconds = list(batch_seconds)
+        self.calls = 0
+
+    def score(self, query, texts):
+        time.sleep(self.batch_seconds[min(self.calls, len(self.batch_seconds) - 1)])
+        self.calls += 1
+        return [0.9 - 0.1 * i for i in range(len(texts))]
+
+
+def _rerank(reranker, budget_s, candidates=6):
+    report = RerankReport()
+    chunks = reranker.rerank("q", [_Chunk(f"t{i}") for i in range(candidates)], 3,
+                             time.perf_counter() + budget_s, report=report)
+    return chunks, report
+
+
+def test_exhausted_budget_skips_all_batches():
+    reranker = _TimedReranker([0.0])
+    report = RerankReport()
+    chunks = reranker.rerank("q", [_Chunk("a"), _Chunk("b")], 2, time.perf_counter() - 0.001, report=report)
+    assert report.scored == 0 and report.exhausted
+    assert reranker.calls == 0
+    assert [chunk.text for chunk in chunks] == ["a", "b"]
+
+
+def test_slow_batch_does_not_disable_later_queries():
+    # Первый пакет (холодный запуск) дольше бюджета, дальше модель быстрая
+    reranker = _TimedReranker([0.2, 0.0])
+    _, report = _rerank(reranker, 0.05)
+    assert report.scored == 2 and report.exhausted
+    for _ in range(3):
+        _, report = _rerank(reranker, 0.5)
+        assert report.scored == 6 and not report.exhausted
+
+
+def test_unscored_candidates_rank_below_scored():
+    reranker = _TimedReranker([0.03])
+    chunks, report = _rerank(reranker, 0.04)
+    assert report.batches == 1 and report.exhausted
+    assert chunks[0].relevance_score >= chunks[1].relevance_score > chunks[2].relevance_score
@@ -0,0 +1,58 @@
+import pytest
+
+from index_stats import IndexStats
+from search_filters import SearchFilter, parse_page_ranges
+from vector_backends import matches_where, where_sources
+
+
+def test_matches_where_operators():
+    metadata = {"source": "a.pdf", "page": 5}
+    assert matches_where(metadata, None)
+    assert matches_where(metadata, {"source": "a.pdf"})
+    assert not matches_where(metadata, {"source": "b.pdf"})
+    assert matches_where(metadata, {"page": {"$gte": 5, "$lte": 6}})
+    assert not matches_where(metadata, {"page": {"$gt": 5}})
+    assert matches_where(metadata, {"source": {"$in": ["a.pdf", "b.pdf"]}})
+    assert not matches_where(metadata, {"source": {"$nin": ["a.pdf"]}})
+    assert matches_where(metadata, {"$or": [{"page": 1}, {"page": 5}]})
+    assert not matches_where(metadata, {"$and": [{"source": "a.pdf"}, {"page": {"$ne": 5}}]})
+
+
+def test_parse_page_ranges():
+    assert parse_page_ranges("1-5, 8, 12-10") == ((1, 5), (8, 8), (10, 12))
+    with pytest.raises(ValueError):
+        parse_page_ranges("1-x")
+
+
+def test_empty_filter_is_none():
+    assert SearchFilter.create() is None
+    assert SearchFilter.create(pages="") is None
+
+
+def test_filter_to_where_matches_metadata():
+    search_filter = SearchFilter.create(sources=["b.pdf", "a.pdf"], pages="2-3, 7")
+    where = search_filter.to_where()
+    assert where_sources(where) == {"a.pdf", "b.pdf"}
+    assert matches_where({"source": "a.pdf", "page": 3}, where)
+    assert matches_where({"source": "b.pdf", "page": 7}, where)
+    assert not matches_where({"source": "a.pdf", "page": 5}, where)
+    assert not matches_where({"source": "c.pdf", "page": 2}, where)
+
+
+def test_ingestion_date_resolves_to_sources():
+    stats = IndexStats()
+    stats.update_source("old.pdf", 1, 1)
+    stats.update_source("new.pdf", 1, 1)
+    stats.sources["old.pdf"].ingested_at = 100.0
+    stats.sources["new.pdf"].ingested_at = 200.0
+    assert SearchFilter.create(ingested_after=150).resolve_sources(stats) == ("new.pdf",)
+    where = SearchFilter.create(ingested_after=300).to_where(stats)
+    assert where == {"source": {"$in": []}}
+    assert not matches_where({"source": "new.pdf"}, where)
+
+
+def test_store_filters_before_scoring(numpy_store):
+    where = SearchFilter.create(sources=["b.pdf"], pages="1-3").to_where()
+    assert sorted(numpy_store.get(where=where, include=[])["ids"]) == ["b.pdf:1", "b.pdf:2", "b.pdf:3"]
+    results = numpy_store.query([[1.0] * 16], n_results=10, where=where)
+    assert sorted(results["ids"][0]) == ["b.pdf:1", "b.pdf:2", "b.pdf:3"]
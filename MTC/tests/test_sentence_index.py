@@ -0,0 +1,66 @@
+import sentence_index
+from conftest import FakeEmbeddings
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+from sentence_index import SentenceIndex, highlight_html, snippet
+
+TEXT = "Нейросети состоят из слоев. Градиентный спуск минимизирует потери. Регуляризация снижает переобучение."
+SPANS = [(0, 27), (28, 66), (67, 103)]
+VECTORS = [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.0, 0.0, 1.0]]
+
+
+def test_best_sentences_ranked_by_similarity(tmp_path):
+    index = SentenceIndex(str(tmp_path / "sentences"))
+    index.add(["a", "b"], [SPANS, []], [VECTORS, []])
+    assert "a" in index and "b" not in index
+    assert index.best_sentences(["a", "missing"], [0.1, 0.9, 0.5], top=2) == [[SPANS[1], SPANS[2]], []]
+    assert TEXT[slice(*SPANS[1])] == "Градиентный спуск минимизирует потери."
+
+
+def test_save_load_and_remove(tmp_path):
+    path = str(tmp_path / "sentences")
+    index = SentenceIndex(path)
+    index.add(["a", "b"], [SPANS, SPANS[:2]], [VECTORS, VECTORS[:2]])
+    index.save()
+    index.remove(["a"])
+    index.save()
+    # Записано после save: при загрузке отбрасывается
+    index.add(["c"], [SPANS], [VECTORS])
+
+    loaded = SentenceIndex.load(path)
+    assert len(loaded) == 1 and "b" in loaded
+    assert loaded.best_sentences(["b"], [1.0, 0.0, 0.0], top=1) == [[SPANS[0]]]
+
+
+def test_compaction_keeps_live_rows(tmp_path, monkeypatch):
+    monkeypatch.setattr(sentence_index, "COMPACT_MIN_DEAD", 2)
+    path = str(tmp_path / "sentences")
+    index = SentenceIndex(path)
+    index.add(["a", "b", "c"], [SPANS, SPANS, SPANS], [VECTORS, VECTORS[::-1], VECTORS])
+    index.remove(["a", "c"])
+    index.save()
+    assert index.generation == 1 and index.rows == 3 and index.dead == 0
+    loaded = SentenceIndex.load(path)
+    assert loaded.best_sentences(["b"], [1.0, 0.0, 0.0], top=1) == [[SPANS[2]]]
+
+
+def test_snippet_and_html_use_best_sentences():
+    assert snippet(TEXT, [SPANS[1]], 300) == "...Градиентный спуск минимизирует потери...."
+    assert "<mark>Градиентный спуск минимизирует потери.</mark>" in highlight_html(TEXT, [SPANS[1]])
+
+
+def test_sentence_vectors_come_from_embedding_cache(make_bot, tmp_path):
+    make_bot.pages[b"a"] = [TEXT]
+    model = FakeEmbeddings()
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"))
+    bot = make_bot()
+    bot._embeddings = CachedEmbeddings(model, cache, "fake")
+    bot.process_pdf(b"a", source="a.pdf")
+    # Чанк и три его предложения
+    assert model.calls == 4
+
+    bot.clear_database()
+    bot._embeddings = CachedEmbeddings(model, cache, "fake")
+    bot.process_pdf(b"a", source="a.pdf")
+    assert model.calls == 4
+    chunks = bot.search("градиентный спуск", k=1)
+    assert bot.highlight("градиентный спуск", chunks, top=1) == [[SPANS[1]]]
@@ -0,0 +1,60 @@
+import pytest
+
+from sharded import ShardedBackend, assign_shards, read_manifest, write_shards
+
+
+def test_assign_shards_by_source_keeps_documents_together():
+    ids = [f"{source}:{i}" for source, size in (("a", 5), ("b", 3), ("c", 2)) for i in range(size)]
+    metadatas = [{"source": chunk_id.split(":")[0]} for chunk_id in ids]
+    assigned = assign_shards(ids, metadatas, 2, by="source")
+    assert sorted(chunk_id for shard in assigned for chunk_id in shard) == sorted(ids)
+    assert sorted(len(shard) for shard in assigned) == [5, 5]
+    shard_of = {}
+    for shard, shard_ids in enumerate(assigned):
+        for chunk_id in shard_ids:
+            assert shard_of.setdefault(chunk_id.split(":")[0], shard) == shard
+    with pytest.raises(ValueError):
+        assign_shards(ids, metadatas, 2, by="page")
+
+
+@pytest.mark.parametrize("by", ["source", "hash"])
+def test_merged_top_k_matches_single_store(tmp_path, numpy_store, by):
+    directory = str(tmp_path / "shards")
+    summary = write_shards(directory, numpy_store, 3, by=by)
+    assert sum(summary["shards"]) == 30
+    assert len(read_manifest(directory)["shards"]) == 3
+
+    sharded = ShardedBackend(directory, workers=2)
+    try:
+        assert sharded.count() == 30
+        queries = [[1.0] * 16, [-1.0, 1.0] * 8]
+        for where in (None, {"source": "b.pdf"}, {"page": {"$lte": 4}}):
+            expected = numpy_store.query(queries, n_results=7, where=where)
+            found = sharded.query(queries, n_results=7, where=where)
+            assert found["ids"] == expected["ids"]
+            for found_scores, expected_scores in zip(found["scores"], expected["scores"]):
+                assert found_scores == pytest.approx(expected_scores, abs=1e-5)
+            for scores in found["scores"]:
+                assert scores == sorted(scores, reverse=True)
+        records = sharded.get(where={"source": "c.pdf"}, include=["metadatas"])
+        assert len(records["ids"]) == 10 and records["documents"] is None
+    finally:
+        sharded.close()
+
+
+def test_lexical_index_is_stored_without_pickle(tmp_path, numpy_store):
+    from bm25_index import BM25Index
+    lexical_index = BM25Index()
+    records = numpy_store.get(include=["documents"])
+    lexical_index.add(records["ids"], records["documents"])
+    directory = str(tmp_path / "shards")
+    write_shards(directory, numpy_store, 2, lexical_index=lexical_index)
+    assert not (tmp_path / "shards" / "bm25_index.pkl").exists()
+
+    sharded = ShardedBackend(directory, workers=1)
+    try:
+        restored = sharded.lexical_index()
+    finally:
+        sharded.close()
+    assert len(restored) == 30
+    assert restored.search("чанка c.pdf:2", 3) == lexical_index.search("чанка c.pdf:2", 3)
@@ -0,0 +1,112 @@
+import pytest
+
+from bm25_index import BM25Index
+from index_stats import IndexStats
+from snapshot import SnapshotBackend, import_snapshot, read_header, write_snapshot
+
+
+@pytest.fixture
+def lexical_index(numpy_store):
+    index = BM25Index()
+    records = numpy_store.get(include=["documents"])
+    index.add(records["ids"], records["documents"])
+    index.remove(["b.pdf:3"])
+    index.add(["b.pdf:3"], ["другой текст чанка b.pdf:3"])
+    return index
+
+
+@pytest.fixture
+def snapshot_path(tmp_path, numpy_store, lexical_index):
+    stats = IndexStats()
+    stats.update_source("a.pdf", 10, 10)
+    path = str(tmp_path / "index.ragsnap")
+    summary = write_snapshot(path, numpy_store, lexical_index=lexical_index, stats=stats, model="test-model")
+    assert summary["rows"] == 30
+    return path
+
+
+def test_round_trip_matches_store(snapshot_path, numpy_store):
+    assert read_header(snapshot_path)["model"] == "test-model"
+    snapshot = SnapshotBackend(snapshot_path)
+    try:
+        assert snapshot.count() == numpy_store.count()
+        original = numpy_store.get(include=["documents", "metadatas"])
+        restored = snapshot.get(ids=original["ids"], include=["documents", "metadatas"])
+        assert dict(zip(restored["ids"], zip(restored["documents"], restored["metadatas"]))) == \
+            dict(zip(original["ids"], zip(original["documents"], original["metadatas"])))
+
+        queries = [[1.0] * 16, [-1.0, 1.0] * 8]
+        where = {"source": {"$in": ["a.pdf", "c.pdf"]}}
+        for condition in (None, where):
+            expected = numpy_store.query(queries, n_results=5, where=condition)
+            found = snapshot.query(queries, n_results=5, where=condition)
+            assert found["ids"] == expected["ids"]
+            for found_scores, expected_scores in zip(found["scores"], expected["scores"]):
+                assert found_scores == pytest.approx(expected_scores, abs=1e-5)
+        assert snapshot.stats.sources["a.pdf"].chunks == 10
+    finally:
+        snapshot.close()
+
+
+def test_lexical_index_round_trip_without_pickle(snapshot_path, lexical_index):
+    with open(snapshot_path, "rb") as f:
+        assert b"\x80\x04\x95" not in f.read()
+    snapshot = SnapshotBackend(snapshot_path)
+    try:
+        restored = snapshot.lexical_index()
+    finally:
+        snapshot.close()
+    assert len(restored) == 30
+    for query in ("текст чанка a.pdf:7", "другой текст"):
+        assert restored.search(query, 5) == lexical_index.search(query, 5)
+    # Вспомогательные списки термов восстановлены: удаление после загрузки работает
+    restored.remove(["b.pdf:3"])
+    assert "другой" not in restored
+    assert len(restored) == 29
+
+
+def test_ivf_round_trip(tmp_path):
+    from conftest import make_vectors
+    from vector_backends import NumpyBackend
+    store = NumpyBackend(str(tmp_path / "ivf_db"), index="ivf", nlist=4, ivf_min_rows=10)
+    vectors = make_vectors(200)
+    ids = [f"doc.pdf:{row}" for row in range(200)]
+    store.upsert(ids=ids, embeddings=vectors.tolist(),
+                 metadatas=[{"source": "doc.pdf", "page": row} for row in range(200)],
+                 documents=[f"чанк {row}" for row in range(200)])
+    store.persist()
+    path = str(tmp_path / "ivf.ragsnap")
+    try:
+        write_snapshot(path, store)
+        snapshot = SnapshotBackend(path)
+        try:
+            assert snapshot.ivf.is_trained
+            assert sorted(row for rows in snapshot.ivf.lists for row in rows) == list(range(200))
+            queries = vectors[:3].tolist()
+            assert snapshot.query(queries, 5, nprobe=4)["ids"] == store.query(queries, 5, nprobe=4)["ids"]
+        finally:
+            snapshot.close()
+    finally:
+        store.close()
+
+
+def test_snapshot_is_read_only(snapshot_path):
+    snapshot = SnapshotBackend(snapshot_path)
+    try:
+        with pytest.raises(RuntimeError):
+            snapshot.delete(ids=["a.pdf:1"])
+    finally:
+        snapshot.close()
+
+
+def test_import_into_new_database(tmp_path, snapshot_path, numpy_store):
+    from vector_backends import NumpyBackend
+    directory = str(tmp_path / "imported")
+    import_snapshot(snapshot_path, directory)
+    store = NumpyBackend(directory)
+    try:
+        assert sorted(store.get(include=[])["ids"]) == sorted(numpy_store.get(include=[])["ids"])
+        assert store.query([[1.0] * 16], 3)["ids"] == numpy_store.query([[1.0] * 16], 3)["ids"]
+        assert len(BM25Index.load(f"{directory}/bm25_index.pkl")) == 30
+    finally:
+        store.close()
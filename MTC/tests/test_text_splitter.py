@@ -0,0 +1,57 @@
+import pytest
+
+from text_splitter import TokenBudgetSplitter, sentence_spans
+
+
+class _Document:
+    def __init__(self, page_content, metadata):
+        self.page_content = page_content
+        self.metadata = metadata
+
+
+TEXT = ("Нейросети состоят из слоев нейронов. Каждый слой преобразует входные данные.\n\n"
+        "Gradient descent minimizes the loss function. Regularization reduces overfitting. ") * 20
+
+
+def test_chunks_fit_budget_and_cover_text():
+    splitter = TokenBudgetSplitter(max_tokens=64, overlap_tokens=8)
+    spans = splitter.split_spans(TEXT)
+    assert len(spans) > 1
+    assert all(tokens <= 64 for _, _, tokens in spans)
+    assert spans[0][0] == 0
+    assert spans[-1][1] == len(TEXT.rstrip())
+    # Соседние чанки перекрываются или идут подряд: текст покрыт без пропусков
+    for (_, end, _), (start, _, _) in zip(spans, spans[1:]):
+        assert start <= end
+
+
+def test_cuts_prefer_sentence_boundaries():
+    splitter = TokenBudgetSplitter(max_tokens=64, overlap_tokens=0)
+    for chunk in splitter.split_text(TEXT)[:-1]:
+        assert chunk.rstrip().endswith(".")
+
+
+def test_split_documents_keeps_metadata_and_offsets():
+    splitter = TokenBudgetSplitter(max_tokens=32, overlap_tokens=4)
+    chunks = splitter.split_documents([_Document(TEXT, {"source": "a.pdf", "page": 3})])
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert chunk.metadata["source"] == "a.pdf" and chunk.metadata["page"] == 3
+        assert TEXT[chunk.metadata["start_index"]:chunk.metadata["end_index"]] == chunk.page_content
+        assert chunk.metadata["token_count"] <= 32
+
+
+def test_invalid_budget():
+    with pytest.raises(ValueError):
+        TokenBudgetSplitter(max_tokens=0)
+    with pytest.raises(ValueError):
+        TokenBudgetSplitter(max_tokens=10, overlap_tokens=10)
+    assert TokenBudgetSplitter().split_text("") == []
+
+
+def test_sentence_spans():
+    text = "Первое предложение достаточно длинное. Второе предложение тоже длинное! Коротко."
+    spans = sentence_spans(text)
+    assert len(spans) >= 2
+    assert text[spans[0][0]:spans[0][1]].startswith("Первое")
+    assert all(text[start:end].strip() == text[start:end] for start, end in spans)
@@ -0,0 +1,79 @@
+import json
+import os
+
+from conftest import make_vectors
+from vector_backends import NumpyBackend, detect_backend
+
+
+def _store_state(store):
+    records = store.get(include=["documents", "metadatas"])
+    return sorted(zip(records["ids"], records["documents"], [json.dumps(m, sort_keys=True)
+                                                             for m in records["metadatas"]]))
+
+
+def test_reopen_restores_rows_and_search(tmp_path, numpy_store):
+    directory = str(tmp_path / "db")
+    assert detect_backend(directory) == "numpy"
+    reopened = NumpyBackend(directory)
+    try:
+        assert reopened.count() == 30
+        assert _store_state(reopened) == _store_state(numpy_store)
+        queries = make_vectors(2, seed=1).tolist()
+        assert reopened.query(queries, 5)["ids"] == numpy_store.query(queries, 5)["ids"]
+    finally:
+        reopened.close()
+
+
+def test_persist_appends_changes_to_journal(tmp_path, numpy_store):
+    directory = str(tmp_path / "db")
+    with open(os.path.join(directory, "numpy_store.json"), encoding="utf-8") as f:
+        header = json.load(f)
+    log_path = os.path.join(directory, header["log"])
+    with open(log_path, "rb") as f:
+        journal = f.read()
+
+    numpy_store.update(ids=["a.pdf:1"], metadatas=[{"source": "a.pdf", "page": 11}])
+    numpy_store.delete(ids=["b.pdf:2"])
+    numpy_store.upsert(ids=["c.pdf:3"], embeddings=make_vectors(1, seed=2).tolist(),
+                       metadatas=[{"source": "c.pdf", "page": 3}], documents=["новый текст"])
+    numpy_store.persist()
+    # Журнал дописан, а не переписан: прежние записи на месте
+    with open(log_path, "rb") as f:
+        assert f.read().startswith(journal)
+
+    reopened = NumpyBackend(directory)
+    try:
+        assert reopened.count() == 29
+        assert reopened.get(ids=["a.pdf:1"])["metadatas"] == [{"source": "a.pdf", "page": 11}]
+        assert reopened.get(ids=["b.pdf:2"])["ids"] == []
+        assert reopened.get(ids=["c.pdf:3"])["documents"] == ["новый текст"]
+        assert _store_state(reopened) == _store_state(numpy_store)
+    finally:
+        reopened.close()
+
+
+def test_unpersisted_tail_is_dropped_on_reopen(tmp_path, numpy_store):
+    directory = str(tmp_path / "db")
+    numpy_store.upsert(ids=["d.pdf:1"], embeddings=make_vectors(1, seed=3).tolist(),
+                       metadatas=[{"source": "d.pdf", "page": 1}], documents=["не сохранен"])
+    reopened = NumpyBackend(directory)
+    try:
+        assert reopened.count() == 30
+        assert reopened.get(ids=["d.pdf:1"])["ids"] == []
+        assert reopened.query(make_vectors(1, seed=3).tolist(), 1)["ids"][0] != ["d.pdf:1"]
+    finally:
+        reopened.close()
+
+
+def test_compaction_after_many_deletes(tmp_path, numpy_store):
+    directory = str(tmp_path / "db")
+    deleted = [f"{source}:{page}" for source in ("a.pdf", "b.pdf") for page in range(1, 11)]
+    numpy_store.delete(ids=deleted)
+    numpy_store.persist()
+    assert len(numpy_store.ids) == 10
+    reopened = NumpyBackend(directory)
+    try:
+        assert sorted(reopened.get(include=[])["ids"]) == sorted(f"c.pdf:{page}" for page in range(1, 11))
+        assert reopened.get(where={"source": "a.pdf"}, include=[])["ids"] == []
+    finally:
+        reopened.close()
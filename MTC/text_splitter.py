@@ -0,0 +1,204 @@
+"""
+Разбиение текста на чанки по бюджету токенов модели эмбеддингов
+Длина чанка считается в токенах того же токенизатора, которым пользуется модель,
+поэтому чанки почти не обрезаются на входе модели и при этом заполняют ее окно.
+
+Разрез ставится на лучшей границе внутри допустимого окна: абзац, конец предложения,
+перевод строки, часть предложения, пробел (русский и английский текст).
+Страница токенизируется один раз, границы ищутся одним проходом регулярных выражений,
+а выбор разрезов идет двумя указателями — время работы линейно по длине страницы.
+Те же правила дают границы предложений внутри чанка (sentence_spans) для подсветки ответа.
+
+В метаданные каждого чанка записываются смещения в тексте страницы:
+start_index и end_index (page_content[start_index:end_index] == текст чанка) и число токенов.
+"""
+
+import re
+import threading
+from typing import Dict, List, Tuple
+
+# all-MiniLM-L6-v2 обрезает вход на 256 токенах, два из них занимают [CLS] и [SEP]
+DEFAULT_MAX_TOKENS = 240
+DEFAULT_OVERLAP_TOKENS = 24
+
+# Приоритеты разреза перед токеном: чем больше, тем лучше
+_INSIDE_WORD, _SPACE, _CLAUSE, _LINE, _SENTENCE, _PARAGRAPH = range(6)
+
+# Точка считается концом предложения, только если дальше заглавная буква или цифра
+_SENTENCE_END = re.compile(r"(?:[!?…]+|\.(?=[\"'»”)\]]*\s+[A-ZА-ЯЁ0-9«\"(]))[\"'»”)\]]*\s+")
+_PARAGRAPH_END = re.compile(r"\n[ \t]*\n\s*")
+
+_BOUNDARY_PATTERNS = (
+    (_CLAUSE, re.compile(r"[,;:]\s+|\s+[—–-]\s+")),
+    (_LINE, re.compile(r"\n\s*")),
+    (_SENTENCE, _SENTENCE_END),
+    (_PARAGRAPH, _PARAGRAPH_END),
+)
+
+# Оценка числа токенов без токенизатора: слова и отдельные знаки
+_WORD_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+_tokenizers: Dict[str, object] = {}
+_tokenizers_lock = threading.Lock()
+
+
+def load_tokenizer(model_name: str):
+    """Быстрый токенизатор модели (один на процесс) или None, если transformers недоступен"""
+    with _tokenizers_lock:
+        if model_name not in _tokenizers:
+            tokenizer = None
+            try:
+                from transformers import AutoTokenizer
+                tokenizer = AutoTokenizer.from_pretrained(model_name)
+                if not getattr(tokenizer, "is_fast", False):
+                    tokenizer = None
+            except Exception as e:
+                print(f"⚠️ Токенизатор {model_name} недоступен ({e}), длина чанков оценивается приблизительно")
+            _tokenizers[model_name] = tokenizer
+        return _tokenizers[model_name]
+
+
+def sentence_spans(text: str, min_chars: int = 20) -> List[Tuple[int, int]]:
+    """
+    Границы предложений текста (без пробелов по краям) по тем же правилам, что и разрезы чанков.
+    Фрагмент короче min_chars (номер пункта, подпись) присоединяется к предыдущему предложению
+    """
+    cuts = sorted({match.end() for pattern in (_SENTENCE_END, _PARAGRAPH_END)
+                   for match in pattern.finditer(text)})
+    spans: List[Tuple[int, int]] = []
+    start = 0
+    for cut in cuts + [len(text)]:
+        end = cut
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if end > start:
+            if spans and end - start < min_chars:
+                spans[-1] = (spans[-1][0], end)
+            else:
+                spans.append((start, end))
+        start = cut
+    return spans
+
+
+def _estimate_cost(word: str) -> int:
+    """Приблизительное число WordPiece-токенов слова (с запасом: кириллица режется мельче)"""
+    if word.isascii():
+        return max(1, (len(word) + 5) // 6)
+    return max(1, (len(word) + 1) // 2)
+
+
+class TokenBudgetSplitter:
+    """Сплиттер с интерфейсом split_documents / split_text, как у сплиттеров LangChain"""
+
+    def __init__(self, max_tokens: int = DEFAULT_MAX_TOKENS, overlap_tokens: int = DEFAULT_OVERLAP_TOKENS,
+                 tokenizer=None, min_fill: float = 0.6):
+        """
+        max_tokens: бюджет чанка в токенах модели (без служебных токенов).
+        overlap_tokens: перекрытие соседних чанков.
+        tokenizer: быстрый токенизатор transformers; None — приблизительная оценка по словам.
+        min_fill: разрез на границе ставится не раньше этой доли бюджета.
+        """
+        if max_tokens <= 0:
+            raise ValueError("max_tokens должен быть положительным")
+        if not 0 <= overlap_tokens < max_tokens:
+            raise ValueError("overlap_tokens должен быть меньше max_tokens")
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.tokenizer = tokenizer
+        self.min_fill = min_fill
+        # Быстрые токенизаторы не рассчитаны на одновременные вызовы из нескольких потоков
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_model(cls, model_name: str, **kwargs) -> "TokenBudgetSplitter":
+        return cls(tokenizer=load_tokenizer(model_name), **kwargs)
+
+    def _tokens(self, text: str) -> Tuple[List[Tuple[int, int]], List[int]]:
+        """Символьные границы токенов и накопленное число токенов перед каждым из них"""
+        if self.tokenizer is not None:
+            with self._lock:
+                encoded = self.tokenizer(text, add_special_tokens=False, return_offsets_mapping=True,
+                                         verbose=False)
+            spans = [tuple(span) for span in encoded["offset_mapping"] if span[1] > span[0]]
+            return spans, list(range(len(spans) + 1))
+        spans, cumulative = [], [0]
+        for match in _WORD_PATTERN.finditer(text):
+            spans.append(match.span())
+            cumulative.append(cumulative[-1] + _estimate_cost(match.group()))
+        return spans, cumulative
+
+    @staticmethod
+    def _priorities(text: str, spans: List[Tuple[int, int]]) -> bytearray:
+        """Приоритет разреза перед каждым токеном (и после последнего)"""
+        marks = bytearray(len(text) + 1)
+        for priority, pattern in _BOUNDARY_PATTERNS:
+            for match in pattern.finditer(text):
+                if marks[match.end()] < priority:
+                    marks[match.end()] = priority
+        priorities = bytearray(len(spans) + 1)
+        previous_end = 0
+        for i, (start, _) in enumerate(spans):
+            if start > previous_end:
+                priorities[i] = max(marks[start], _SPACE)
+            previous_end = spans[i][1]
+        priorities[len(spans)] = _PARAGRAPH
+        return priorities
+
+    def split_spans(self, text: str) -> List[Tuple[int, int, int]]:
+        """Чанки текста в виде (начало, конец, число токенов)"""
+        spans, cumulative = self._tokens(text)
+        if not spans:
+            return []
+        priorities = self._priorities(text, spans)
+        count = len(spans)
+        min_tokens = int(self.max_tokens * self.min_fill)
+        chunks = []
+        start = end = 0
+        while start < count:
+            # Самое дальнее окно, которое укладывается в бюджет (указатель только растет)
+            end = max(end, start + 1)
+            while end < count and cumulative[end + 1] - cumulative[start] <= self.max_tokens:
+                end += 1
+            cut = end
+            if end < count:
+                # Лучшая граница в окне [min_fill * бюджет, бюджет]; при равенстве — самая дальняя
+                best = -1
+                i = end
+                while i > start and cumulative[i] - cumulative[start] >= min_tokens:
+                    if priorities[i] > best:
+                        best, cut = priorities[i], i
+                        if best == _PARAGRAPH:
+                            break
+                    i -= 1
+            chunks.append((spans[start][0], spans[cut - 1][1], cumulative[cut] - cumulative[start]))
+            if cut >= count:
+                break
+            start = self._overlap_start(cut, start, cumulative, priorities)
+        return chunks
+
+    def _overlap_start(self, cut: int, start: int, cumulative: List[int], priorities: bytearray) -> int:
+        """Начало следующего чанка: лучшая граница в пределах перекрытия перед разрезом"""
+        next_start, best = cut, -1
+        i = cut - 1
+        while i > start and cumulative[cut] - cumulative[i] <= self.overlap_tokens:
+            if priorities[i] >= best:
+                best, next_start = priorities[i], i
+            i -= 1
+        # Разрез внутри слова не годится для начала чанка
+        return next_start if best > _INSIDE_WORD else cut
+
+    def split_text(self, text: str) -> List[str]:
+        return [text[start:end] for start, end, _ in self.split_spans(text)]
+
+    def split_documents(self, documents) -> list:
+        """Документы того же класса с метаданными исходного документа и смещениями чанка"""
+        chunks = []
+        for doc in documents:
+            text = doc.page_content or ""
+            for start, end, tokens in self.split_spans(text):
+                metadata = dict(doc.metadata)
+                metadata.update(start_index=start, end_index=end, token_count=tokens)
+                chunks.append(type(doc)(page_content=text[start:end], metadata=metadata))
+        return chunks
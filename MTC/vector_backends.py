@@ -0,0 +1,924 @@
+"""
+Векторные хранилища для SimpleRAGBot
+
+Оба хранилища реализуют один и тот же небольшой интерфейс в стиле коллекции Chroma:
+    upsert(ids, embeddings, metadatas, documents), update(ids, metadatas), delete(ids),
+    get(ids=None, where=None, include=...) -> {"ids", "documents", "metadatas", "embeddings"},
+    query(query_embeddings, n_results, where=None, nprobe=None) -> {"ids", "documents", "metadatas", "scores"},
+    count(), persist(), close()
+В результатах query "scores" — релевантность (чем больше, тем лучше).
+Условие {"$duplicates": where} выполняется для строки, если where выполняется хотя бы для одного
+места [source, page] из ее поля "duplicates" (места отброшенных дубликатов, см. dedup.py);
+его понимают хранилища с supports_duplicates.
+
+ChromaBackend  — коллекция Chroma через LangChain (по умолчанию)
+NumpyBackend   — нормированные float32 векторы в memory-mapped файле и таблица метаданных;
+                 точный top-k одним матрично-векторным произведением и argpartition.
+                 Дополнительно может хранить сжатую копию векторов (float16 или int8 с
+                 масштабом на вектор): поиск просматривает сжатую копию, а небольшой набор
+                 кандидатов пересчитывается по полным float32 векторам.
+                 Для больших коллекций — приближенный поиск по индексу IVF (ivf_index.py):
+                 просматриваются только nprobe ближайших кластеров.
+                 Строки каждого документа хранятся списком (раздел по source), поэтому
+                 фильтр по документам просматривает только их строки, а не всю коллекцию.
+                 Таблица строк — журнал JSON Lines, persist() дописывает только изменения;
+                 поиск идет вне блокировки по зафиксированному состоянию массивов
+"""
+
+import os
+import copy
+import json
+import operator
+import threading
+from itertools import chain
+from typing import Dict, List, Optional, Set
+
+NUMPY_MARKER = "numpy_store.json"
+
+# Режимы хранения сжатой копии векторов для NumpyBackend ("none" — без сжатия)
+QUANTIZATION_MODES = ("none", "float16", "int8")
+
+# Сколько строк матрицы обрабатывается за раз при полном просмотре
+SCAN_BLOCK_ROWS = 65536
+
+# Режимы поиска NumpyBackend: точный полный просмотр или приближенный по IVF
+INDEX_MODES = ("flat", "ivf")
+
+# Если фильтр оставляет меньше этой доли строк, оцениваются только выбранные строки
+SUBSET_SCAN_FRACTION = 0.25
+
+# Поле метаданных представителя: места [source, page] дубликатов, за которые он стоит
+DUPLICATES_KEY = "duplicates"
+
+
+def matches_where(metadata: dict, where: Optional[dict]) -> bool:
+    """Проверка метаданных на условие в стиле Chroma ({"source": "a.pdf"}, {"page": {"$gte": 3}})"""
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_where(metadata, part) for part in condition):
+                return False
+            continue
+        if key == "$or":
+            if not any(matches_where(metadata, part) for part in condition):
+                return False
+            continue
+        if key == "$duplicates":
+            if not any(matches_where({**metadata, "source": source, "page": page}, condition)
+                       for source, page in metadata.get(DUPLICATES_KEY) or ()):
+                return False
+            continue
+        value = metadata.get(key)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for op_name, expected in condition.items():
+            if op_name == "$eq" and value != expected:
+                return False
+            if op_name == "$ne" and value == expected:
+                return False
+            if op_name == "$in" and value not in expected:
+                return False
+            if op_name == "$nin" and value in expected:
+                return False
+            if op_name in ("$gt", "$gte", "$lt", "$lte"):
+                if value is None:
+                    return False
+                if op_name == "$gt" and not value > expected:
+                    return False
+                if op_name == "$gte" and not value >= expected:
+                    return False
+                if op_name == "$lt" and not value < expected:
+                    return False
+                if op_name == "$lte" and not value <= expected:
+                    return False
+    return True
+
+
+# Сравнения для векторной проверки условий where по столбцам метаданных
+_COMPARISONS = {"$eq": operator.eq, "$ne": operator.ne, "$gt": operator.gt,
+                "$gte": operator.ge, "$lt": operator.lt, "$lte": operator.le}
+
+
+def where_sources(where: Optional[dict]) -> Optional[set]:
+    """Документы, которыми ограничивает условие (None — условие на source не задано)"""
+    if not where:
+        return None
+    condition = where.get("source")
+    if condition is not None:
+        if not isinstance(condition, dict):
+            return {condition}
+        if "$eq" in condition:
+            return {condition["$eq"]}
+        if "$in" in condition:
+            return set(condition["$in"])
+    for part in where.get("$and", []):
+        sources = where_sources(part)
+        if sources is not None:
+            return sources
+    if "$duplicates" in where:
+        return where_sources(where["$duplicates"])
+    if "$or" in where:
+        # Ограничение есть, только если каждая ветвь ограничивает документы
+        parts = [where_sources(part) for part in where["$or"]]
+        if parts and all(sources is not None for sources in parts):
+            return set().union(*parts)
+    return None
+
+
+def quantize_vectors(vectors, mode: str):
+    """float32 векторы -> (сжатые векторы, масштабы для int8 или None)"""
+    import numpy as np
+    if mode == "float16":
+        return vectors.astype(np.float16), None
+    scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+    quantized = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+class ChromaBackend:
+    """Хранилище на Chroma (через LangChain)"""
+
+    name = "chroma"
+    # В метаданных Chroma нет списков: места дубликатов не хранятся
+    supports_duplicates = False
+
+    def __init__(self, persist_directory: str, embedding_function):
+        from langchain_community.vectorstores import Chroma
+        self.persist_directory = persist_directory
+        self.store = Chroma(persist_directory=persist_directory, embedding_function=embedding_function)
+        self._relevance_fn = self.store._select_relevance_score_fn()
+
+    def count(self) -> int:
+        return self.store._collection.count()
+
+    def upsert(self, ids: List[str], embeddings: List[List[float]], metadatas: List[dict],
+               documents: List[str]):
+        self.store._collection.upsert(ids=ids, embeddings=embeddings, metadatas=metadatas,
+                                      documents=documents)
+
+    def update(self, ids: List[str], metadatas: List[dict]):
+        self.store._collection.update(ids=ids, metadatas=metadatas)
+
+    def delete(self, ids: List[str]):
+        self.store.delete(ids=ids)
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[dict] = None,
+            include: Optional[List[str]] = None) -> dict:
+        include = include if include is not None else ["documents", "metadatas"]
+        return self.store.get(ids=ids, where=where, include=include)
+
+    def query(self, query_embeddings: List[List[float]], n_results: int,
+              where: Optional[dict] = None, nprobe: Optional[int] = None) -> dict:
+        # nprobe не используется: у Chroma собственный индекс HNSW
+        results = self.store._collection.query(
+            query_embeddings=query_embeddings,
+            n_results=n_results,
+            where=where,
+            include=["documents", "metadatas", "distances"]
+        )
+        results["scores"] = [[self._relevance_fn(distance) for distance in distances]
+                             for distances in results["distances"]]
+        return results
+
+    def persist(self):
+        # В новых версиях Chroma сохраняет данные автоматически
+        if hasattr(self.store, "persist"):
+            self.store.persist()
+
+    def close(self):
+        self.store = None
+
+
+class _SearchView:
+    """Состояние хранилища, зафиксированное для одного поиска (меняющие операции его не трогают)"""
+
+    def __init__(self, matrix, quant, scales, ivf):
+        self.matrix = matrix
+        self.quant = quant
+        self.scales = scales
+        self.ivf = ivf
+
+
+class NumpyBackend:
+    """
+    Хранилище на NumPy: векторы в vectors.f32 (memory-mapped), тексты в texts.bin,
+    таблица строк (id, смещение текста, page, source, ...) — журнал rows-N.jsonl,
+    а numpy_store.json — короткий заголовок (размерность, режимы, длина журнала).
+    Удаленные строки помечаются и вычищаются при persist(), когда их становится много.
+
+    Изменения идут под self._lock; массив alive и списки IVF не меняются на месте,
+    а заменяются целиком, поэтому поиск оценивает строки вне блокировки.
+    Сжатие файлов ждет завершения начатых поисков.
+    """
+
+    name = "numpy"
+    supports_duplicates = True
+
+    def __init__(self, persist_directory: str, dim: Optional[int] = None,
+                 quantization: Optional[str] = None, rescore_factor: int = 4,
+                 index: Optional[str] = None, nlist: Optional[int] = None, nprobe: int = 8,
+                 ivf_min_rows: int = 20000):
+        """
+        quantization: "float16", "int8" или "none"; None — оставить режим существующей БД.
+        rescore_factor: во сколько раз больше k кандидатов пересчитывается по float32.
+        index: "flat" (точный поиск) или "ivf"; None — оставить режим существующей БД.
+        nlist: число кластеров IVF (по умолчанию около 4 * sqrt(N)).
+        nprobe: сколько ближайших кластеров просматривается (можно задать на каждый запрос).
+        ivf_min_rows: IVF обучается, только когда строк не меньше этого числа.
+        """
+        import numpy as np
+        from ivf_index import IVFIndex
+        if quantization is not None and quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"Неизвестный режим квантизации: {quantization}")
+        if index is not None and index not in INDEX_MODES:
+            raise ValueError(f"Неизвестный режим индекса: {index}")
+        self.np = np
+        self.persist_directory = persist_directory
+        self.meta_path = os.path.join(persist_directory, NUMPY_MARKER)
+        self.vectors_path = os.path.join(persist_directory, "vectors.f32")
+        self.texts_path = os.path.join(persist_directory, "texts.bin")
+        self.quant_path = os.path.join(persist_directory, "vectors.q")
+        self.scales_path = os.path.join(persist_directory, "scales.f32")
+        self.ivf_path = os.path.join(persist_directory, "ivf_index.pkl")
+        self.rescore_factor = rescore_factor
+        self.quantization = "none"
+        self.index = "flat"
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.ivf_min_rows = ivf_min_rows
+        self.ivf = IVFIndex()
+        self._lock = threading.RLock()
+        # Поиски, которые идут вне блокировки (сжатие файлов ждет, пока их не станет)
+        self._readers = 0
+        self._readers_done = threading.Condition(self._lock)
+        # Журнал строк: записи, еще не дописанные в файл, и число записей в файле
+        self.log_name = "rows-0.jsonl"
+        self._log_size = 0
+        self._log_records = 0
+        self._pending: List[str] = []
+        self._rewrite_log = False
+
+        self.dim = dim
+        self.ids: List[str] = []
+        self.metadatas: List[dict] = []
+        self.text_offsets: List[int] = []
+        self.text_lengths: List[int] = []
+        self.alive = np.zeros(0, dtype=bool)
+        self.id_to_row: Dict[str, int] = {}
+        # Раздел по документам: source -> строки (включая удаленные, они отсекаются по alive)
+        self.source_rows: Dict[str, List[int]] = {}
+        # Строки представителей по документам их дубликатов (для фильтра $duplicates)
+        self.duplicate_rows: Dict[str, Set[int]] = {}
+        # Столбцы метаданных в виде массивов numpy (строятся при первом фильтре по полю)
+        self._columns: Dict[str, object] = {}
+        self._texts_size = 0
+        self._matrix = None
+        self._quant = None
+        self._scales = None
+
+        os.makedirs(persist_directory, exist_ok=True)
+        if os.path.exists(self.meta_path):
+            self._load()
+        changed = False
+        if quantization is not None and quantization != self.quantization:
+            self.quantization = quantization
+            self._rebuild_quantized()
+            changed = True
+        if index is not None and index != self.index:
+            self.index = index
+            self.ivf = IVFIndex()
+            changed = True
+        if changed and self.ids:
+            self.persist()
+
+    def _load(self):
+        np = self.np
+        with open(self.meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        self.dim = meta["dim"]
+        alive = self._replay_log(meta)
+        rows = len(self.ids)
+        self.alive = np.array(alive, dtype=bool)
+        self.id_to_row = {chunk_id: i for i, chunk_id in enumerate(self.ids) if self.alive[i]}
+        self._rebuild_source_rows()
+        self._texts_size = meta["texts_size"]
+        self.quantization = meta.get("quantization", "none")
+        self.index = meta.get("index", "flat")
+
+        # Данные, дописанные после последнего persist() (например, при сбое), отбрасываются
+        quant_itemsize = {"float16": 2, "int8": 1}.get(self.quantization, 0)
+        for path, size in ((self.vectors_path, rows * (self.dim or 0) * 4),
+                           (self.texts_path, self._texts_size),
+                           (self.quant_path, rows * (self.dim or 0) * quant_itemsize),
+                           (self.scales_path, rows * 4 if self.quantization == "int8" else 0)):
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                os.truncate(path, size)
+
+        if self.index == "ivf":
+            from ivf_index import IVFIndex
+            self.ivf = IVFIndex.load(self.ivf_path)
+            if self.ivf.indexed_rows > rows:
+                self.ivf.reassign(self.matrix)
+            elif self.ivf.indexed_rows < rows:
+                self.ivf.add(self.matrix, self.ivf.indexed_rows)
+
+    def _replay_log(self, meta: dict) -> List[bool]:
+        """
+        Чтение журнала строк до длины из заголовка (хвост после сбоя отбрасывается).
+        Записи: новая строка {"id", "offset", "length", "metadata"} (тот же id в более ранней
+        строке становится удаленным), {"update": строка, "metadata"} и {"delete": [строки]}
+        """
+        self.log_name = meta["log"]
+        self._log_size = meta["log_size"]
+        log_path = os.path.join(self.persist_directory, self.log_name)
+        with open(log_path, "rb") as f:
+            data = f.read(self._log_size)
+        if os.path.getsize(log_path) > self._log_size:
+            os.truncate(log_path, self._log_size)
+        alive: List[bool] = []
+        last_row: Dict[str, int] = {}
+        for line in data.split(b"\n"):
+            if not line:
+                continue
+            record = json.loads(line)
+            self._log_records += 1
+            if "update" in record:
+                self.metadatas[record["update"]] = record["metadata"]
+            elif "delete" in record:
+                for row in record["delete"]:
+                    alive[row] = False
+            else:
+                previous = last_row.get(record["id"])
+                if previous is not None:
+                    alive[previous] = False
+                last_row[record["id"]] = len(self.ids)
+                self.ids.append(record["id"])
+                self.metadatas.append(record["metadata"])
+                self.text_offsets.append(record["offset"])
+                self.text_lengths.append(record["length"])
+                alive.append(True)
+        return alive
+
+    def _rebuild_source_rows(self):
+        self._columns = {}
+        self.source_rows = {}
+        self.duplicate_rows = {}
+        for row, metadata in enumerate(self.metadatas):
+            if self.alive[row]:
+                self.source_rows.setdefault(metadata.get("source"), []).append(row)
+                self._add_duplicate_rows(row, metadata)
+
+    def _add_duplicate_rows(self, row: int, metadata: dict):
+        for source in {source for source, _ in metadata.get(DUPLICATES_KEY) or ()}:
+            self.duplicate_rows.setdefault(source, set()).add(row)
+
+    @property
+    def matrix(self):
+        """Матрица векторов (memory-mapped, переоткрывается после добавления строк)"""
+        np = self.np
+        rows = len(self.ids)
+        if self._matrix is None or self._matrix.shape[0] != rows:
+            if rows == 0 or not self.dim:
+                self._matrix = np.zeros((0, self.dim or 0), dtype=np.float32)
+            else:
+                self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+        return self._matrix
+
+    @property
+    def quant_matrix(self):
+        """Сжатая копия векторов (memory-mapped) или None, если сжатие выключено"""
+        np = self.np
+        if self.quantization == "none":
+            return None
+        rows = len(self.ids)
+        if self._quant is None or self._quant.shape[0] != rows:
+            dtype = np.float16 if self.quantization == "float16" else np.int8
+            if rows == 0 or not self.dim:
+                self._quant = np.zeros((0, self.dim or 0), dtype=dtype)
+                self._scales = np.zeros(0, dtype=np.float32)
+            else:
+                self._quant = np.memmap(self.quant_path, dtype=dtype, mode="r", shape=(rows, self.dim))
+                if self.quantization == "int8":
+                    self._scales = np.memmap(self.scales_path, dtype=np.float32, mode="r", shape=(rows,))
+        return self._quant
+
+    def _quantize(self, vectors):
+        return quantize_vectors(vectors, self.quantization)
+
+    def _append_quantized(self, vectors):
+        if self.quantization == "none":
+            return
+        quantized, scales = self._quantize(vectors)
+        with open(self.quant_path, "ab") as f:
+            f.write(quantized.tobytes())
+        if scales is not None:
+            with open(self.scales_path, "ab") as f:
+                f.write(scales.tobytes())
+
+    def _rebuild_quantized(self):
+        """Пересоздание сжатой копии по полным векторам (после смены режима или сжатия файлов)"""
+        self._quant = self._scales = None
+        for path in (self.quant_path, self.scales_path):
+            if os.path.exists(path):
+                os.remove(path)
+        if self.quantization == "none" or not self.ids:
+            return
+        matrix = self.matrix
+        for start in range(0, matrix.shape[0], SCAN_BLOCK_ROWS):
+            self._append_quantized(self.np.asarray(matrix[start:start + SCAN_BLOCK_ROWS]))
+
+    def count(self) -> int:
+        return len(self.id_to_row)
+
+    def _read_texts(self, rows: List[int]) -> List[str]:
+        if not rows:
+            return []
+        with open(self.texts_path, "rb") as f:
+            texts = []
+            for row in rows:
+                f.seek(self.text_offsets[row])
+                texts.append(f.read(self.text_lengths[row]).decode("utf-8"))
+            return texts
+
+    def upsert(self, ids: List[str], embeddings: List[List[float]], metadatas: List[dict],
+               documents: List[str]):
+        np = self.np
+        if not ids:
+            return
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.maximum(norms, 1e-12)
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            encoded = [document.encode("utf-8") for document in documents]
+            with open(self.vectors_path, "ab") as f:
+                f.write(vectors.tobytes())
+            self._append_quantized(vectors)
+            with open(self.texts_path, "ab") as f:
+                for data in encoded:
+                    f.write(data)
+
+            start = len(self.ids)
+            replaced = []
+            for i, (chunk_id, metadata, data) in enumerate(zip(ids, metadatas, encoded)):
+                old_row = self.id_to_row.get(chunk_id)
+                if old_row is not None:
+                    replaced.append(old_row)
+                self.ids.append(chunk_id)
+                self.metadatas.append(dict(metadata))
+                self.source_rows.setdefault(metadata.get("source"), []).append(start + i)
+                self._add_duplicate_rows(start + i, metadata)
+                self.text_offsets.append(self._texts_size)
+                self.text_lengths.append(len(data))
+                self._pending.append(json.dumps({"id": chunk_id, "offset": self._texts_size,
+                                                 "length": len(data), "metadata": self.metadatas[-1]},
+                                                ensure_ascii=False))
+                self._texts_size += len(data)
+                self.id_to_row[chunk_id] = start + i
+            # Новый массив, а не изменение на месте: идущие поиски видят прежний
+            alive = np.concatenate([self.alive, np.ones(len(ids), dtype=bool)])
+            alive[replaced] = False
+            self.alive = alive
+            # Новые строки сразу попадают в ближайшие кластеры обученного индекса
+            if self.index == "ivf" and self.ivf.is_trained:
+                self.ivf.add(self.matrix, start)
+
+    def update(self, ids: List[str], metadatas: List[dict]):
+        with self._lock:
+            for chunk_id, metadata in zip(ids, metadatas):
+                row = self.id_to_row.get(chunk_id)
+                if row is not None:
+                    if metadata.get("source") != self.metadatas[row].get("source"):
+                        self.source_rows.setdefault(metadata.get("source"), []).append(row)
+                    self._add_duplicate_rows(row, metadata)
+                    self.metadatas[row] = dict(metadata)
+                    self._pending.append(json.dumps({"update": row, "metadata": self.metadatas[row]},
+                                                    ensure_ascii=False))
+            self._columns = {}
+
+    def delete(self, ids: List[str]):
+        with self._lock:
+            rows = [row for row in (self.id_to_row.pop(chunk_id, None) for chunk_id in ids) if row is not None]
+            if rows:
+                alive = self.alive.copy()
+                alive[rows] = False
+                self.alive = alive
+                self._pending.append(json.dumps({"delete": rows}))
+
+    def _column(self, key: str):
+        """Значения поля метаданных для всех строк (числа — float64 с NaN вместо пропусков)"""
+        np = self.np
+        column = self._columns.get(key)
+        if column is None or len(column) != len(self.metadatas):
+            values = [metadata.get(key) for metadata in self.metadatas]
+            try:
+                column = np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+            except (TypeError, ValueError):
+                column = np.empty(len(values), dtype=object)
+                column[:] = values
+            self._columns[key] = column
+        return column
+
+    def _where_mask(self, where: dict, rows):
+        """Векторная проверка условия where для строк rows (массив номеров строк)"""
+        np = self.np
+        mask = np.ones(len(rows), dtype=bool)
+        for key, condition in where.items():
+            if key in ("$and", "$or"):
+                parts = [self._where_mask(part, rows) for part in condition]
+                mask &= (np.logical_and if key == "$and" else np.logical_or).reduce(parts)
+                continue
+            if key == "$duplicates":
+                mask &= self._duplicates_mask(condition, rows)
+                continue
+            values = self._column(key)[rows]
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            for name, expected in condition.items():
+                if name in ("$in", "$nin"):
+                    hit = np.isin(values, list(expected))
+                    mask &= hit if name == "$in" else ~hit
+                else:
+                    mask &= np.asarray(_COMPARISONS[name](values, expected), dtype=bool)
+        return mask
+
+    def _duplicates_mask(self, where: dict, rows):
+        """Условие where по местам дубликатов: проверяются только строки с полем duplicates"""
+        np = self.np
+        mask = np.zeros(len(rows), dtype=bool)
+        candidates = sorted({row for source_rows in self.duplicate_rows.values() for row in source_rows})
+        if candidates:
+            condition = {"$duplicates": where}
+            for position in np.flatnonzero(np.isin(rows, candidates)):
+                mask[position] = matches_where(self.metadatas[int(rows[position])], condition)
+        return mask
+
+    def _rows(self, ids: Optional[List[str]], where: Optional[dict]) -> List[int]:
+        np = self.np
+        sources = where_sources(where)
+        if ids is not None:
+            rows = [self.id_to_row[chunk_id] for chunk_id in ids if chunk_id in self.id_to_row]
+        elif sources is not None:
+            # Просматриваются только разделы выбранных документов
+            rows = sorted({row for source in sources
+                           for row in chain(self.source_rows.get(source, ()), self.duplicate_rows.get(source, ()))
+                           if self.alive[row]})
+        else:
+            rows = np.flatnonzero(self.alive).tolist()
+        if not where or not rows:
+            return rows
+        try:
+            selected = np.asarray(rows, dtype=np.int64)
+            return selected[self._where_mask(where, selected)].tolist()
+        except (TypeError, ValueError, KeyError):
+            # Смешанные типы значений: построчная проверка
+            return [row for row in rows if matches_where(self.metadatas[row], where)]
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[dict] = None,
+            include: Optional[List[str]] = None) -> dict:
+        include = include if include is not None else ["documents", "metadatas"]
+        with self._lock:
+            rows = self._rows(ids, where)
+            return {
+                "ids": [self.ids[row] for row in rows],
+                "documents": self._read_texts(rows) if "documents" in include else None,
+                "metadatas": [self.metadatas[row] for row in rows] if "metadatas" in include else None,
+                "embeddings": (self.np.asarray(self.matrix[rows], dtype=self.np.float32)
+                               if "embeddings" in include else None),
+            }
+
+    def _row_mask(self, where: Optional[dict]):
+        """Маска строк, участвующих в поиске"""
+        if not where:
+            return self.alive
+        mask = self.np.zeros(len(self.ids), dtype=bool)
+        mask[self._rows(None, where)] = True
+        return mask
+
+    def _view(self) -> _SearchView:
+        """Зафиксированное состояние для поиска (вызывается под блокировкой)"""
+        quant = self.quant_matrix
+        # Копия без копирования данных: обучение и добавление строк заменяют списки IVF целиком
+        scales = self._scales if quant is not None and self.quantization == "int8" else None
+        return _SearchView(self.matrix, quant, scales, copy.copy(self.ivf))
+
+    def _scan(self, view: _SearchView, queries, exact: bool):
+        """Оценки всех строк для всех запросов (строки x запросы), поблочно"""
+        np = self.np
+        quant = None if exact else view.quant
+        source = view.matrix if quant is None else quant
+        scores = np.empty((source.shape[0], queries.shape[0]), dtype=np.float32)
+        for start in range(0, source.shape[0], SCAN_BLOCK_ROWS):
+            block = np.asarray(source[start:start + SCAN_BLOCK_ROWS], dtype=np.float32)
+            block_scores = block @ queries.T
+            if quant is not None and view.scales is not None:
+                block_scores *= np.asarray(view.scales[start:start + SCAN_BLOCK_ROWS])[:, None]
+            scores[start:start + block.shape[0]] = block_scores
+        return scores
+
+    def _score_rows(self, view: _SearchView, rows, query, exact: bool):
+        """
+        Оценки выбранных строк для одного запроса или матрицы запросов (размерность x запросы)
+        по сжатой копии, если exact=False
+        """
+        np = self.np
+        quant = None if exact else view.quant
+        if quant is None:
+            return np.asarray(view.matrix[rows], dtype=np.float32) @ query
+        scores = np.asarray(quant[rows], dtype=np.float32) @ query
+        if view.scales is not None:
+            scales = np.asarray(view.scales[rows])
+            scores *= scales if scores.ndim == 1 else scales[:, None]
+        return scores
+
+    def _search_rows(self, queries, k: int, mask, exact: bool = False,
+                     nprobe: Optional[int] = None, use_index: bool = True,
+                     view: Optional[_SearchView] = None):
+        """
+        Top-k строк для каждого запроса: список (строки, оценки).
+        view — состояние, зафиксированное под блокировкой (None — текущее, блокировка должна быть взята)
+        """
+        np = self.np
+        view = view or self._view()
+        live = int(mask.sum())
+        k = min(k, live)
+        if k == 0:
+            return [([], []) for _ in range(queries.shape[0])]
+
+        rescore = not exact and self.quantization != "none"
+        use_ivf = (not exact and use_index and self.index == "ivf" and view.ivf.is_trained
+                   and live >= self.ivf_min_rows)
+        subset = None
+        if not use_ivf and live < len(mask) * SUBSET_SCAN_FRACTION:
+            # Фильтр оставил малую часть коллекции: оцениваются только подходящие строки
+            subset = np.flatnonzero(mask)
+            scores = self._score_rows(view, subset, queries.T, exact=not rescore)
+        elif not use_ivf:
+            # Косинусная близость для всех запросов сразу (по сжатой копии, если она есть)
+            scores = self._scan(view, queries, exact=not rescore)
+            if live < len(mask):
+                scores[~mask] = -np.inf
+
+        found = []
+        for column in range(queries.shape[0]):
+            if use_ivf:
+                rows = view.ivf.probe(queries[column], nprobe or self.nprobe)
+                rows = rows[mask[rows]]
+                if len(rows) < k:
+                    # Фильтр отсек почти все кандидаты: точный просмотр подходящих строк
+                    rows = np.flatnonzero(mask)
+                column_scores = self._score_rows(view, rows, queries[column], exact=not rescore)
+            else:
+                rows = subset
+                column_scores = scores[:, column]
+            candidates = min(live, len(column_scores), k * self.rescore_factor if rescore else k)
+            top = np.argpartition(-column_scores, candidates - 1)[:candidates]
+            top_rows = top if rows is None else rows[top]
+            if rescore:
+                # Точный пересчет кандидатов по полным float32 векторам
+                top_rows = np.sort(top_rows)
+                top_scores = np.asarray(view.matrix[top_rows], dtype=np.float32) @ queries[column]
+            else:
+                top_scores = column_scores[top]
+            order = np.argsort(-top_scores)[:k]
+            found.append((top_rows[order].tolist(), top_scores[order].tolist()))
+        return found
+
+    def query(self, query_embeddings: List[List[float]], n_results: int,
+              where: Optional[dict] = None, nprobe: Optional[int] = None) -> dict:
+        np = self.np
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        results = {"ids": [], "documents": [], "metadatas": [], "scores": []}
+
+        # Под блокировкой только фильтр и фиксация состояния; оценка строк идет без нее
+        with self._lock:
+            mask = self._row_mask(where)
+            view = self._view()
+            self._readers += 1
+        try:
+            # Строки до зафиксированной длины не меняются: списки только дописываются,
+            # а сжатие файлов ждет завершения поиска
+            for rows, scores in self._search_rows(queries, n_results, mask, nprobe=nprobe, view=view):
+                results["ids"].append([self.ids[row] for row in rows])
+                results["documents"].append(self._read_texts(rows))
+                results["metadatas"].append([self.metadatas[row] for row in rows])
+                results["scores"].append([float(score) for score in scores])
+        finally:
+            with self._lock:
+                self._readers -= 1
+                if not self._readers:
+                    self._readers_done.notify_all()
+        return results
+
+    def build_ivf(self, nlist: Optional[int] = None):
+        """Обучение (или переобучение) индекса IVF по текущим векторам"""
+        with self._lock:
+            self.index = "ivf"
+            if self.ids:
+                self.ivf.train(self.matrix, nlist or self.nlist)
+                self.ivf.save(self.ivf_path)
+
+    def _sample_queries(self, sample: int):
+        """Случайные векторы из самой БД в качестве тестовых запросов"""
+        np = self.np
+        live_rows = np.flatnonzero(self.alive)
+        if len(live_rows) == 0:
+            return None
+        picked = np.random.default_rng(0).choice(live_rows, size=min(sample, len(live_rows)), replace=False)
+        return np.asarray(self.matrix[np.sort(picked)], dtype=np.float32)
+
+    def ann_report(self, nprobes: List[int], sample: int = 100, k: int = 10) -> List[dict]:
+        """
+        Recall@k и задержка приближенного поиска для каждого значения nprobe
+        относительно точного полного просмотра
+        """
+        import time
+        np = self.np
+        report = []
+        with self._lock:
+            queries = self._sample_queries(sample)
+            if queries is None:
+                return report
+
+            def timed(**kwargs):
+                latencies, found = [], []
+                for query in queries:
+                    started = time.perf_counter()
+                    found.extend(self._search_rows(query[None, :], k, self.alive, **kwargs))
+                    latencies.append((time.perf_counter() - started) * 1000)
+                return found, latencies
+
+            exact, exact_latencies = timed(exact=True)
+            for nprobe in nprobes:
+                approx, latencies = timed(nprobe=nprobe)
+                hits = [len(set(exact_rows) & set(approx_rows)) / max(len(exact_rows), 1)
+                        for (exact_rows, _), (approx_rows, _) in zip(exact, approx)]
+                report.append({
+                    "nprobe": nprobe,
+                    "recall": float(np.mean(hits)),
+                    "mean_ms": float(np.mean(latencies)),
+                    "p95_ms": float(np.percentile(latencies, 95)),
+                    "exact_mean_ms": float(np.mean(exact_latencies)),
+                })
+        return report
+
+    def quantization_report(self, sample: int = 50, k: int = 10) -> dict:
+        """
+        Экономия памяти и recall@k сжатого поиска относительно точного.
+        В качестве запросов берутся случайные векторы из самой БД.
+        """
+        np = self.np
+        rows = len(self.ids)
+        dim = self.dim or 0
+        itemsize = {"float16": 2, "int8": 1}.get(self.quantization, 4)
+        full_bytes = rows * dim * 4
+        compressed_bytes = rows * dim * itemsize + (rows * 4 if self.quantization == "int8" else 0)
+        report = {
+            "mode": self.quantization,
+            "full_mb": full_bytes / 1024 / 1024,
+            "compressed_mb": compressed_bytes / 1024 / 1024,
+            "ratio": full_bytes / compressed_bytes if compressed_bytes else 1.0,
+            "k": k,
+            "recall": 1.0,
+        }
+        with self._lock:
+            queries = self._sample_queries(sample)
+            if self.quantization == "none" or queries is None:
+                return report
+            exact = self._search_rows(queries, k, self.alive, exact=True)
+            approx = self._search_rows(queries, k, self.alive, use_index=False)
+        hits = [len(set(exact_rows) & set(approx_rows)) / max(len(exact_rows), 1)
+                for (exact_rows, _), (approx_rows, _) in zip(exact, approx)]
+        report["recall"] = float(np.mean(hits))
+        return report
+
+    def persist(self):
+        """
+        Сохранение таблицы строк (и сжатие файлов, если удаленных строк много).
+        В журнал дописываются только изменения с прошлого вызова; заново он пишется
+        после сжатия файлов и когда записей об изменениях стало вдвое больше, чем строк
+        """
+        with self._lock:
+            dead = len(self.ids) - self.count()
+            if dead and dead > len(self.ids) // 3:
+                self._compact()
+            # IVF обучается, когда коллекция стала достаточно большой или выросла в несколько раз
+            if (self.index == "ivf" and self.count() >= self.ivf_min_rows
+                    and self.ivf.needs_training(self.count())):
+                self.ivf.train(self.matrix, self.nlist)
+            if self.index == "ivf" and self.ivf.is_trained:
+                self.ivf.save(self.ivf_path)
+            if self._rewrite_log or self._log_records > 2 * len(self.ids) + 1024:
+                self._write_log()
+            else:
+                self._append_log()
+
+    def _append_log(self):
+        log_path = os.path.join(self.persist_directory, self.log_name)
+        if self._pending:
+            # Хвост, не попавший в заголовок (сбой до его записи), отбрасывается
+            if os.path.exists(log_path) and os.path.getsize(log_path) > self._log_size:
+                os.truncate(log_path, self._log_size)
+            data = ("\n".join(self._pending) + "\n").encode("utf-8")
+            with open(log_path, "ab") as f:
+                f.write(data)
+            self._log_size += len(data)
+            self._log_records += len(self._pending)
+            self._pending = []
+        self._write_header()
+
+    def _write_log(self):
+        """Новый журнал с текущими строками; заголовок переключается на него после записи"""
+        generation = int(self.log_name[len("rows-"):-len(".jsonl")]) + 1
+        name = f"rows-{generation}.jsonl"
+        lines = [json.dumps({"id": chunk_id, "offset": offset, "length": length, "metadata": metadata},
+                            ensure_ascii=False)
+                 for chunk_id, offset, length, metadata in zip(
+                     self.ids, self.text_offsets, self.text_lengths, self.metadatas)]
+        dead = self.np.flatnonzero(~self.alive).tolist()
+        if dead:
+            lines.append(json.dumps({"delete": dead}))
+        data = "".join(line + "\n" for line in lines).encode("utf-8")
+        with open(os.path.join(self.persist_directory, name), "wb") as f:
+            f.write(data)
+        old_path = os.path.join(self.persist_directory, self.log_name)
+        self.log_name = name
+        self._log_size = len(data)
+        self._log_records = len(lines)
+        self._pending = []
+        self._rewrite_log = False
+        self._write_header()
+        if os.path.exists(old_path):
+            os.remove(old_path)
+
+    def _write_header(self):
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": 2, "dim": self.dim, "texts_size": self._texts_size,
+                       "quantization": self.quantization, "index": self.index, "rows": len(self.ids),
+                       "log": self.log_name, "log_size": self._log_size}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.meta_path)
+
+    def _compact(self):
+        """Перезапись файлов без удаленных строк (после завершения начатых поисков)"""
+        np = self.np
+        while self._readers:
+            self._readers_done.wait()
+        rows = [row for row in range(len(self.ids)) if self.alive[row]]
+        vectors = np.array(self.matrix[rows], dtype=np.float32) if rows else np.zeros((0, self.dim or 0), np.float32)
+        texts = [text.encode("utf-8") for text in self._read_texts(rows)]
+        self._matrix = None
+
+        with open(self.vectors_path + ".tmp", "wb") as f:
+            f.write(vectors.tobytes())
+        with open(self.texts_path + ".tmp", "wb") as f:
+            for data in texts:
+                f.write(data)
+        os.replace(self.vectors_path + ".tmp", self.vectors_path)
+        os.replace(self.texts_path + ".tmp", self.texts_path)
+
+        self.ids = [self.ids[row] for row in rows]
+        self.metadatas = [self.metadatas[row] for row in rows]
+        self.text_lengths = [len(data) for data in texts]
+        self.text_offsets = []
+        offset = 0
+        for length in self.text_lengths:
+            self.text_offsets.append(offset)
+            offset += length
+        self._texts_size = offset
+        self.alive = np.ones(len(rows), dtype=bool)
+        self.id_to_row = {chunk_id: i for i, chunk_id in enumerate(self.ids)}
+        self._rebuild_source_rows()
+        self._rebuild_quantized()
+        # Номера строк изменились: списки IVF перестраиваются с прежними центроидами,
+        # а журнал строк пишется заново
+        self.ivf.reassign(self.matrix)
+        self._rewrite_log = True
+
+    def close(self):
+        self._matrix = self._quant = self._scales = None
+
+
+def detect_backend(persist_directory: str) -> str:
+    """Тип хранилища в существующей папке БД"""
+    if os.path.exists(os.path.join(persist_directory, NUMPY_MARKER)):
+        return NumpyBackend.name
+    return ChromaBackend.name
+
+
+def open_backend(name: str, persist_directory: str, embedding_function=None,
+                 quantization: Optional[str] = None, index: Optional[str] = None,
+                 nprobe: int = 8):
+    """Открытие (или создание) хранилища по имени"""
+    if name == ChromaBackend.name:
+        if quantization not in (None, "none"):
+            raise ValueError("Квантизация поддерживается только хранилищем numpy")
+        if index not in (None, "flat"):
+            raise ValueError("Индекс IVF поддерживается только хранилищем numpy")
+        return ChromaBackend(persist_directory, embedding_function)
+    if name == NumpyBackend.name:
+        return NumpyBackend(persist_directory, quantization=quantization, index=index, nprobe=nprobe)
+    raise ValueError(f"Неизвестное хранилище: {name}")
@@ -3,43 +3,26 @@
 Запуск: python web_app.py
 """
 
-import os
 import sys
-import subprocess
-import tempfile
 from typing import List
 from dataclasses import dataclass
 import warnings
 import time
 warnings.filterwarnings('ignore')
 
-# Функция для установки streamlit если его нет
-def install_streamlit():
-    try:
-        import streamlit as st
-        print("✅ Streamlit уже установлен")
-        return True, st
-    except ImportError:
-        print("📦 Устанавливаю Streamlit...")
-        try:
-            subprocess.check_call([sys.executable, "-m", "pip", "install", "streamlit"])
-            print("✅ Streamlit успешно установлен")
-            import streamlit as st
-            return True, st
-        except:
-            print("❌ Не удалось установить Streamlit")
-            return False, None
-
-# Проверяем и устанавливаем Streamlit
-success, st = install_streamlit()
-if not success:
-    print("Попробуйте установить вручную: pip install streamlit")
-    input("Нажмите Enter для выхода...")
+# Streamlit не устанавливается автоматически: это замедляло каждый запуск
+try:
+    import streamlit as st
+except ImportError:
+    print("❌ Streamlit не установлен. Установите его: pip install streamlit")
     sys.exit(1)
 
 # Импортируем наш RAG бот
 try:
     from rag_chatbot import SimpleRAGBot, ChunkInfo
+    from search_filters import SearchFilter, parse_page_ranges
+    from jobs import JobRunner, DONE, FAILED, CANCELLED
+    from sentence_index import highlight_html
 except ImportError:
     st.error("❌ Не найден файл rag_chatbot.py")
     st.stop()
@@ -91,6 +74,12 @@ st.markdown("""
         margin: 0.5rem 0;
     }
     
+    .source-box mark {
+        background: #ffe8a3;
+        padding: 0 2px;
+        border-radius: 3px;
+    }
+    
     .stat-card {
         background: white;
         padding: 1rem;
@@ -155,10 +144,21 @@ st.markdown("""
 # Инициализация бота в сессии
 @st.cache_resource
 def init_bot():
-    return SimpleRAGBot()
+    # Модель и БД загружаются в фоновом потоке, страница отрисовывается сразу
+    return SimpleRAGBot(warm_up=True)
+
+# Очередь фоновых загрузок общая для всех сессий, как и сам бот
+@st.cache_resource
+def init_jobs():
+    return JobRunner(init_bot())
 
 if 'bot' not in st.session_state:
     st.session_state.bot = init_bot()
+if 'jobs' not in st.session_state:
+    st.session_state.jobs = init_jobs()
+if 'seen_jobs' not in st.session_state:
+    # Завершенные задачи, о которых страница уже знает (чтобы обновить статистику один раз)
+    st.session_state.seen_jobs = set()
 if 'messages' not in st.session_state:
     st.session_state.messages = []
 if 'processing' not in st.session_state:
@@ -204,17 +204,42 @@ with col1:
                 
                 if "sources" in message and message["sources"]:
                     with st.expander("📚 Источники информации"):
-                        for i, src in enumerate(message["sources"], 1):
+                        highlights = message.get("highlights") or [[] for _ in message["sources"]]
+                        for i, (src, spans) in enumerate(zip(message["sources"], highlights), 1):
+                            # Предложения, ближайшие к вопросу, выделены; без них — начало текста
+                            preview = highlight_html(src.text, spans) if spans else f"{src.text[:200]}..."
                             st.markdown(f"""
                             <div class="source-box">
                                 <b>📄 Источник {i} (Страница {src.page})</b><br>
                                 <small>Релевантность: {src.relevance_score:.2%}</small><br>
-                                <p style="margin-top: 0.5rem;">{src.text[:200]}...</p>
+                                <p style="margin-top: 0.5rem;">{preview}</p>
                             </div>
                             """, unsafe_allow_html=True)
     
-    # Поле ввода вопроса
+    # Область поиска: выбранные документы, страницы и период загрузки
     st.markdown("---")
+    search_filter = None
+    sources = st.session_state.bot.indexed_sources()
+    if len(sources) > 1:
+        with st.expander("🎯 Где искать"):
+            picked = st.multiselect("Документы", sources, placeholder="Все документы")
+            pages = st.text_input("Страницы", placeholder="Например: 1-5, 8")
+            period = st.date_input("Загружены в период", value=(), format="DD.MM.YYYY")
+            try:
+                page_ranges = parse_page_ranges(pages)
+            except ValueError as e:
+                st.warning(f"⚠️ {e}")
+                page_ranges = None
+            ingested_after = ingested_before = None
+            if len(period) == 2:
+                ingested_after = time.mktime(period[0].timetuple())
+                ingested_before = time.mktime(period[1].timetuple()) + 24 * 3600
+            search_filter = SearchFilter.create(sources=picked or None, pages=page_ranges,
+                                                ingested_after=ingested_after, ingested_before=ingested_before)
+            if search_filter:
+                st.caption(f"Поиск: {search_filter.describe()}")
+    
+    # Поле ввода вопроса
     col_input, col_button = st.columns([5, 1])
     
     with col_input:
@@ -227,6 +252,8 @@ with col1:
     
     with col_button:
         send_button = st.button("📤 Отправить", use_container_width=True)
+    rerank = st.toggle("🎯 Точнее: переранжирование кандидатов моделью cross-encoder",
+                       help=f"Бюджет запроса — {st.session_state.bot.rerank_budget_ms:.0f} мс")
     
     if send_button and question:
         if st.session_state.bot.chunks_count == 0:
@@ -235,22 +262,26 @@ with col1:
             # Добавляем вопрос пользователя
             st.session_state.messages.append({"role": "user", "content": question})
             
-            # Поиск и генерация ответа
-            with st.spinner("🔍 Анализирую конспекты..."):
-                # Прогресс бар для визуализации
-                progress_bar = st.progress(0)
-                for i in range(100):
-                    time.sleep(0.01)
-                    progress_bar.progress(i + 1)
-                
-                chunks = st.session_state.bot.search(question)
+            # Поиск и генерация ответа: статус показывает реальные этапы и их время
+            with st.status("🔍 Анализирую конспекты...") as status:
+                started = time.perf_counter()
+                chunks = st.session_state.bot.search(question, mode="rerank" if rerank else None,
+                                                     filters=search_filter)
+                status.write(f"Найдено фрагментов: {len(chunks)} "
+                             f"({(time.perf_counter() - started) * 1000:.0f} мс)")
+                report = st.session_state.bot.last_rerank if rerank else None
+                if report is not None:
+                    status.write(f"Бюджет: {report.describe()}")
                 response = st.session_state.bot.generate_answer(question, chunks)
+                status.update(label=f"✅ Ответ готов за {(time.perf_counter() - started) * 1000:.0f} мс",
+                              state="complete")
                 
                 # Добавляем ответ ассистента
                 st.session_state.messages.append({
                     "role": "assistant",
                     "content": response,
-                    "sources": chunks
+                    "sources": chunks,
+                    "highlights": st.session_state.bot.highlight(question, chunks)
                 })
             
             st.rerun()
@@ -283,27 +314,54 @@ with col2:
     )
     
     if uploaded_file is not None:
-        # Сохраняем временный файл
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-            tmp_file.write(uploaded_file.getvalue())
-            tmp_path = tmp_file.name
-        
         col_proc1, col_proc2 = st.columns(2)
         with col_proc1:
             if st.button("🔄 Обработать", type="primary", use_container_width=True):
-                with st.spinner("Обработка документа..."):
-                    success = st.session_state.bot.process_pdf(tmp_path)
-                    if success:
-                        st.success(f"✅ Готово! {st.session_state.bot.chunks_count} фрагментов")
-                    else:
-                        st.error("❌ Ошибка при обработке")
+                # PDF разбирается прямо из памяти; файл, который уже есть в БД, не обрабатывается
+                data = uploaded_file.getvalue()
+                duplicate = st.session_state.bot.indexed_as(data)
+                if duplicate is not None:
+                    st.info(f"📄 Этот файл уже загружен ({duplicate})")
+                else:
+                    st.session_state.jobs.submit_pdf(data, source=uploaded_file.name)
+                    st.rerun()
         
         with col_proc2:
             if st.button("🗑️ Отмена", use_container_width=True):
                 st.rerun()
-        
-        # Удаляем временный файл
-        os.unlink(tmp_path)
+    
+    # Ход фоновых загрузок: пока есть активные задачи, блок обновляется сам раз в секунду,
+    # а вопросы по уже загруженным документам можно задавать в это время
+    def render_jobs():
+        jobs = st.session_state.jobs.list()[:5]
+        for job in jobs:
+            progress = job.progress
+            if job.is_finished:
+                if job.id not in st.session_state.seen_jobs:
+                    st.session_state.seen_jobs.add(job.id)
+                    if job.status == DONE:
+                        # Перерисовка всей страницы: статистика и статус БД изменились
+                        st.rerun()
+                if job.status == DONE:
+                    duplicates = progress.chunks_duplicate if progress is not None else 0
+                    st.success(f"✅ {job.description}: готово за {job.elapsed:.1f} с"
+                               + (f", дубликатов не записано: {duplicates}" if duplicates else ""))
+                elif job.status == CANCELLED:
+                    st.info(f"⏹️ {job.description}: отменено")
+                elif job.status == FAILED:
+                    st.error(f"❌ {job.description}: {job.error}")
+                continue
+            
+            text = f"{job.description}: в очереди"
+            if progress is not None:
+                text = (f"{job.description}: страниц {progress.pages_done}/{progress.pages_total}, "
+                        f"фрагментов {progress.chunks_embedded + progress.chunks_duplicate}/{progress.chunks_new}")
+            st.progress(job.fraction, text=text)
+            if st.button("⏹️ Остановить", key=f"cancel_{job.id}"):
+                st.session_state.jobs.cancel(job.id)
+    
+    fragment = getattr(st, "fragment", None) or st.experimental_fragment
+    fragment(run_every=1.0 if st.session_state.jobs.active() else None)(render_jobs)()
     
     st.markdown("---")
     
@@ -328,18 +386,62 @@ with col2:
         </div>
         """, unsafe_allow_html=True)
     
-    # Размер БД
-    if os.path.exists(st.session_state.bot.persist_directory):
-        import shutil
-        size = sum(os.path.getsize(os.path.join(dirpath, filename)) 
-                  for dirpath, _, filenames in os.walk(st.session_state.bot.persist_directory) 
-                  for filename in filenames) / 1024 / 1024
+    # Размер БД (из статистики индекса, без обхода каталога на каждом перезапуске скрипта)
+    stats = st.session_state.bot.stats
+    if stats:
+        st.markdown(f"""
+        <div class="stat-card">
+            <b>💾 Размер БД:</b> {stats.disk_mb:.2f} MB<br>
+            <b>📄 Документов:</b> {len(stats.sources)}, страниц: {stats.total_pages}
+        </div>
+        """, unsafe_allow_html=True)
+    
+    # Почти одинаковые фрагменты (колонтитулы, повторяющиеся абзацы), не записанные в БД
+    dedup = st.session_state.bot.dedup_report()
+    if dedup and dedup["dropped"]:
         st.markdown(f"""
         <div class="stat-card">
-            <b>💾 Размер БД:</b> {size:.2f} MB
+            <b>🧹 Дубликатов не записано:</b> {dedup['dropped']} ({dedup['ratio']:.1%})
         </div>
         """, unsafe_allow_html=True)
     
+    # Сжатое хранение векторов: экономия памяти и качество поиска
+    report = st.session_state.bot.quantization_report()
+    if report and report["mode"] != "none":
+        st.markdown(f"""
+        <div class="stat-card">
+            <b>🗜️ Квантизация {report['mode']}:</b> {report['compressed_mb']:.2f} MB
+            вместо {report['full_mb']:.2f} MB (×{report['ratio']:.1f})<br>
+            <small>recall@{report['k']} после пересчета: {report['recall']:.3f}</small>
+        </div>
+        """, unsafe_allow_html=True)
+    
+    # Время запуска
+    timings = st.session_state.bot.startup_timings
+    timing_lines = "<br>".join(
+        f"{name}: {timings[name] * 1000:.0f} мс"
+        for name in ["module", "init", "imports", "model", "database"] if name in timings
+    )
+    st.markdown(f"""
+    <div class="stat-card">
+        <b>⏱️ Время запуска</b><br>
+        <small>{timing_lines}</small>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    # Время этапов поиска и загрузки (скользящее окно последних вызовов)
+    metrics = st.session_state.bot.metrics.snapshot()
+    if metrics["timers"]:
+        with st.expander("⏱️ Этапы обработки"):
+            st.table([
+                {"этап": name, "вызовов": timer["count"], "сред., мс": round(timer["mean_ms"], 1),
+                 "p50": round(timer["p50_ms"], 1), "p95": round(timer["p95_ms"], 1),
+                 "p99": round(timer["p99_ms"], 1)}
+                for name, timer in metrics["timers"].items()
+            ])
+            st.download_button("📥 Метрики (Prometheus)", st.session_state.bot.metrics_text(),
+                               file_name="rag_metrics.prom", mime="text/plain")
+    
     st.markdown("---")
     
     # Советы по использованию